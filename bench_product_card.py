@@ -0,0 +1,39 @@
+"""对比 ProductCardItem 逐个构造/序列化与批量构造/序列化的速度"""
+
+from timeit import repeat
+
+from emag_crawler.models import ProductCardItem, dump_product_cards, load_product_cards
+
+PAGE_SIZE = 60  # 一个类目页的产品卡片数
+ROUNDS = 200
+
+raw_cards = [
+    {
+        'pnk': f'D{i:05d}BBM',
+        'product_id': str(100000 + i),
+        'category': 'bare-transversale',
+        'source_url': 'https://www.emag.ro/bare-transversale/c',
+        'rank': i + 1,
+        'is_top_favorite': i % 7 == 0,
+        'price': 99.99 + i,
+        'rating': 4.5,
+        'review_count': 10 + i,
+        'cart_added': True,
+        'max_qty': 5,
+    }
+    for i in range(PAGE_SIZE)
+]
+items = [ProductCardItem(**r) for r in raw_cards]
+
+
+def bench(name: str, func) -> None:
+    seconds = min(repeat(func, number=ROUNDS, repeat=5))
+    print(f'{name:<32} {PAGE_SIZE * ROUNDS / seconds:>12,.0f} items/s')
+
+
+if __name__ == '__main__':
+    bench('ProductCardItem(**raw)', lambda: [ProductCardItem(**r) for r in raw_cards])
+    bench('load_product_cards', lambda: load_product_cards(raw_cards))
+    bench('load_product_cards(trusted)', lambda: load_product_cards(raw_cards, trusted=True))
+    bench('model_dump()', lambda: [i.model_dump() for i in items])
+    bench('dump_product_cards', lambda: dump_product_cards(items))
@@ -0,0 +1,282 @@
+"""跨上下文、跨运行共享的静态资源缓存"""
+
+from __future__ import annotations
+
+import asyncio
+from hashlib import sha256
+from json import dumps, loads
+from os import replace
+from pathlib import Path
+from re import compile as re_compile, search as re_search
+from threading import RLock
+from time import time
+from typing import TYPE_CHECKING
+from uuid import uuid4
+
+from scraper_utils.exceptions.browser_exception import PlaywrightError
+
+from .logger import logger
+from .storage import connect_sqlite, data_dir, transaction
+
+if TYPE_CHECKING:
+    from typing import Optional, Pattern
+
+    from playwright.async_api import Route
+
+    from .storage import StrOrPath
+    from .utils import BrowserContextOrPage
+
+
+# eMAG 的 JS、CSS 都在 CDN 上，文件名或查询参数带版本号
+STATIC_URL_PATTERN: Pattern[str] = re_compile(
+    r'^https://[^/]*emagst\.akamaized\.net/[^?#]+\.(?:js|css)(?:\?.*)?$'
+)
+
+# 不保存到缓存中的响应头
+_SKIPPED_HEADERS = frozenset(
+    (
+        'set-cookie',
+        'connection',
+        'keep-alive',
+        'transfer-encoding',
+        'content-encoding',
+        'content-length',
+        'date',
+        'age',
+    )
+)
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entry (
+    url TEXT PRIMARY KEY,
+    digest TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    headers TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    last_access REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS entry_digest ON entry (digest);
+CREATE INDEX IF NOT EXISTS entry_last_access ON entry (last_access);
+CREATE TABLE IF NOT EXISTS stat (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+) WITHOUT ROWID;
+'''
+
+
+def freshness_lifetime(headers: dict[str, str]) -> Optional[float]:
+    """
+    根据 Cache-Control 计算响应可以缓存多少秒，不可缓存时返回 None
+
+    只认明确的 max-age / s-maxage / immutable，没有这些指令的响应不缓存
+    """
+    cache_control = headers.get('cache-control', '').lower()
+    if re_search(r'no-store|no-cache|private', cache_control):
+        return None
+    if 'immutable' in cache_control:
+        return 365 * 24 * 3600.0
+    m = re_search(r's-maxage=(\d+)', cache_control) or re_search(r'max-age=(\d+)', cache_control)
+    if m is None or int(m.group(1)) <= 0:
+        return None
+    return float(m.group(1))
+
+
+class AssetCache:
+    """
+    以内容哈希寻址的磁盘缓存，拦截 STATIC_URL_PATTERN 的请求
+
+    ---
+
+    1. 未过期的条目直接从磁盘返回，不发出请求
+    2. 过期但有 ETag / Last-Modified 的条目发条件请求，304 时续期并从磁盘返回
+    3. 只缓存 Cache-Control 允许缓存的 200 响应；内容相同的资源只保存一份
+    4. 总大小超过 `max_bytes` 时按最近访问时间（LRU）淘汰
+    5. 多个上下文、多个进程可以共享同一个目录
+    6. 读写磁盘和 SQLite 都在线程中执行，不阻塞事件循环；总大小随写入、删除更新，淘汰时不用重新统计
+    """
+
+    def __init__(self, root: StrOrPath = data_dir / 'asset_cache', max_bytes: int = 512 * 1024 * 1024):
+        self.root = Path(root)
+        self.blob_dir = self.root / 'blobs'
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+        self.conn = connect_sqlite(self.root / 'index.db')
+        self.conn.executescript(_SCHEMA)
+        # 旧版本的索引没有记录总大小，统计一次
+        self.conn.execute(
+            'INSERT OR IGNORE INTO stat (name, value) '
+            "SELECT 'total_bytes', COALESCE(SUM(size), 0) FROM (SELECT DISTINCT digest, size FROM entry)"
+        )
+        self._lock = RLock()  # 路由在多个线程中处理，同一个连接上的读写要串行
+
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0  # 条件请求返回 304 的次数
+        self.bytes_saved = 0  # 从缓存返回、省下的下载字节数
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def report(self) -> str:
+        return (
+            f'静态资源缓存命中率 {self.hit_ratio:.1%} ({self.hits}/{self.hits + self.misses})，'
+            f'条件请求 304 {self.revalidated} 次，节省 {self.bytes_saved / 1024 / 1024:.1f}MB'
+        )
+
+    def close(self) -> None:
+        logger.info(self.report())
+        self.conn.close()
+
+    def _blob_path(self, digest: str) -> Path:
+        return self.blob_dir / digest[:2] / digest
+
+    @property
+    def total_bytes(self) -> int:
+        """缓存中全部内容的总大小（字节），内容相同的资源只计一次"""
+        with self._lock:
+            return self.conn.execute("SELECT value FROM stat WHERE name='total_bytes'").fetchone()[0]
+
+    def _add_total(self, delta: int) -> None:
+        self.conn.execute("UPDATE stat SET value=value + ? WHERE name='total_bytes'", (delta,))
+
+    def _lookup(self, url: str) -> Optional[tuple[str, dict[str, str], float]]:
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT digest, headers, expires_at FROM entry WHERE url=?', (url,)
+            ).fetchone()
+        if row is None:
+            return None
+        digest, headers, expires_at = row
+        if not self._blob_path(digest).exists():
+            return None
+        return digest, loads(headers), expires_at
+
+    def _touch(self, url: str, expires_at: Optional[float] = None) -> None:
+        with self._lock:
+            if expires_at is None:
+                self.conn.execute('UPDATE entry SET last_access=? WHERE url=?', (time(), url))
+            else:
+                self.conn.execute(
+                    'UPDATE entry SET last_access=?, expires_at=? WHERE url=?', (time(), expires_at, url)
+                )
+
+    def _read(self, url: str, digest: str, expires_at: Optional[float] = None) -> bytes:
+        """读取命中的内容并更新访问时间"""
+        body = self._blob_path(digest).read_bytes()
+        self._touch(url, expires_at)
+        return body
+
+    def _store(self, url: str, headers: dict[str, str], body: bytes, lifetime: float) -> None:
+        digest = sha256(body).hexdigest()
+        path = self._blob_path(digest)
+        if not path.exists():
+            path.parent.mkdir(exist_ok=True)
+            # 先写临时文件再改名，其他进程不会读到写了一半的文件
+            temp = path.with_name(f'{digest}.{uuid4().hex}.tmp')
+            temp.write_bytes(body)
+            replace(temp, path)
+
+        kept = {k.lower(): v for k, v in headers.items() if k.lower() not in _SKIPPED_HEADERS}
+        now = time()
+        with self._lock, transaction(self.conn):
+            old = self.conn.execute('SELECT digest, size FROM entry WHERE url=?', (url,)).fetchone()
+            if self.conn.execute('SELECT 1 FROM entry WHERE digest=? LIMIT 1', (digest,)).fetchone() is None:
+                self._add_total(len(body))
+            self.conn.execute(
+                'INSERT OR REPLACE INTO entry (url, digest, size, headers, expires_at, last_access) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (url, digest, len(body), dumps(kept), now + lifetime, now),
+            )
+            # 链接的内容变化后，旧内容不再计入总大小，要一起删除
+            if old is not None and old[0] != digest:
+                self._release_blob(*old)
+        self.evict()
+
+    def _release_blob(self, digest: str, size: int) -> bool:
+        """没有链接再引用该内容时删除文件并从总大小中减去，返回是否删除"""
+        if self.conn.execute('SELECT 1 FROM entry WHERE digest=? LIMIT 1', (digest,)).fetchone() is not None:
+            return False
+        self._add_total(-size)
+        self._blob_path(digest).unlink(missing_ok=True)
+        return True
+
+    def evict(self) -> int:
+        """按 LRU 淘汰条目直到总大小不超过上限，返回释放的字节数"""
+        if self.total_bytes <= self.max_bytes:
+            return 0
+
+        freed = 0
+        with self._lock, transaction(self.conn):
+            # 其他进程可能已经淘汰过，在事务内重新读取
+            total = self.total_bytes
+            for url, digest, size in self.conn.execute(
+                'SELECT url, digest, size FROM entry ORDER BY last_access'
+            ).fetchall():
+                if total - freed <= self.max_bytes:
+                    break
+                self.conn.execute('DELETE FROM entry WHERE url=?', (url,))
+                # 没有其他链接引用同一内容时才删除文件
+                if self._release_blob(digest, size):
+                    freed += size
+        return freed
+
+    async def handle_route(self, route: Route) -> None:
+        request = route.request
+        if request.method != 'GET':
+            await route.fallback()
+            return
+
+        url = request.url
+        cached = await asyncio.to_thread(self._lookup, url)
+
+        # 未过期，直接从磁盘返回
+        if cached is not None and cached[2] > time():
+            digest, headers, _ = cached
+            body = await asyncio.to_thread(self._read, url, digest)
+            self.hits += 1
+            self.bytes_saved += len(body)
+            await route.fulfill(status=200, headers=headers, body=body)
+            return
+
+        # 已过期，带上验证器发条件请求
+        conditional: dict[str, str] = dict()
+        if cached is not None:
+            etag = cached[1].get('etag')
+            last_modified = cached[1].get('last-modified')
+            if etag:
+                conditional['If-None-Match'] = etag
+            if last_modified:
+                conditional['If-Modified-Since'] = last_modified
+
+        try:
+            response = await route.fetch(headers={**request.headers, **conditional} if conditional else None)
+        except PlaywrightError as pe:
+            logger.debug(f'获取静态资源 "{url}" 时出错\n{pe}')
+            await route.abort()
+            return
+
+        if response.status == 304 and cached is not None:
+            digest, headers, _ = cached
+            lifetime = freshness_lifetime(response.headers) or freshness_lifetime(headers) or 0
+            body = await asyncio.to_thread(self._read, url, digest, time() + lifetime)
+            self.hits += 1
+            self.revalidated += 1
+            self.bytes_saved += len(body)
+            await route.fulfill(status=200, headers=headers, body=body)
+            return
+
+        self.misses += 1
+        body = await response.body()
+        await route.fulfill(response=response, body=body)
+        # 先返回给页面再写入缓存
+        if response.status == 200:
+            lifetime = freshness_lifetime(response.headers)
+            if lifetime is not None:
+                await asyncio.to_thread(self._store, url, response.headers, body, lifetime)
+
+    async def install(self, context_page: BrowserContextOrPage) -> None:
+        """为上下文或页面启用静态资源缓存"""
+        await context_page.route(STATIC_URL_PATTERN, self.handle_route)
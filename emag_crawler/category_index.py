@@ -0,0 +1,235 @@
+"""类目元数据索引，用于规划爬取"""
+
+from __future__ import annotations
+
+import asyncio
+from time import time
+from typing import TYPE_CHECKING, Optional
+
+from pydantic import BaseModel, Field
+from scraper_utils.exceptions.browser_exception import PlaywrightError
+
+from .exceptions import CaptchaError
+from .handlers.category_page import count_products
+from .logger import logger
+from .storage import connect_sqlite, data_dir, transaction
+from .utils import build_category_url, count_crawlable_pages
+
+if TYPE_CHECKING:
+    from typing import Iterable, Literal
+
+    from playwright.async_api import BrowserContext
+
+    from .storage import StrOrPath
+
+    type CrawlStatus = Literal['complete', 'captcha', 'error']
+
+
+class CategoryMeta(BaseModel):
+    """一个类目的元数据"""
+
+    category: str = Field(..., description='类目')
+    total_product_count: Optional[int] = Field(None, ge=0, description='产品总数')
+    crawlable_pages: Optional[int] = Field(None, ge=0, description='最多能爬取的页数')
+    counted_at: Optional[float] = Field(None, description='最近一次获取产品总数的时间戳')
+    crawled_at: Optional[float] = Field(None, description='最近一次完整爬取的时间戳')
+    crawl_count: int = Field(0, ge=0, description='爬取次数')
+    avg_duration: Optional[float] = Field(None, ge=0, description='完整爬取的平均耗时（秒）')
+    captcha_count: int = Field(0, ge=0, description='爬取时触发验证的次数')
+
+    @property
+    def captcha_rate(self) -> float:
+        """触发验证的爬取次数占比"""
+        return self.captcha_count / self.crawl_count if self.crawl_count else 0.0
+
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS category (
+    category TEXT PRIMARY KEY,
+    total_product_count INTEGER,
+    crawlable_pages INTEGER,
+    counted_at REAL,
+    crawled_at REAL,
+    crawl_count INTEGER NOT NULL DEFAULT 0,
+    avg_duration REAL,
+    captcha_count INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+'''
+
+_COLUMNS = tuple(CategoryMeta.model_fields)
+
+
+class CategoryIndex:
+    """
+    持久化的类目元数据索引
+
+    每次爬取都会更新产品总数、可爬页数、爬取耗时和验证次数，规划时可以在启动浏览器前估算成本、排序、跳过空类目
+    """
+
+    def __init__(self, file: StrOrPath = data_dir / 'category_index.db'):
+        self.conn = connect_sqlite(file)
+        self.conn.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self) -> CategoryIndex:
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def record_count(self, category: str, total_product_count: int) -> None:
+        """记录类目的产品总数"""
+        self.conn.execute(
+            'INSERT INTO category (category, total_product_count, crawlable_pages, counted_at) '
+            'VALUES (?, ?, ?, ?) ON CONFLICT (category) DO UPDATE SET '
+            'total_product_count=excluded.total_product_count, crawlable_pages=excluded.crawlable_pages, '
+            'counted_at=excluded.counted_at',
+            (category, total_product_count, count_crawlable_pages(total_product_count), time()),
+        )
+
+    def record_crawl(
+        self,
+        category: str,
+        duration: float,
+        status: CrawlStatus,
+        total_product_count: Optional[int] = None,
+    ) -> None:
+        """
+        记录一次爬取
+
+        - complete：完整爬取，更新爬取时间，耗时在完整爬取之间累计平均
+        - captcha：触发验证，计入爬取次数和验证次数，中途结束的耗时不参与平均
+        - error：出错（如网络错误、超时），不计入爬取次数，只记录产品总数
+        """
+        with transaction(self.conn):
+            if total_product_count is not None:
+                self.record_count(category, total_product_count)
+            if status == 'error':
+                return
+            captcha = status == 'captcha'
+            self.conn.execute(
+                'INSERT INTO category (category, crawled_at, crawl_count, avg_duration, captcha_count) '
+                'VALUES (?, ?, 1, ?, ?) ON CONFLICT (category) DO UPDATE SET '
+                'crawled_at=COALESCE(excluded.crawled_at, crawled_at), '
+                'avg_duration=COALESCE((COALESCE(avg_duration, 0) * (crawl_count - captcha_count) '
+                '+ excluded.avg_duration) / (crawl_count - captcha_count + 1), avg_duration), '
+                'crawl_count=crawl_count + 1, '
+                'captcha_count=captcha_count + excluded.captcha_count',
+                (category, None if captcha else time(), None if captcha else duration, int(captcha)),
+            )
+
+    def get(self, category: str) -> Optional[CategoryMeta]:
+        row = self.conn.execute(
+            f'SELECT {", ".join(_COLUMNS)} FROM category WHERE category=?', (category,)
+        ).fetchone()
+        return None if row is None else CategoryMeta(**dict(zip(_COLUMNS, row)))
+
+    def query(
+        self,
+        categories: Optional[Iterable[str]] = None,
+        min_products: Optional[int] = None,
+        max_products: Optional[int] = None,
+        stale_before: Optional[float] = None,
+        order_by: Literal[
+            'total_product_count', 'avg_duration', 'crawled_at', 'captcha_count'
+        ] = 'crawled_at',
+        descending: bool = False,
+        limit: Optional[int] = None,
+    ) -> list[CategoryMeta]:
+        """
+        按条件查询类目
+
+        - `categories` 限定在这些类目中查询
+        - `min_products`、`max_products` 产品总数的范围
+        - `stale_before` 只返回在这个时间戳之前（或从未）完整爬取过的类目
+        """
+        if order_by not in _COLUMNS:
+            raise ValueError(f'不能按 "{order_by}" 排序')
+
+        where: list[str] = list()
+        params: list = list()
+        if categories is not None:
+            categories = list(categories)
+            where.append(f'category IN ({", ".join("?" * len(categories))})')
+            params.extend(categories)
+        if min_products is not None:
+            where.append('total_product_count >= ?')
+            params.append(min_products)
+        if max_products is not None:
+            where.append('total_product_count <= ?')
+            params.append(max_products)
+        if stale_before is not None:
+            where.append('(crawled_at IS NULL OR crawled_at < ?)')
+            params.append(stale_before)
+
+        sql = f'SELECT {", ".join(_COLUMNS)} FROM category'
+        if where:
+            sql += f' WHERE {" AND ".join(where)}'
+        sql += f' ORDER BY {order_by} IS NULL, {order_by} {"DESC" if descending else "ASC"}'
+        if limit is not None:
+            sql += f' LIMIT {int(limit)}'
+
+        return [CategoryMeta(**dict(zip(_COLUMNS, row))) for row in self.conn.execute(sql, params)]
+
+    def estimate_duration(self, category: str) -> Optional[float]:
+        """
+        估算爬取一个类目的耗时（秒）
+
+        有历史记录时用该类目的平均耗时，否则按全部类目的平均每页耗时乘以可爬页数估算
+        """
+        meta = self.get(category)
+        if meta is None:
+            return None
+        if meta.avg_duration is not None:
+            return meta.avg_duration
+        if meta.crawlable_pages is None:
+            return None
+
+        (per_page,) = self.conn.execute(
+            'SELECT SUM(avg_duration) / SUM(crawlable_pages) FROM category '
+            'WHERE avg_duration IS NOT NULL AND crawlable_pages > 0'
+        ).fetchone()
+        return None if per_page is None else per_page * meta.crawlable_pages
+
+
+async def refresh_counts(
+    context: BrowserContext,
+    categories: Iterable[str],
+    index: CategoryIndex,
+    concurrency: int = 4,
+) -> dict[str, Optional[int]]:
+    """
+    批量刷新类目的产品总数，不执行加购阶段
+
+    只等到 domcontentloaded 就读取产品总数，遇到验证时停止刷新，返回各类目的产品总数（失败为 None）
+    """
+    result: dict[str, Optional[int]] = dict()
+    semaphore = asyncio.Semaphore(concurrency)
+    captcha = asyncio.Event()
+
+    async def refresh(category: str) -> None:
+        async with semaphore:
+            if captcha.is_set():
+                return
+            category_logger = logger.bind(category=category)
+            try:
+                count = await count_products(context, build_category_url(category), category_logger)
+            except CaptchaError as ce:
+                category_logger.error(ce)
+                captcha.set()
+                return
+            except (PlaywrightError, ValueError) as e:
+                category_logger.error(f'刷新产品总数时出错\n{e}')
+                return
+
+            index.record_count(category, count)
+            result[category] = count
+            category_logger.debug(f'产品总数 {count}')
+
+    categories = list(categories)
+    await asyncio.gather(*(refresh(c) for c in categories))
+    if captcha.is_set():
+        logger.warning('刷新产品总数时触发验证，已停止')
+    return {c: result.get(c) for c in categories}
@@ -0,0 +1,245 @@
+"""浏览器上下文的生命周期管理"""
+
+from __future__ import annotations
+
+import asyncio
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING
+
+from scraper_utils.exceptions.browser_exception import PlaywrightError
+
+from .logger import logger
+from .session import apply_storage_state
+from .utils import CART_PAGE_URL
+
+if TYPE_CHECKING:
+    from typing import Any, AsyncIterator, Optional
+
+    from playwright.async_api import BrowserContext, Page, Request
+    from scraper_utils.utils.browser_util import BrowserManager
+
+    from .asset_cache import AssetCache
+    from .profiles import BrowserProfile
+    from .proxies import ProxyEndpoint, ProxyPool
+    from .session import SessionStore, StorageState
+
+
+async def page_js_heap(page: Page) -> int:
+    """页面 JS 堆的已用字节数，页面已关闭或无法采样时返回 0"""
+    if page.is_closed():
+        return 0
+    try:
+        cdp = await page.context.new_cdp_session(page)
+        try:
+            usage = await cdp.send('Runtime.getHeapUsage')
+        finally:
+            await cdp.detach()
+    except PlaywrightError:
+        return 0
+    return int(usage['usedSize'])
+
+
+class ManagedContext:
+    """
+    会定期回收的 BrowserContext
+
+    ---
+
+    1. 记录上下文打开过的页面数、购物车页访问次数，每隔 `sample_interval` 秒采样各页面的 JS 堆内存
+    2. 达到 `max_pages`、`max_cart_cycles` 或 `max_memory_mb` 任一上限后，等当前的使用者全部结束，
+       用相同的 `context_kwargs`（隐身、abort_res_types 等）重建上下文，并带上旧上下文的 storage_state（cookies 和 localStorage）
+    3. 通过 `async with managed.use() as context` 使用，回收期间新的使用者会等待
+    4. 传入 `profile` 时，新建的上下文都会应用该配置（视口、关闭动画等），每次采样内存时同时输出标签页的资源统计
+    5. 传入 `session_store` 时，第一个上下文从 `session_slot`（默认与 `proxy_key` 相同）槽位恢复会话，close 时保存回槽位；
+       report_captcha 后回收的上下文不带旧的 cookies，仍是遇到验证的上下文在 close 时删除槽位而不保存
+    6. 传入 `proxy_pool` 时，每个新建的上下文都以 `proxy_key` 从代理池领取代理；
+       report_captcha 后代理进入冷却，下次使用时回收上下文并换用其他代理；
+       没有可用代理时最多等待 `proxy_timeout` 秒，不会不带代理直接连接
+    """
+
+    def __init__(
+        self,
+        bm: BrowserManager,
+        context_kwargs: Optional[dict[str, Any]] = None,
+        max_pages: Optional[int] = 200,
+        max_cart_cycles: Optional[int] = 20,
+        max_memory_mb: Optional[float] = 1024,
+        sample_interval: float = 30,
+        asset_cache: Optional[AssetCache] = None,
+        profile: Optional[BrowserProfile] = None,
+        session_store: Optional[SessionStore] = None,
+        session_slot: Optional[str] = None,
+        proxy_pool: Optional[ProxyPool] = None,
+        proxy_key: str = 'default',
+        proxy_timeout: Optional[float] = None,
+    ):
+        self.bm = bm
+        self.context_kwargs = context_kwargs or dict()
+        self.max_pages = max_pages
+        self.max_cart_cycles = max_cart_cycles
+        self.max_memory_mb = max_memory_mb
+        self.sample_interval = sample_interval  # 内存采样间隔（秒）
+        self.asset_cache = asset_cache  # 新建的上下文都会启用该静态资源缓存
+        self.profile = profile
+        self.session_store = session_store
+        self.session_slot = session_slot or proxy_key  # 每个并发的上下文用不同的槽位
+        self.proxy_pool = proxy_pool
+        self.proxy_key = proxy_key
+        self.proxy_timeout = proxy_timeout  # 没有可用代理时最多等待多少秒，None 表示一直等到冷却结束
+        self.proxy: Optional[ProxyEndpoint] = None  # 当前上下文使用的代理
+
+        self.context: Optional[BrowserContext] = None
+        self.pages_opened = 0  # 当前上下文打开过的页面数
+        self.cart_cycles = 0  # 当前上下文访问购物车页的次数
+        self.memory_mb = 0.0  # 最近一次采样的内存
+        self.peak_memory_mb = 0.0  # 当前上下文采样到的内存峰值
+        self.recycles = 0  # 已回收的次数
+        self.captcha_seen = False  # 当前上下文是否遇到过验证
+
+        self._users = 0
+        self._recycling = False
+        self._cond = asyncio.Condition()
+        self._sampler: Optional[asyncio.Task] = None
+
+    def _on_page(self, _: Page) -> None:
+        self.pages_opened += 1
+
+    def _on_request(self, request: Request) -> None:
+        if request.is_navigation_request() and request.url.startswith(CART_PAGE_URL):
+            self.cart_cycles += 1
+
+    async def _open(self, state: Optional[StorageState] = None) -> BrowserContext:
+        context_kwargs = self.context_kwargs
+        if self.proxy_pool is not None:
+            # 没有可用代理时等待冷却结束，不能不带代理直接连接
+            self.proxy = await self.proxy_pool.wait_acquire(self.proxy_key, self.proxy_timeout)
+            context_kwargs = {**context_kwargs, 'proxy': self.proxy.playwright_proxy()}
+        context = await self.bm.new_context(**context_kwargs)
+        if state is not None:
+            await apply_storage_state(context, state)
+        elif self.session_store is not None:
+            await self.session_store.restore(context, self.session_slot)
+        if self.asset_cache is not None:
+            await self.asset_cache.install(context)
+        if self.profile is not None:
+            await self.profile.apply(context)
+        context.on('page', self._on_page)
+        context.on('request', self._on_request)
+        self.pages_opened = 0
+        self.cart_cycles = 0
+        self.memory_mb = 0.0
+        self.peak_memory_mb = 0.0
+        return context
+
+    async def _sample_loop(self) -> None:
+        from .profiles import report_tabs  # profiles 依赖本模块的 page_js_heap
+
+        # 页面关闭后 JS 堆就释放了，所以要在使用期间定期采样，记录峰值
+        while True:
+            await asyncio.sleep(self.sample_interval)
+            await self.sample_memory()
+            # 用于比较不同配置下标签页的内存和加载耗时
+            if self.profile is not None and self.context is not None:
+                await report_tabs([self.context])
+
+    async def sample_memory(self) -> float:
+        """采样当前上下文所有页面的 JS 堆内存（MB）"""
+        if self.context is None:
+            return 0.0
+        heaps = await asyncio.gather(*(page_js_heap(p) for p in self.context.pages))
+        self.memory_mb = sum(heaps) / 1024 / 1024
+        self.peak_memory_mb = max(self.peak_memory_mb, self.memory_mb)
+        return self.memory_mb
+
+    def report_success(self) -> None:
+        """当前上下文完成了一个类目，计入代理的成功次数"""
+        if self.proxy_pool is not None and self.proxy is not None:
+            self.proxy_pool.report_success(self.proxy)
+
+    def report_captcha(self) -> None:
+        """当前上下文遇到了验证，它的会话不再保存，代理进入冷却"""
+        self.captcha_seen = True
+        if self.proxy_pool is not None and self.proxy is not None:
+            self.proxy_pool.report_captcha(self.proxy)
+
+    def _recycle_reason(self) -> Optional[str]:
+        """需要回收时返回原因"""
+        if self.captcha_seen:
+            return '遇到验证'
+        # 只检查代理是否可用，换用哪个代理在 _open 中领取
+        if self.proxy_pool is not None and self.proxy is not None:
+            if self.proxy not in self.proxy_pool.available():
+                return f'代理 {self.proxy.server} 已不可用'
+        if self.max_pages is not None and self.pages_opened >= self.max_pages:
+            return f'已打开 {self.pages_opened} 个页面'
+        if self.max_cart_cycles is not None and self.cart_cycles >= self.max_cart_cycles:
+            return f'已访问 {self.cart_cycles} 次购物车页'
+        if self.max_memory_mb is not None and self.peak_memory_mb >= self.max_memory_mb:
+            return f'内存峰值 {self.peak_memory_mb:.0f}MB'
+        return None
+
+    async def _recycle(self, reason: str) -> None:
+        old = self.context
+        assert old is not None
+        logger.info(f'回收浏览器上下文：{reason}')
+
+        # 遇到过验证的 cookies 已被标记，不带到新的上下文，也不再从槽位恢复
+        state = None
+        if not self.captcha_seen:
+            try:
+                state = await old.storage_state()
+            except PlaywrightError as pe:
+                logger.warning(f'读取旧上下文的 storage_state 时出错\n{pe}')
+        elif self.session_store is not None:
+            self.session_store.discard(self.session_slot)
+        await old.close()
+
+        self.context = await self._open(state)
+        self.captcha_seen = False
+        self.recycles += 1
+
+    @asynccontextmanager
+    async def use(self) -> AsyncIterator[BrowserContext]:
+        """使用上下文，进入时如果已达上限就等其他使用者结束后先回收"""
+        async with self._cond:
+            await self._cond.wait_for(lambda: not self._recycling)
+
+            if self.context is None:
+                self.context = await self._open()
+                if self.max_memory_mb is not None:
+                    self._sampler = asyncio.create_task(self._sample_loop())
+            else:
+                reason = self._recycle_reason()
+                if reason is not None:
+                    # 阻止新的使用者进入，等已有的使用者全部结束后回收
+                    self._recycling = True
+                    try:
+                        await self._cond.wait_for(lambda: self._users == 0)
+                        await self._recycle(reason)
+                    finally:
+                        self._recycling = False
+                        self._cond.notify_all()
+
+            self._users += 1
+            context = self.context
+
+        try:
+            yield context
+        finally:
+            async with self._cond:
+                self._users -= 1
+                self._cond.notify_all()
+
+    async def close(self) -> None:
+        if self._sampler is not None:
+            self._sampler.cancel()
+            self._sampler = None
+        if self.context is not None:
+            if self.session_store is not None:
+                if self.captcha_seen:
+                    logger.info(f'上下文遇到过验证，删除会话槽位 "{self.session_slot}"')
+                    self.session_store.discard(self.session_slot)
+                else:
+                    await self.session_store.persist(self.context, self.session_slot)
+            await self.context.close()
+            self.context = None
@@ -30,3 +30,63 @@ class ParsePNKError(Exception):
 
     def __str__(self):
         return self.origin_str
+
+
+class LeaseLostError(Exception):
+    """任务租约已失效（超时被收回或已被其他实例领取）时的异常"""
+
+    def __init__(self, category: str, message: str, *args: object):
+        super().__init__(*args)
+        self.category = category
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+class CartFullError(Exception):
+    """购物车已满、网站拒绝继续加购时的异常"""
+
+    def __init__(self, url: str, message: str, *args: object):
+        super().__init__(*args)
+        self.url = unquote(url)
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+class RetryableError(Exception):
+    """操作失败但可以重试时的异常，由 RetryPolicy 捕获后重试"""
+
+    def __init__(self, message: str, *args: object):
+        super().__init__(*args)
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+class RetryExhaustedError(Exception):
+    """操作达到最大尝试次数或超过期限后仍然失败时的异常"""
+
+    def __init__(self, operation: str, attempts: int, message: str, *args: object):
+        super().__init__(*args)
+        self.operation = operation
+        self.attempts = attempts
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+class NoProxyAvailableError(Exception):
+    """代理池中没有可用的代理（全部被移除或等待冷却超时）时的异常"""
+
+    def __init__(self, key: str, message: str, *args: object):
+        super().__init__(*args)
+        self.key = key
+        self.message = message
+
+    def __str__(self):
+        return self.message
@@ -0,0 +1,177 @@
+"""按筛选条件把大类目拆分成多个切片，突破每个类目最多爬 5 页的限制"""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Optional
+
+from pydantic import BaseModel, Field
+
+from .logger import logger
+from .utils import MAX_CRAWLABLE_PAGE, PAGE_SIZE, build_category_url, count_crawlable_pages
+
+if TYPE_CHECKING:
+    from typing import Awaitable, Callable, Iterable
+
+    from .models import ProductCardItem
+
+    # 传入类目页链接，返回该链接的产品总数
+    type CountProbe = Callable[[str], Awaitable[int]]
+
+
+SLICE_CAPACITY = PAGE_SIZE * MAX_CRAWLABLE_PAGE  # 一个切片最多能爬到的产品数
+_MAX_PRICE_DOUBLINGS = 10  # 价格上限最多翻倍的次数
+
+
+class FacetSlice(BaseModel):
+    """类目的一个筛选切片"""
+
+    category: str = Field(..., description='类目')
+    brand: Optional[str] = Field(None, description='品牌')
+    price_range: Optional[tuple[int, int]] = Field(None, description='价格区间')
+    sort: Optional[str] = Field(None, description='排序')
+    total_product_count: int = Field(..., ge=0, description='切片内的产品总数（合并后的切片为上限估计）')
+
+    @property
+    def pages(self) -> int:
+        """切片需要爬取的页数"""
+        return count_crawlable_pages(self.total_product_count)
+
+    def url(self, page: int = 1) -> str:
+        return build_category_url(self.category, page, self.brand, self.price_range, self.sort)
+
+
+class FacetPlanner:
+    """
+    把产品数超过 SLICE_CAPACITY 的类目拆分成每个都不超过上限的切片
+
+    ---
+
+    1. 先按 `brands`（如果有）拆分，再对仍然超限的切片按价格区间二分
+       二分的上限从 `max_price` 开始，[0, 上限] 的产品数少于切片的产品总数时上限翻倍，不会漏掉更贵的产品
+    2. 价格区间已经无法再分（不超过 `min_price_span`）时，用升序、降序两种排序各爬 5 页，尽量覆盖
+    3. 二分后相邻的小切片会合并，减少需要爬取的页数
+    4. 每个切片的产品总数通过 `probe` 获取，同一个链接只会探测一次
+    """
+
+    def __init__(self, probe: CountProbe, max_price: int = 100_000, min_price_span: int = 1):
+        self.probe = probe
+        self.max_price = max_price
+        self.min_price_span = min_price_span
+        self._counts: dict[str, int] = dict()
+
+    async def _count(self, facet: FacetSlice) -> int:
+        url = facet.url()
+        if url not in self._counts:
+            self._counts[url] = await self.probe(url)
+        return self._counts[url]
+
+    async def _split_price(
+        self, category: str, brand: Optional[str], low: int, high: int
+    ) -> list[FacetSlice]:
+        facet = FacetSlice(category=category, brand=brand, price_range=(low, high), total_product_count=0)
+        count = await self._count(facet)
+        if count == 0:
+            return []
+        facet.total_product_count = count
+        if count <= SLICE_CAPACITY:
+            return [facet]
+
+        if high - low <= self.min_price_span:
+            logger.warning(
+                f'"{facet.url()}" 有 {count} 个产品，价格区间无法再拆分，'
+                f'按价格升序、降序最多覆盖 {2 * SLICE_CAPACITY} 个'
+            )
+            return [
+                facet.model_copy(update={'sort': 'priceasc', 'total_product_count': SLICE_CAPACITY}),
+                facet.model_copy(update={'sort': 'pricedesc', 'total_product_count': SLICE_CAPACITY}),
+            ]
+
+        # 区间端点可能是闭区间，两个子区间共用中点，重复的产品在合并结果时按 pnk 去重
+        mid = (low + high) // 2
+        return await self._split_price(category, brand, low, mid) + await self._split_price(
+            category, brand, mid, high
+        )
+
+    @staticmethod
+    def _merge_adjacent(slices: list[FacetSlice]) -> list[FacetSlice]:
+        """合并同一品牌下相邻的价格切片，合并后的产品数不超过上限"""
+        merged: list[FacetSlice] = list()
+        for s in slices:
+            last = merged[-1] if merged else None
+            if (
+                last is not None
+                and last.sort is None
+                and s.sort is None
+                and last.brand == s.brand
+                and last.price_range is not None
+                and s.price_range is not None
+                and last.price_range[1] == s.price_range[0]
+                and last.total_product_count + s.total_product_count <= SLICE_CAPACITY
+            ):
+                merged[-1] = last.model_copy(
+                    update={
+                        'price_range': (last.price_range[0], s.price_range[1]),
+                        'total_product_count': last.total_product_count + s.total_product_count,
+                    }
+                )
+            else:
+                merged.append(s)
+        return merged
+
+    async def _plan_brand(self, category: str, brand: Optional[str]) -> list[FacetSlice]:
+        facet = FacetSlice(category=category, brand=brand, total_product_count=0)
+        facet.total_product_count = await self._count(facet)
+        if facet.total_product_count <= SLICE_CAPACITY:
+            return [facet] if facet.total_product_count > 0 else []
+        high = await self._price_ceiling(category, brand, facet.total_product_count)
+        return self._merge_adjacent(await self._split_price(category, brand, 0, high))
+
+    async def _price_ceiling(self, category: str, brand: Optional[str], total: int) -> int:
+        """从 max_price 开始翻倍，直到价格区间 [0, 上限] 覆盖切片的全部 `total` 个产品"""
+        high = self.max_price
+        for _ in range(_MAX_PRICE_DOUBLINGS):
+            facet = FacetSlice(category=category, brand=brand, price_range=(0, high), total_product_count=0)
+            if await self._count(facet) >= total:
+                return high
+            high *= 2
+        logger.warning(f'"{category}" 价格上限翻倍到 {high} 后仍不能覆盖全部 {total} 个产品')
+        return high
+
+    async def plan(self, category: str, brands: Optional[Iterable[str]] = None) -> list[FacetSlice]:
+        """规划类目的切片，产品数不超过上限的类目只有一个不带筛选条件的切片"""
+        root = FacetSlice(category=category, total_product_count=0)
+        root.total_product_count = await self._count(root)
+        if root.total_product_count <= SLICE_CAPACITY:
+            return [root]
+
+        slices: list[FacetSlice] = list()
+        if brands:
+            for brand in brands:
+                slices.extend(await self._plan_brand(category, brand))
+            covered = sum(s.total_product_count for s in slices if s.sort is None)
+            if covered < root.total_product_count:
+                logger.warning(
+                    f'"{category}" 按品牌拆分后只覆盖了约 {covered}/{root.total_product_count} 个产品，'
+                    '改为按价格拆分'
+                )
+                slices = await self._plan_brand(category, None)
+        else:
+            slices = await self._plan_brand(category, None)
+
+        logger.info(
+            f'"{category}" 共 {root.total_product_count} 个产品，拆分为 {len(slices)} 个切片、'
+            f'{sum(s.pages for s in slices)} 页，探测了 {len(self._counts)} 次'
+        )
+        return slices
+
+
+def merge_slice_results(results: Iterable[Iterable[ProductCardItem]]) -> list[ProductCardItem]:
+    """合并各切片的爬取结果，同一个 pnk 只保留第一次出现的"""
+    seen: set[str] = set()
+    merged: list[ProductCardItem] = list()
+    for items in results:
+        for item in items:
+            if item.pnk not in seen:
+                seen.add(item.pnk)
+                merged.append(item)
+    return merged
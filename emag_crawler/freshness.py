@@ -0,0 +1,255 @@
+"""根据类目的变化频率规划重新爬取"""
+
+from __future__ import annotations
+
+from math import exp, inf, log
+from time import time
+from typing import TYPE_CHECKING, Optional
+
+from pydantic import BaseModel, Field
+
+from .snapshot import TRACKED_FIELDS
+from .storage import connect_sqlite, data_dir, transaction
+from .utils import MAX_CRAWLABLE_PAGE, PAGE_SIZE
+
+if TYPE_CHECKING:
+    from typing import Any, Iterable
+
+    from .category_index import CategoryIndex
+    from .models import ProductChange
+    from .storage import StrOrPath
+
+
+# 需要估计变化频率的字段；产品的新增、消失计入 rank
+RATE_FIELDS: tuple[str, ...] = ('price', 'rank', 'max_qty')
+
+_MAX_CHANGED_FRACTION = 0.99  # 全部产品都变化时无法估计频率，按 99% 计算
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS rate (
+    category TEXT NOT NULL,
+    field TEXT NOT NULL,
+    rate REAL,
+    observed_at REAL NOT NULL,
+    observations INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (category, field)
+) WITHOUT ROWID;
+'''
+
+
+class ChangeRate(BaseModel):
+    """一个类目某个字段的变化频率"""
+
+    field: str = Field(..., description='字段')
+    rate: Optional[float] = Field(
+        None, ge=0, description='每个产品每小时发生变化的次数（EWMA），未知时为 None'
+    )
+    observed_at: float = Field(..., description='最近一次对比该字段的时间戳')
+    observations: int = Field(0, ge=0, description='参与估计的对比次数')
+
+    def changed_probability(self, now: float) -> Optional[float]:
+        """按泊松过程估计，到 `now` 时一个产品该字段已经变化的概率"""
+        if self.rate is None:
+            return None
+        return 1 - exp(-self.rate * max(now - self.observed_at, 0) / 3600)
+
+
+class FreshnessTracker:
+    """
+    用每次爬取后 SnapshotIndex 输出的变化，估计各类目各字段的变化频率
+
+    ---
+
+    1. 两次对比之间有 X/n 的产品发生了变化，视为泊松过程，频率估计为 -ln(1 - X/n) / Δt
+    2. 多次估计以 `alpha` 为权重做指数加权平均（EWMA），越近的估计权重越大
+    3. 每个字段单独记录对比时间，如未执行加购阶段时 max_qty 不参与对比，它的频率和对比时间都不变
+    """
+
+    def __init__(self, file: StrOrPath = data_dir / 'freshness.db', alpha: float = 0.3):
+        if not 0 < alpha <= 1:
+            raise ValueError(f'alpha 必须在 (0, 1] 之间，而不是 {alpha}')
+        self.conn = connect_sqlite(file)
+        self.conn.executescript(_SCHEMA)
+        self.alpha = alpha
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self) -> FreshnessTracker:
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def observe(
+        self,
+        category: str,
+        changes: Iterable[ProductChange],
+        product_count: int,
+        fields: Iterable[str] = TRACKED_FIELDS,
+        now: Optional[float] = None,
+    ) -> None:
+        """
+        记录一次爬取的变化
+
+        - `changes` 为 SnapshotIndex.update 的返回值，`fields` 与传给它的相同
+        - `product_count` 为本次爬取到的产品数
+        """
+        now = time() if now is None else now
+        fields = [f for f in RATE_FIELDS if f in set(fields)]
+
+        changed = dict.fromkeys(fields, 0)
+        for c in changes:
+            if c.change == 'update':
+                for f in c.changed_fields:
+                    if f in changed:
+                        changed[f] += 1
+            elif 'rank' in changed:
+                changed['rank'] += 1
+
+        rates = self.rates(category)
+        with transaction(self.conn):
+            for f in fields:
+                old = rates.get(f)
+                # 第一次对比只记录时间
+                if old is None or now <= old.observed_at:
+                    self.conn.execute(
+                        'INSERT INTO rate (category, field, observed_at) VALUES (?, ?, ?) '
+                        'ON CONFLICT (category, field) DO UPDATE SET observed_at=excluded.observed_at',
+                        (category, f, now),
+                    )
+                    continue
+
+                fraction = min(changed[f] / max(product_count, 1), _MAX_CHANGED_FRACTION)
+                estimate = -log(1 - fraction) / ((now - old.observed_at) / 3600)
+                rate = estimate if old.rate is None else self.alpha * estimate + (1 - self.alpha) * old.rate
+                self.conn.execute(
+                    'UPDATE rate SET rate=?, observed_at=?, observations=observations + 1 '
+                    'WHERE category=? AND field=?',
+                    (rate, now, category, f),
+                )
+
+    def rates(self, category: str) -> dict[str, ChangeRate]:
+        """类目各字段的变化频率，从未对比过的字段不在结果中"""
+        return {
+            field: ChangeRate(field=field, rate=rate, observed_at=observed_at, observations=observations)
+            for field, rate, observed_at, observations in self.conn.execute(
+                'SELECT field, rate, observed_at, observations FROM rate WHERE category=?', (category,)
+            )
+        }
+
+
+class CrawlPlanItem(BaseModel):
+    """一个类目在本轮的爬取计划"""
+
+    category: str = Field(..., description='类目')
+    pages: int = Field(..., ge=1, description='爬取的页数')
+    cart: bool = Field(..., description='是否执行加购阶段（获取最大可加购数）')
+    expected_changes: float = Field(..., ge=0, description='预计能发现的变化产品数，变化频率未知时为 inf')
+    estimated_duration: float = Field(..., ge=0, description='预计耗时（秒）')
+
+    @property
+    def fields(self) -> tuple[str, ...]:
+        """本次爬取后传给 SnapshotIndex.update 的对比字段"""
+        return TRACKED_FIELDS if self.cart else tuple(f for f in TRACKED_FIELDS if f != 'max_qty')
+
+    def worker_kwargs(self) -> dict[str, Any]:
+        """传给 CategoryPageWorker 的参数"""
+        return {'pages': self.pages, 'skip_cart': not self.cart}
+
+
+class FreshnessPlanner:
+    """
+    在时间和验证预算内，优先爬取变化最多的类目
+
+    ---
+
+    1. 每个类目按预计能发现的变化产品数 / 预计耗时排序，依次放入计划，直到用完 `time_budget` 秒
+    2. 价格、排行变化的概率不低于 `full_crawl_threshold` 时爬取全部可爬页，否则只爬第一页
+    3. max_qty 变化的概率不低于 `cart_threshold` 时才执行加购阶段，不执行时耗时按 `1 - cart_share` 折算
+    4. 变化频率未知（从未对比过）的类目总是最先爬取
+    5. 传入 `captcha_budget` 时，计划中各类目历史验证率之和不超过该值
+    """
+
+    def __init__(
+        self,
+        tracker: FreshnessTracker,
+        category_index: CategoryIndex,
+        full_crawl_threshold: float = 0.2,
+        cart_threshold: float = 0.1,
+        cart_share: float = 0.6,
+        default_duration: float = 120,
+    ):
+        self.tracker = tracker
+        self.category_index = category_index
+        self.full_crawl_threshold = full_crawl_threshold
+        self.cart_threshold = cart_threshold
+        self.cart_share = cart_share  # 加购阶段占爬取耗时的比例
+        self.default_duration = default_duration  # 没有历史耗时的类目按这个秒数估算
+
+    def _plan_category(self, category: str, now: float) -> CrawlPlanItem:
+        meta = self.category_index.get(category)
+        crawlable_pages = (meta.crawlable_pages if meta is not None else None) or MAX_CRAWLABLE_PAGE
+        total = meta.total_product_count if meta is not None else None
+        full_duration = self.category_index.estimate_duration(category) or self.default_duration
+
+        rates = self.tracker.rates(category)
+        probabilities = {f: r.changed_probability(now) for f, r in rates.items()}
+        listing = [probabilities.get(f) for f in ('price', 'rank')]
+        max_qty = probabilities.get('max_qty')
+
+        if any(p is None for p in listing):
+            pages, cart = crawlable_pages, True
+            listing_probability = max_qty_probability = inf
+        else:
+            # 价格、排行任一变化即为变化
+            listing_probability = 1 - (1 - listing[0]) * (1 - listing[1])  # type: ignore
+            max_qty_probability = inf if max_qty is None else max_qty
+            pages = crawlable_pages if listing_probability >= self.full_crawl_threshold else 1
+            cart = max_qty_probability >= self.cart_threshold
+
+        products = min(total, pages * PAGE_SIZE) if total is not None else pages * PAGE_SIZE
+        expected_changes = (
+            products * listing_probability + (products * max_qty_probability if cart else 0)
+            if products
+            else 0.0
+        )
+        duration = full_duration * pages / crawlable_pages * (1 if cart else 1 - self.cart_share)
+
+        return CrawlPlanItem(
+            category=category,
+            pages=pages,
+            cart=cart,
+            expected_changes=expected_changes,
+            estimated_duration=duration,
+        )
+
+    def plan(
+        self,
+        categories: Iterable[str],
+        time_budget: float,
+        captcha_budget: Optional[float] = None,
+        now: Optional[float] = None,
+    ) -> list[CrawlPlanItem]:
+        """规划本轮的爬取，按优先级从高到低返回"""
+        now = time() if now is None else now
+        candidates = [self._plan_category(c, now) for c in dict.fromkeys(categories)]
+        candidates.sort(key=lambda i: i.expected_changes / max(i.estimated_duration, 1), reverse=True)
+
+        plan: list[CrawlPlanItem] = list()
+        spent_time = 0.0
+        spent_captcha = 0.0
+        for item in candidates:
+            if item.expected_changes == 0:
+                break
+            if spent_time + item.estimated_duration > time_budget:
+                continue
+            if captcha_budget is not None:
+                meta = self.category_index.get(item.category)
+                captcha_rate = meta.captcha_rate if meta is not None else 0.0
+                if spent_captcha + captcha_rate > captcha_budget:
+                    continue
+                spent_captcha += captcha_rate
+            spent_time += item.estimated_duration
+            plan.append(item)
+        return plan
@@ -2,24 +2,72 @@
 
 from __future__ import annotations
 
-from asyncio import gather
+from asyncio import TaskGroup
 from re import compile
 from typing import TYPE_CHECKING
 
 from scraper_utils.constants.time_constant import MS1000
-from scraper_utils.exceptions.browser_exception import PlaywrightError
 
-from ..exceptions import CaptchaError
+from ..exceptions import CaptchaError, RetryableError
 from ..models import ProductCardItem
+from ..retry import RetryPolicy
 from ..utils import CART_PAGE_URL, block_track
 
 if TYPE_CHECKING:
-    from typing import Literal
+    from typing import Literal, Optional
 
     from loguru import Logger
     from playwright.async_api import BrowserContext, Page, Locator, Response
 
 
+class CartBatchSizer:
+    """
+    每批加购多少个产品后打开一次购物车页
+
+    ---
+
+    1. 从 `initial` 开始，还没遇到过拒绝加购时，每处理完一批满额的产品就增加 `step`，最多到 `maximum`
+    2. 网站拒绝加购时，把当时购物车内的产品数记为购物车容量，批量大小降为该容量
+    3. 之后连续 `recover_after` 批满额的产品都没有被拒绝时，不再信任学习到的容量，批量大小重新按 `step` 增长
+    """
+
+    def __init__(self, initial: int = 40, step: int = 10, maximum: int = 100, recover_after: int = 10):
+        self.size = initial
+        self.step = step
+        self.maximum = maximum
+        self.recover_after = recover_after
+        self.capacity: Optional[int] = None  # 学习到的购物车容量
+        self._clean_batches = 0  # 学习到容量后，连续没有被拒绝的满额批次数
+
+    def on_full(self, in_cart: int) -> None:
+        """网站拒绝加购时，`in_cart` 为此时购物车内的产品数"""
+        if in_cart <= 0:
+            return
+        self.capacity = in_cart
+        self.size = in_cart
+        self._clean_batches = 0
+
+    def on_flush(self, batch_size: int) -> None:
+        """处理完一批产品后"""
+        if batch_size < self.size:
+            return
+        if self.capacity is not None:
+            self._clean_batches += 1
+            if self._clean_batches < self.recover_after:
+                return
+            # 学习到的容量可能来自一次偶然的拒绝，重新尝试更大的批量
+            self.capacity = None
+            self._clean_batches = 0
+        self.size = min(self.size + self.step, self.maximum)
+
+
+# 同一进程内的所有类目共享学习到的购物车容量
+cart_batch_sizer = CartBatchSizer()
+
+# 单个 Sterge 按钮最多尝试 5 次、30 秒
+sterge_retry = RetryPolicy('click_sterge', max_attempts=5, deadline=30)
+
+
 async def open_url(
     context: BrowserContext,
     logger: Logger,
@@ -63,49 +111,55 @@ async def open_url(
 # 点击 Sterge 按钮，然后等待响应判断是否 Sterge 成功、有无触发验证
 # BUG
 async def clear_cart(page: Page, logger: Logger) -> None:
-    """清空购物车"""
+    """清空购物车，某个 Sterge 按钮失败（如用尽重试次数）时取消其余的点击，并抛出它的异常"""
     logger.info('清空购物车')
 
     # 全部可点击的 Sterge 按钮
     sterge_buttons = page.locator('css=button.remove-product[data-line]').filter(visible=True)
 
-    click_sterge_tasks = [click_sterge(page, b, logger) for b in await sterge_buttons.all()]
-    sterge_results = await gather(*click_sterge_tasks)
-    if False in sterge_results:
+    try:
+        async with TaskGroup() as tg:
+            click_sterge_tasks = [
+                tg.create_task(click_sterge(page, b, logger)) for b in await sterge_buttons.all()
+            ]
+    except* Exception as eg:
+        # 调用方只处理单个异常，不处理 ExceptionGroup
+        raise eg.exceptions[0]
+    if False in (t.result() for t in click_sterge_tasks):
         raise CaptchaError(CART_PAGE_URL, '尝试清空购物车时遇到验证')
 
 
-async def click_sterge(page: Page, button: Locator, logger: Logger) -> bool:
-    """点击单个 Sterge 按钮，返回是否 Sterge 成功"""
+async def click_sterge(
+    page: Page, button: Locator, logger: Logger, retry: RetryPolicy = sterge_retry
+) -> bool:
+    """点击单个 Sterge 按钮，返回是否 Sterge 成功（False 表示遇到验证），用尽重试次数时抛出 RetryExhaustedError"""
 
     # BUG Sterge 请求的响应是成功的，但还是会重复点击加购按钮
 
-    data_line: str = await button.get_attribute('data-line', timeout=MS1000)  # type: ignore
+    data_line: Optional[str] = None
 
-    while True:
+    async def attempt() -> bool:
+        nonlocal data_line
         if page.is_closed():
             return False
-
-        # async with page.expect_response(compile(r'.*?emag\.ro/cart/remove.*')) as response_event:
-
-        try:
-            async with page.expect_response(
-                lambda r: _sterge_response_filter(r, data_line)
-            ) as response_event:
-                try:
-                    await button.click(timeout=MS1000)
-                except PlaywrightError as pe:
-                    logger.warning(f'尝试点击 Sterge 时出错 data-line={data_line}\n{pe}')
-        except PlaywrightError as pe:
-            logger.warning(f'尝试等待 Sterge 响应时出错 data-line={data_line}\n{pe}')
-            continue
+        # 读取属性同样可能超时，放在重试内
+        if data_line is None:
+            data_line = await button.get_attribute('data-line', timeout=MS1000)
+            if data_line is None:
+                raise RetryableError('Sterge 按钮没有 data-line')
+        line = data_line
+
+        async with page.expect_response(lambda r: _sterge_response_filter(r, line)) as response_event:
+            await button.click(timeout=MS1000)
         response = await response_event.value
-        response.request.post_data_json
         if response.ok:
             logger.debug(f'Sterge 成功 data-line={data_line}')
             return True
         if response.status == 511:
             return False
+        raise RetryableError(f'Sterge 的响应为 {response.status} data-line={data_line}')
+
+    return await retry.run(attempt, logger)
 
 
 def _sterge_response_filter(response: Response, data_line: str) -> bool:
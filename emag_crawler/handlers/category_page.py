@@ -2,25 +2,30 @@
 
 from __future__ import annotations
 
-from asyncio import create_task
+from asyncio import TaskGroup, create_task, gather
 from re import compile, search
 from typing import TYPE_CHECKING
 
 from scraper_utils.constants.time_constant import MS1000
 from scraper_utils.exceptions.browser_exception import PlaywrightError
 
-from .cart_page import clear_cart, open_url as open_cart_page, parse_max_qty
-from ..exceptions import CaptchaError, ParsePNKError
+from .cart_page import CartBatchSizer, cart_batch_sizer, clear_cart, open_url as open_cart_page, parse_max_qty
+from ..exceptions import CaptchaError, CartFullError, ParsePNKError, RetryableError, RetryExhaustedError
 from ..models import ProductCardItem
+from ..retry import RetryPolicy
 from ..utils import block_track, hide_cookie_banner, parse_pnk_from_url
 
 if TYPE_CHECKING:
-    from typing import Literal, Iterable
+    from typing import Literal, Iterable, Iterator, Mapping, Optional, Sequence
 
     from loguru import Logger
     from playwright.async_api import BrowserContext, Page, Locator, Response
 
 
+# 单个产品的加购最多尝试 5 次、30 秒
+add_cart_retry = RetryPolicy('add_cart', max_attempts=5, deadline=30)
+
+
 async def open_url(
     context: BrowserContext,
     url: str,
@@ -31,12 +36,17 @@ async def open_url(
     logger.info(f'尝试访问 "{url}"')
 
     page = await context.new_page()
-    await hide_cookie_banner(page)
-    await block_track(page)
+    try:
+        await hide_cookie_banner(page)
+        await block_track(page)
 
-    response = await page.goto(url, wait_until=wait_until)
-    if response is None or response.status == 511:
-        raise CaptchaError(url, f'尝试访问 "{url}" 时遇到验证')
+        response = await page.goto(url, wait_until=wait_until)
+        if response is None or response.status == 511:
+            raise CaptchaError(url, f'尝试访问 "{url}" 时遇到验证')
+    except BaseException:
+        # 打开失败时调用方拿不到页面，在这里关闭，重试时不会留下多余的页面
+        await page.close()
+        raise
 
     return page
 
@@ -45,16 +55,34 @@ async def handle_cart_dialog(page: Page, logger: Logger, interval: int = 1000) -
     """
     处理类目页面点击加购按钮后可能出现的弹窗
 
-    当页面还未关闭时，每隔 `interval` 毫秒尝试点击一次加购弹窗的关闭按钮
+    每隔 `interval` 毫秒尝试点击一次加购弹窗的关闭按钮，直到页面关闭或任务被取消
     """
     logger.info(f'为 "{page.url}" 启动处理加购弹窗任务')
-    while page.is_closed() is False:
-        dialog_close_button = page.locator('xpath=//button[@class="close gtm_6046yfqs"]')
-        try:
-            await dialog_close_button.click(timeout=interval)
-        except PlaywrightError:
-            pass
-    logger.info(f'检测到页面 "{page.url}" 关闭，处理加购弹窗任务即将关闭')
+    dialog_close_button = page.locator('xpath=//button[@class="close gtm_6046yfqs"]')
+    try:
+        while page.is_closed() is False:
+            try:
+                await dialog_close_button.click(timeout=interval)
+            except PlaywrightError:
+                pass
+    finally:
+        logger.info(f'处理加购弹窗任务结束 "{page.url}"')
+
+
+def parse_price_text(text: str) -> Optional[float]:
+    """从 "1.234,56 Lei" 形式的文本中解析价格"""
+    m = search(r'([\d.]+),(\d+) Lei', text)
+    if m is None:
+        return None
+    return float(f'{m.group(1).replace(".", "")}.{m.group(2)}')
+
+
+def parse_review_count_text(text: str) -> Optional[int]:
+    """从 "(123)" 形式的文本中解析评论数"""
+    m = search(r'\((\d+)\)', text)
+    if m is None:
+        return None
+    return int(m.group(1))
 
 
 async def parse_card(
@@ -68,7 +96,9 @@ async def parse_card(
     pnk = parse_pnk_from_url(data_url)
 
     # 解析 product-id
-    
+    product_id = await card_div.get_attribute('data-offer-id', timeout=MS1000)
+    if product_id is None:
+        raise ValueError(f'第 {rank} 个产品卡片没有 data-offer-id')
 
     # 解析是否带 Top Favorite 标志
     top_favorite_span = card_div.locator(
@@ -80,13 +110,10 @@ async def parse_card(
         logger.warning(f'第 {rank} 个产品卡片找到了多个 top_favorite_span')
 
     # 解析价格
-    price = None
     price_p = card_div.locator('css=p.product-new-price')
     price_p_text = await price_p.inner_text(timeout=MS1000)
-    price_text_match = search(r'(\d+),(\d+) Lei', price_p_text)
-    if price_text_match is not None:
-        price = float(f'{price_text_match.group(1)}.{price_text_match.group(2)}')
-    else:
+    price = parse_price_text(price_p_text)
+    if price is None:
         logger.error(f'第 {rank} 个产品卡片，正则表达式从 "{price_p_text}" 匹配不到价格')
 
     # 解析评分
@@ -106,10 +133,8 @@ async def parse_card(
     review_count_span = card_div.locator('css=span.visible-xs-inline-block')
     if await review_count_span.count() == 1:
         review_count_span_text = await review_count_span.inner_text(timeout=MS1000)
-        review_count_text_match = search(r'\((\d+)\)', review_count_span_text)
-        if review_count_text_match is not None:
-            review_count = int(review_count_text_match.group(1))
-        else:
+        review_count = parse_review_count_text(review_count_span_text)
+        if review_count is None:
             logger.error(f'第 {rank} 个产品卡片，正则表达式从 "{review_count_span_text}" 匹配不到评论数')
     else:
         logger.debug(f'第 {rank} 个产品卡片没有评论数')
@@ -122,55 +147,101 @@ async def parse_card(
             f'第 {rank} 个产品卡片，评分和评论数不同时为空或同时非空，评分="{average_rating}"评论数="{review_count}"'
         )
 
-    # return ProductCardItem(
-    #     pnk=pnk,
-    #     category=category,
-    #     source_url=source_url,
-    #     rank=rank,
-    #     is_top_favorite=top_favorite,
-    #     price=price,
-    #     rating=average_rating,
-    #     review_count=review_count,
-    #     cart_added=False,
-    #     max_qty=None,
-    # )
-
-
-async def add_cart(page: Page, card_div: Locator, rank: int, logger: Logger) -> None:
-    """传入一个产品卡片，将该产品添加到购物车"""
+    return ProductCardItem(
+        pnk=pnk,
+        product_id=product_id,
+        category=category,
+        source_url=source_url,
+        rank=rank,
+        is_top_favorite=top_favorite,
+        price=price,
+        rating=average_rating,
+        review_count=review_count,
+        cart_added=False,
+        max_qty=None,
+    )
+
+
+async def add_cart(
+    page: Page, card_div: Locator, rank: int, logger: Logger, retry: RetryPolicy = add_cart_retry
+) -> None:
+    """
+    传入一个产品卡片，将该产品添加到购物车
+
+    点击失败或响应异常时按 `retry` 重试，用尽重试次数时抛出 RetryExhaustedError
+    """
     add_cart_button = card_div.locator('css=button.yeahIWantThisProduct[data-offer-id]')
     data_offer_id: str = await add_cart_button.get_attribute('data-offer-id', timeout=MS1000)  # type: ignore
     data_pnk: str = await add_cart_button.get_attribute('data-pnk', timeout=MS1000)  # type: ignore
 
-    # TODO 如何检测购物车已满的情况？
     # TODO 如何检测加购成功
-    # BUG 有时会出现
 
-    while True:
+    async def attempt() -> None:
         if page.is_closed():
-            logger.error('页面关闭')
-            break
+            raise RetryExhaustedError(retry.operation, 0, f'加购第 {rank} 个产品时页面已关闭')
 
-        # async with page.expect_response(
-        #     compile(rf'.*?emag\.ro/newaddtocart.*?X-Product-Id={data_offer_id}.*')
-        # ) as response_event:
+        async with page.expect_response(
+            lambda r: _add_cart_response_filter(r, data_offer_id)
+        ) as response_event:
+            await add_cart_button.click(timeout=MS1000)
+        response = await response_event.value
+        if response.status == 511:
+            raise CaptchaError(page.url, f'尝试加购第 {rank} 个的产品时遇到验证')
+        # 购物车已满时响应也可能是 2xx，要先检查
+        if await _is_cart_full_response(response):
+            raise CartFullError(page.url, f'加购第 {rank} 个产品时被拒绝，购物车已满 pnk="{data_pnk}"')
+        if response.ok:
+            logger.debug(f'加购第 {rank} 个产品成功 pnk="{data_pnk}"')
+            return
+        raise RetryableError(f'加购第 {rank} 个产品的响应为 {response.status} pnk="{data_pnk}"')
 
-        try:
-            async with page.expect_response(
-                lambda r: _add_cart_response_filter(r, data_offer_id)
-            ) as response_event:
-                await add_cart_button.click(timeout=MS1000)
-                # logger.debug(f'等待第 {rank} 个加购请求响应 data-offer-id={data_offer_id}')
-        except PlaywrightError as pe:
-            logger.warning(f'尝试加购第 {rank} 个产品时出错\n{pe}')
-            continue
-        else:
-            response = await response_event.value
-            if response.ok:
-                logger.debug(f'加购第 {rank} 个产品成功 pnk="{data_pnk}"')
-                break
-            if response.status == 511:
-                raise CaptchaError(page.url, f'尝试加购第 {rank} 个的产品时遇到验证')
+    await retry.run(attempt, logger)
+
+
+# 购物车已满的提示要同时提到购物车和数量上限（罗马尼亚语、英语）
+_CART_WORD = compile(r'(?i)\b(co[sșş](ul(ui)?)?|cart|basket)\b')
+_LIMIT_WORD = compile(r'(?i)\b(maxim|limit|plin|full)')
+
+
+def _messages(body: object) -> Iterator[str]:
+    """JSON 响应中的全部字符串"""
+    if isinstance(body, str):
+        yield body
+    elif isinstance(body, dict):
+        for v in body.values():
+            yield from _messages(v)
+    elif isinstance(body, list):
+        for v in body:
+            yield from _messages(v)
+
+
+def is_cart_full_body(body: object) -> bool:
+    """加购响应的 JSON 中是否有购物车已满的提示"""
+    return any(_CART_WORD.search(m) and _LIMIT_WORD.search(m) for m in _messages(body))
+
+
+async def _is_cart_full_response(response: Response) -> bool:
+    """
+    判断加购请求的响应是否表示网站拒绝了加购（购物车已满）
+
+    ---
+
+    1. 4xx 响应，或 JSON 中带有错误信息、失败状态的 2xx 响应
+    2. 并且 JSON 中有同时提到购物车和数量上限的提示；其他错误（如 429、403）交给重试
+    """
+    if not (response.ok or 400 <= response.status < 500):
+        return False
+
+    try:
+        body = await response.json()
+    except (PlaywrightError, ValueError):
+        return False
+    if response.ok and not (
+        isinstance(body, dict)
+        and (bool(body.get('error') or body.get('errors')) or body.get('status') in (False, 'error', 'fail'))
+    ):
+        return False
+    return is_cart_full_body(body)
 
 
 def _add_cart_response_filter(response: Response, data_offer_id: str) -> bool:
@@ -194,20 +265,108 @@ async def get_total_product_count(page: Page) -> int:
     return count
 
 
-async def handle_products(
-    page: Page, category: str, need_clear_cart: bool, logger: Logger
-) -> tuple[list[ProductCardItem], bool]:
-    """加购一个类目页内的所有产品、统计产品最大可加购数，返回解析结果、解析过程中是否遇到验证"""
-    # 非 Promovat、非 Vezi Detalii 的加购按钮的所属产品卡片
-    product_card_divs = page.locator(
+async def count_products(context: BrowserContext, url: str, logger: Logger) -> int:
+    """只打开类目页（可带筛选条件）到 domcontentloaded，读取产品总数后关闭"""
+    page = await open_url(context, url, logger, 'domcontentloaded')
+    try:
+        # 没有产品的类目页没有分页栏
+        if await page.locator('css=div.control-label.js-listing-pagination').count() == 0:
+            return 0
+        return await get_total_product_count(page)
+    finally:
+        await page.close()
+
+
+def product_card_locator(page: Page) -> Locator:
+    """非 Promovat、非 Vezi Detalii 的加购按钮的所属产品卡片"""
+    return page.locator(
         'css=div.card-item',
         has_not=page.locator('css=span.card-v2-badge-cmp.bg-light'),
         has=page.locator('css=button.yeahIWantThisProduct'),
     )
+
+
+async def card_offer_ids(page: Page) -> list[Optional[str]]:
+    """类目页内各产品卡片的 data-offer-id，顺序与 product_card_locator 的相同"""
+    return await product_card_locator(page).evaluate_all(
+        'cards => cards.map(card => card.getAttribute("data-offer-id"))'
+    )
+
+
+async def parse_products(
+    page: Page, category: str, logger: Logger, result: Optional[list[ProductCardItem]] = None
+) -> list[ProductCardItem]:
+    """
+    只解析类目页内的产品卡片，不加购（没有最大可加购数），解析后关闭页面
+
+    与 handle_products 解析同样的产品卡片，排行一致；`result` 与 handle_products 的相同
+    """
+    result = list() if result is None else result
+    product_card_divs = product_card_locator(page)
+    try:
+        product_card_count = await product_card_divs.count()
+        logger.debug(f'在 "{page.url}" 找到 {product_card_count} 个产品卡片，只解析不加购')
+        for i in range(product_card_count):
+            try:
+                result.append(await parse_card(product_card_divs.nth(i), category, page.url, i + 1, logger))
+            except (ParsePNKError, ValueError) as e:
+                logger.error(f'解析第 {i+1} 个产品卡片时出错，跳过\n{e}')
+    finally:
+        await page.close()
+    return result
+
+
+async def handle_products(
+    page: Page,
+    category: str,
+    need_clear_cart: bool,
+    logger: Logger,
+    batch_sizer: CartBatchSizer = cart_batch_sizer,
+    ranks: Optional[Mapping[str, int]] = None,
+    result: Optional[list[ProductCardItem]] = None,
+) -> tuple[list[ProductCardItem], bool]:
+    """
+    加购一个类目页内的所有产品、统计产品最大可加购数，返回解析结果、解析过程中是否遇到验证
+
+    每加购 `batch_sizer.size` 个产品就打开一次购物车页处理这一批；网站拒绝加购时，
+    先处理已加购的这一批、记下购物车的实际容量，再重新加购被拒绝的产品
+
+    传入 `ranks`（data-offer-id -> 排行）时只处理其中的产品卡片，排行也用其中的，
+    分片时各上下文渲染出的卡片顺序可能不同，排行以分配产品的页面为准
+
+    传入 `result` 时解析到的产品会随时追加到其中并返回该列表，被取消（如超过时间预算）时调用方仍能拿到已解析的产品
+    """
+    product_card_divs = product_card_locator(page)
     product_card_count = await product_card_divs.count()
     logger.debug(f'在 "{page.url}" 找到 {product_card_count} 个非 Promovat、非 Vezi Detalii 的产品卡片')
 
-    result: list[ProductCardItem] = list()
+    result = list() if result is None else result
+    batch: list[ProductCardItem] = list()  # 已加购、还未处理的一批产品
+
+    # 每个卡片的排行，不处理的卡片为 None
+    card_ranks: list[Optional[int]] = list(range(1, product_card_count + 1))
+    if ranks is not None:
+        card_ranks = list()
+        found: set[str] = set()
+        for offer_id in await card_offer_ids(page):
+            # 页面内重复的产品只处理第一个
+            if offer_id is not None and offer_id in ranks and offer_id not in found:
+                found.add(offer_id)
+                card_ranks.append(ranks[offer_id])
+            else:
+                card_ranks.append(None)
+        missing = len(ranks) - len(found)
+        if missing > 0:
+            logger.error(f'分配的 {len(ranks)} 个产品中有 {missing} 个不在 "{page.url}" 中')
+
+    async def flush() -> None:
+        """处理已加购的这一批产品"""
+        await handle_added_products(page, batch, need_clear_cart, logger)
+        missing = [p.pnk for p in batch if p.max_qty is None]
+        if missing:
+            logger.error(f'{len(missing)}/{len(batch)} 个产品没有解析到最大可加购数 {missing}')
+        batch_sizer.on_flush(len(batch))
+        batch.clear()
 
     ##### 开始加购产品 #####
     handle_dialog_task = create_task(handle_cart_dialog(page, logger))
@@ -215,75 +374,199 @@ async def handle_products(
     # 遇到验证时会终止爬取，并保存已爬取结果
     captcha_flag = False  # 目前还未遇到验证
 
-    # 如果产品卡片不超过 40 个
-    if product_card_count <= 40:
-        for i in range(product_card_count):
-            # 如果已经触发验证就中断
-            if captcha_flag:
-                break
+    try:
+        for i, rank in enumerate(card_ranks):
+            if rank is None:
+                continue
 
-            logger.debug(f'尝试加购产品 {i+1}/{product_card_count}')
-            # 尝试加购，加购成功后往 result 中放入解析到的产品卡片信息
+            # 加购数达到批量大小时，打开购物车处理这一批产品
+            if len(batch) >= batch_sizer.size:
+                await flush()
+
+            # 先解析再加购，解析失败的产品不进购物车，购物车内的产品数与 batch 一致，on_full 才能学到正确的容量
             card_div = product_card_divs.nth(i)
             try:
-                await add_cart(page, card_div, i + 1, logger)
-            except CaptchaError as ce:
-                logger.error(ce)
-                captcha_flag = True
-                break
-            else:
-                p = await parse_card(card_div, category, page.url, i + 1, logger)
-                p.cart_added = True
-                result.append(p)
-                logger.debug(f'产品加购成功 {i+1}/{product_card_count}')
+                p = await parse_card(card_div, category, page.url, rank, logger)
+            except (ParsePNKError, ValueError) as e:
+                logger.error(f'解析第 {rank} 个产品卡片时出错，跳过\n{e}')
+                continue
 
-    # 如果产品卡片超过 40 个
-    else:
-        for i in range(product_card_count):
-            # 如果已经触发验证就中断
-            if captcha_flag:
-                break
-
-            # 当加购到 40 个时，打开购物车处理一批产品
-            if i == 40:
-                try:
-                    await handle_added_products(page, result, need_clear_cart, logger)
-                except CaptchaError as ce:
-                    logger.error(ce)
-                    captcha_flag = True
-                    break
-
-            logger.debug(f'尝试加购产品 {i+1}/{product_card_count}')
-            # 尝试加购，加购成功后往 result 中放入解析到的产品卡片信息
-            card_div = product_card_divs.nth(i)
+            logger.debug(f'尝试加购产品 {rank}/{product_card_count}')
             try:
-                await add_cart(page, card_div, i + 1, logger)
-            except CaptchaError as ce:
-                logger.error(ce)
-                captcha_flag = True
-                break
-            else:
-                p = await parse_card(card_div, category, page.url, i + 1, logger)
-                p.cart_added = True
-                result.append(p)
-                logger.debug(f'产品加购成功 {i+1}/{product_card_count}')
+                await add_cart(page, card_div, rank, logger)
+            except RetryExhaustedError as ree:
+                logger.error(f'加购第 {rank} 个产品失败，跳过\n{ree}')
+                continue
+            except CartFullError as cfe:
+                logger.warning(cfe)
+                if len(batch) == 0:
+                    # 处理完一批后购物车仍然是满的（如不清空购物车时），后面的产品都加购不了
+                    logger.error('购物车为空时仍被拒绝加购，停止加购')
+                    break
+                batch_sizer.on_full(len(batch))
+                await flush()
+                try:
+                    await add_cart(page, card_div, rank, logger)
+                except CartFullError as cfe:
+                    logger.error(f'清空购物车后仍被拒绝加购，跳过\n{cfe}')
+                    continue
+                except RetryExhaustedError as ree:
+                    logger.error(f'加购第 {rank} 个产品失败，跳过\n{ree}')
+                    continue
+
+            # 加购成功后往 result 中放入解析到的产品卡片信息
+            p.cart_added = True
+            result.append(p)
+            batch.append(p)
+            logger.debug(f'产品加购成功 {rank}/{product_card_count}')
+
+        # 解析购物车内剩余的一批产品
+        if batch:
+            await flush()
 
-    # 解析购物车内的产品信息
-    try:
-        # 解析所有 max_qty 为 None 的产品
-        await handle_added_products(
-            page,
-            filter(lambda p: p.max_qty is None, result),
-            need_clear_cart,
-            logger,
-        )
     except CaptchaError as ce:
         logger.error(ce)
         captcha_flag = True
+    except RetryExhaustedError as ree:
+        # 购物车没有清空时继续加购也拿不到正确的最大可加购数
+        logger.error(f'处理购物车时放弃，停止加购\n{ree}')
+
+    finally:
+        # 被取消（如超过类目的时间预算）时同样要结束弹窗任务、关闭页面
+        handle_dialog_task.cancel()
+        await gather(handle_dialog_task, return_exceptions=True)
+        await page.close()
+
+    return result, captcha_flag
+
+
+async def handle_products_sharded(
+    page: Page,
+    contexts: Sequence[BrowserContext],
+    category: str,
+    need_clear_cart: bool,
+    logger: Logger,
+    result: Optional[list[ProductCardItem]] = None,
+) -> tuple[list[ProductCardItem], bool]:
+    """
+    把一个类目页的加购阶段分到多个相互隔离的上下文中并行处理，返回按排行合并的解析结果、是否遇到验证
+
+    ---
+
+    1. `page` 为已打开的类目页，从中读取各产品卡片的 data-offer-id 和排行，轮流分配给 `page` 的上下文和 `contexts`
+       中的每个上下文（各自有独立的购物车和 cookies），每个上下文只处理分到的产品，总耗时约为单个上下文的 1 / (len(contexts) + 1)
+    2. 某个上下文打开类目页出错时先在该上下文中重试一次，仍然出错时把它的产品分给已经成功的上下文，
+       这些上下文也出错时才在 `page` 的上下文中依次处理
+    3. 合并时去掉重复的产品，并报告分配了但没有解析到的产品
+
+    `result` 与 handle_products 的相同，各分片解析到的产品都会随时追加到其中
+    """
+    if not contexts:
+        return await handle_products(page, category, need_clear_cart, logger, result=result)
+
+    result = list() if result is None else result
+    start = len(result)  # result 中已有前几页的产品，只合并这一页的
+
+    url = page.url
+    shards = len(contexts) + 1
+
+    # 以第 0 个分片的页面为准分配产品，排行与不分片时相同
+    ranks: dict[str, int] = dict()
+    for i, offer_id in enumerate(await card_offer_ids(page)):
+        if offer_id is not None:
+            ranks.setdefault(offer_id, i + 1)
+    items = list(ranks.items())
+    assignments = [dict(items[k::shards]) for k in range(shards)]
+
+    succeeded: list[BrowserContext] = [page.context]  # 成功打开类目页的上下文
+    failed: dict[int, dict[str, int]] = dict()  # 打开类目页出错的分片和分到的产品
+
+    async def open_shard(context: BrowserContext, shard_logger: Logger) -> Optional[Page]:
+        """打开类目页，出错时在同一上下文中重试一次，仍然出错时返回 None"""
+        for attempt in range(2):
+            try:
+                return await open_url(context, url, shard_logger, 'networkidle')
+            except PlaywrightError as pe:
+                shard_logger.warning(f'打开类目页时出错 ({attempt + 1}/2)\n{pe}')
+        return None
+
+    async def run_shard(k: int, context: BrowserContext, assigned: dict[str, int]) -> bool:
+        shard_logger = logger.bind(shard=k)
+        if k == 0:
+            shard_page = page
+        else:
+            try:
+                shard_page = await open_shard(context, shard_logger)
+            except CaptchaError as ce:
+                shard_logger.error(f'分片 {k} 打开类目页时触发验证\n{ce}')
+                return True
+            if shard_page is None:
+                failed[k] = assigned
+                return False
+            succeeded.append(context)
+        _, flag = await handle_products(
+            shard_page, category, need_clear_cart, shard_logger, ranks=assigned, result=result
+        )
+        return flag
+
+    # 任一分片抛出异常时取消其余分片
+    async with TaskGroup() as tg:
+        tasks = [
+            tg.create_task(run_shard(k, context, assignments[k]))
+            for k, context in enumerate((page.context, *contexts))
+        ]
+    captcha_flag = any(task.result() for task in tasks)
+
+    # 出错的分片的产品分给已经成功的上下文，每个上下文同时只处理一个分片，不会共用购物车
+    if failed and not captcha_flag:
+        retry_items = [item for k in sorted(failed) for item in failed[k].items()]
+        logger.info(
+            f'分片 {sorted(failed)} 出错，{len(retry_items)} 个产品改由 {len(succeeded)} 个上下文处理'
+        )
+        failed.clear()
+        retry_contexts = list(succeeded)
+        parts = [dict(retry_items[j :: len(retry_contexts)]) for j in range(len(retry_contexts))]
+        async with TaskGroup() as tg:
+            tasks = [
+                tg.create_task(run_shard(shards + j, context, part))
+                for j, (context, part) in enumerate(zip(retry_contexts, parts))
+                if part
+            ]
+        captcha_flag = any(task.result() for task in tasks)
+
+    # 仍然出错的部分在 page 的上下文中依次处理，再次出错时抛出异常，类目不算爬取完整
+    for k, assigned in sorted(failed.items()):
+        if captcha_flag:
+            break
+        shard_logger = logger.bind(shard=k)
+        shard_logger.info(f'在主上下文中重新处理分片 {k} 的 {len(assigned)} 个产品')
+        try:
+            shard_page = await open_url(page.context, url, shard_logger, 'networkidle')
+        except CaptchaError as ce:
+            shard_logger.error(f'重新处理分片 {k} 时触发验证\n{ce}')
+            captcha_flag = True
+            break
+        _, captcha_flag = await handle_products(
+            shard_page, category, need_clear_cart, shard_logger, ranks=assigned, result=result
+        )
+
+    # 各分片的产品按完成顺序追加，按排行合并并去重
+    merged: list[ProductCardItem] = list()
+    seen: set[str] = set()
+    for p in sorted(result[start:], key=lambda p: p.rank):
+        if p.product_id in seen:
+            logger.warning(f'"{p.pnk}" 被多个分片重复处理，只保留排行 {p.rank} 之前的一份')
+            continue
+        seen.add(p.product_id)
+        merged.append(p)
+    result[start:] = merged
 
-    await page.close()
-    await handle_dialog_task
+    if not captcha_flag:
+        missing = sorted(ranks[offer_id] for offer_id in ranks.keys() - seen)
+        if missing:
+            logger.warning(f'{len(missing)}/{len(ranks)} 个产品没有解析或加购成功，排行 {missing}')
 
+    logger.info(f'{shards} 个分片共解析 {len(merged)} 个产品')
     return result, captcha_flag
 
 
@@ -0,0 +1,352 @@
+"""不经过浏览器渲染，直接用 HTTP 请求获取类目页"""
+
+from __future__ import annotations
+
+from html.parser import HTMLParser
+from importlib.util import find_spec
+from typing import TYPE_CHECKING
+
+import httpx
+from scraper_utils.exceptions.browser_exception import PlaywrightError
+
+from .exceptions import CaptchaError, ParsePNKError
+from .handlers.category_page import open_url as open_category_page, parse_price_text, parse_review_count_text
+from .logger import logger
+from .models import ProductCardItem
+from .utils import parse_pnk_from_url
+
+if TYPE_CHECKING:
+    from typing import Optional
+
+    from loguru import Logger
+    from playwright.async_api import BrowserContext
+
+    from .proxies import ProxyEndpoint, ProxyPool
+
+
+_VOID_TAGS = frozenset(
+    ('area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'track', 'wbr')
+)
+
+
+class _ListingParser(HTMLParser):
+    """
+    从类目页 HTML 中解析产品卡片和产品总数
+
+    与浏览器模式使用相同的规则：只保留非 Promovat、带加购按钮（非 Vezi Detalii）的 div.card-item
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.cards: list[dict] = list()
+        self.pagination_strongs: list[str] = list()
+
+        # 每个打开的标签：(标签名, 需要收集文本的字段)
+        self._stack: list[tuple[str, Optional[str]]] = list()
+        self._card: Optional[dict] = None
+        self._card_depth = 0
+        self._pagination_depth: Optional[int] = None
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, Optional[str]]]) -> None:
+        attr = dict(attrs)
+        classes = set((attr.get('class') or '').split())
+        field: Optional[str] = None
+
+        if tag == 'div' and 'card-item' in classes:
+            # 产品卡片不会嵌套，上一个卡片内有未闭合的标签时在这里结束它
+            if self._card is not None:
+                del self._stack[self._card_depth :]
+                self.cards.append(self._card)
+            self._card = {
+                'data-url': attr.get('data-url'),
+                'data-offer-id': attr.get('data-offer-id'),
+                'promovat': False,
+                'add_cart': False,
+                'texts': dict(),
+            }
+            self._card_depth = len(self._stack)
+        elif tag == 'div' and {'control-label', 'js-listing-pagination'} <= classes:
+            self._pagination_depth = len(self._stack)
+        elif self._pagination_depth is not None and tag == 'strong':
+            field = 'pagination'
+            self.pagination_strongs.append('')
+        elif self._card is not None:
+            if tag == 'span' and {'card-v2-badge-cmp', 'bg-light'} <= classes:
+                self._card['promovat'] = True
+            elif tag == 'span' and 'card-v2-badge-cmp' in classes:
+                field = 'badge'
+            elif tag == 'button' and 'yeahIWantThisProduct' in classes:
+                self._card['add_cart'] = True
+            elif tag == 'p' and 'product-new-price' in classes:
+                field = 'price'
+            elif tag == 'span' and 'average-rating' in classes:
+                field = 'rating'
+            elif tag == 'span' and 'visible-xs-inline-block' in classes:
+                field = 'review_count'
+
+        # 同一字段可能有多个标签，每个标签的文本单独保存
+        if field is not None and field != 'pagination' and self._card is not None:
+            self._card['texts'].setdefault(field, list()).append('')
+
+        if tag not in _VOID_TAGS:
+            self._stack.append((tag, field))
+
+    def handle_endtag(self, tag: str) -> None:
+        # 容错：弹出到最近的同名标签
+        for i in range(len(self._stack) - 1, -1, -1):
+            if self._stack[i][0] == tag:
+                break
+        else:
+            return
+
+        del self._stack[i:]
+
+        if self._card is not None and len(self._stack) <= self._card_depth:
+            self.cards.append(self._card)
+            self._card = None
+        if self._pagination_depth is not None and len(self._stack) <= self._pagination_depth:
+            self._pagination_depth = None
+
+    def close(self) -> None:
+        super().close()
+        # HTML 在卡片内截断时保留该卡片
+        if self._card is not None:
+            self.cards.append(self._card)
+            self._card = None
+
+    def handle_data(self, data: str) -> None:
+        fields = {f for _, f in self._stack if f is not None}
+        if 'pagination' in fields:
+            self.pagination_strongs[-1] += data
+        if self._card is not None:
+            for f in fields - {'pagination'}:
+                self._card['texts'][f][-1] += data
+
+
+def _parse(html: str) -> _ListingParser:
+    parser = _ListingParser()
+    parser.feed(html)
+    parser.close()
+    return parser
+
+
+def _total_product_count(parser: _ListingParser) -> Optional[int]:
+    """分页栏的第二个 strong 为产品总数，找不到分页栏时为 None"""
+    if len(parser.pagination_strongs) < 2:
+        return None
+    try:
+        return int(parser.pagination_strongs[1].strip())
+    except ValueError:
+        logger.error(f'无法将 "{parser.pagination_strongs[1]}" 解析成产品总数')
+        return None
+
+
+def parse_listing_html(
+    html: str, category: str, source_url: str, logger: Logger
+) -> tuple[Optional[int], list[ProductCardItem]]:
+    """解析类目页 HTML，返回产品总数（找不到分页栏时为 None）和产品卡片"""
+    parser = _parse(html)
+
+    total_product_count = _total_product_count(parser)
+
+    result: list[ProductCardItem] = list()
+    cards = [c for c in parser.cards if c['add_cart'] and not c['promovat']]
+    for rank, card in enumerate(cards, start=1):
+        texts: dict[str, list[str]] = card['texts']
+        try:
+            pnk = parse_pnk_from_url(card['data-url'])
+        except ParsePNKError as pe:
+            logger.error(f'第 {rank} 个产品卡片无法解析 pnk "{pe}"')
+            continue
+        if card['data-offer-id'] is None:
+            logger.error(f'第 {rank} 个产品卡片没有 data-offer-id')
+            continue
+
+        top_favorite_count = sum('Top Favorite' in t for t in texts.get('badge', []))
+        if top_favorite_count > 1:
+            logger.warning(f'第 {rank} 个产品卡片找到了多个 top_favorite_span')
+
+        price = parse_price_text(texts['price'][0]) if 'price' in texts else None
+        if price is None:
+            logger.error(f'第 {rank} 个产品卡片匹配不到价格')
+
+        rating = None
+        if len(texts.get('rating', [])) == 1:
+            try:
+                rating = float(texts['rating'][0].strip())
+            except ValueError:
+                logger.error(f'第 {rank} 个产品卡片，无法将 "{texts["rating"][0]}" 转为小数形式的评分')
+
+        review_count = None
+        if len(texts.get('review_count', [])) == 1:
+            review_count = parse_review_count_text(texts['review_count'][0])
+
+        result.append(
+            ProductCardItem(
+                pnk=pnk,
+                product_id=card['data-offer-id'],
+                category=category,
+                source_url=source_url,
+                rank=rank,
+                is_top_favorite=top_favorite_count == 1,
+                price=price,
+                rating=rating,
+                review_count=review_count,
+                cart_added=False,
+                max_qty=None,
+            )
+        )
+
+    return total_product_count, result
+
+
+class HttpListingFetcher:
+    """
+    用浏览器上下文预热会话，导出 cookies 和请求头后，用连接池复用的 HTTP 客户端获取类目页
+
+    ---
+
+    1. 响应状态为 511 或没有响应时，与 open_url 一样视为遇到验证
+    2. 遇到验证时自动改用浏览器打开该链接，浏览器通过后把新的 cookies 同步回 HTTP 客户端
+    3. 连续遇到 `max_challenges` 次验证后不再使用 HTTP，之后都用浏览器
+    4. 安装了 h2 时使用 HTTP/2
+    5. 传入 `proxy_pool` 时，HTTP 客户端以 `proxy_key` 领取代理，并向代理池报告延迟和验证；
+       `proxy_key` 应与浏览器上下文使用的相同，使 cookies 和出口 IP 保持一致
+    """
+
+    def __init__(
+        self,
+        context: BrowserContext,
+        max_connections: int = 8,
+        timeout: float = 30,
+        max_challenges: int = 3,
+        proxy_pool: Optional[ProxyPool] = None,
+        proxy_key: str = 'default',
+    ):
+        self.context = context
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.max_challenges = max_challenges
+        self.proxy_pool = proxy_pool
+        self.proxy_key = proxy_key
+        self.proxy: Optional[ProxyEndpoint] = None
+
+        self.challenges = 0  # 连续遇到验证的次数
+        self.http_fetches = 0
+        self.browser_fetches = 0
+
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def browser_only(self) -> bool:
+        return self.challenges >= self.max_challenges
+
+    async def _sync_cookies(self) -> None:
+        assert self._client is not None
+        for c in await self.context.cookies('https://www.emag.ro'):
+            self._client.cookies.set(c['name'], c['value'], domain=c['domain'], path=c['path'])
+
+    async def warm(self) -> None:
+        """用浏览器打开一次首页，导出 User-Agent、cookies，创建 HTTP 客户端"""
+        logger.info('预热 HTTP 会话')
+        page = await self.context.new_page()
+        try:
+            response = await page.goto('https://www.emag.ro/', wait_until='load')
+            if response is None or response.status == 511:
+                raise CaptchaError('https://www.emag.ro/', '预热 HTTP 会话时遇到验证')
+            user_agent: str = await page.evaluate('navigator.userAgent')
+            accept_language: str = await page.evaluate('navigator.languages.join(",")')
+        finally:
+            await page.close()
+
+        # 没有可用代理时等待冷却结束，不能不带代理直接请求
+        if self.proxy_pool is not None:
+            self.proxy = await self.proxy_pool.wait_acquire(self.proxy_key)
+
+        self._client = httpx.AsyncClient(
+            http2=find_spec('h2') is not None,
+            proxy=None if self.proxy is None else self.proxy.url(),
+            headers={
+                'User-Agent': user_agent,
+                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+                'Accept-Language': accept_language,
+                'Referer': 'https://www.emag.ro/',
+            },
+            limits=httpx.Limits(
+                max_connections=self.max_connections, max_keepalive_connections=self.max_connections
+            ),
+            timeout=self.timeout,
+            follow_redirects=True,
+        )
+        await self._sync_cookies()
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def __aenter__(self) -> HttpListingFetcher:
+        await self.warm()
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        await self.close()
+
+    async def _fetch_http(self, url: str) -> str:
+        assert self._client is not None
+        try:
+            response = await self._client.get(url)
+        except (httpx.ConnectError, httpx.ProxyError):
+            if self.proxy_pool is not None and self.proxy is not None:
+                self.proxy_pool.report_failure(self.proxy)
+            raise
+        if self.proxy_pool is not None and self.proxy is not None:
+            if response.status_code == 511:
+                self.proxy_pool.report_captcha(self.proxy)
+            else:
+                self.proxy_pool.report_success(self.proxy, response.elapsed.total_seconds())
+        if response.status_code == 511:
+            raise CaptchaError(url, f'尝试请求 "{url}" 时遇到验证')
+        response.raise_for_status()
+        return response.text
+
+    async def _fetch_browser(self, url: str, logger: Logger) -> str:
+        page = await open_category_page(self.context, url, logger, 'domcontentloaded')
+        try:
+            return await page.content()
+        finally:
+            await page.close()
+
+    async def fetch(self, url: str, logger: Logger = logger) -> str:
+        """获取类目页 HTML，HTTP 遇到验证时改用浏览器；浏览器也遇到验证时抛出 CaptchaError"""
+        if self._client is not None and not self.browser_only:
+            try:
+                html = await self._fetch_http(url)
+            except CaptchaError as ce:
+                self.challenges += 1
+                logger.warning(f'{ce}，改用浏览器 ({self.challenges}/{self.max_challenges})')
+            except httpx.HTTPError as he:
+                logger.warning(f'请求 "{url}" 时出错，改用浏览器\n{he!r}')
+            else:
+                self.challenges = 0
+                self.http_fetches += 1
+                return html
+
+        html = await self._fetch_browser(url, logger)
+        self.browser_fetches += 1
+        if self._client is not None and not self.browser_only:
+            try:
+                await self._sync_cookies()
+            except PlaywrightError as pe:
+                logger.warning(f'同步 cookies 时出错\n{pe}')
+        return html
+
+    async def fetch_listing(
+        self, url: str, category: str, logger: Logger = logger
+    ) -> tuple[Optional[int], list[ProductCardItem]]:
+        """获取并解析类目页，返回产品总数和产品卡片（不含最大可加购数）"""
+        return parse_listing_html(await self.fetch(url, logger), category, url, logger)
+
+    async def count_products(self, url: str) -> int:
+        """类目页的产品总数，可以作为 FacetPlanner 的 probe"""
+        return _total_product_count(_parse(await self.fetch(url))) or 0
@@ -1,5 +1,6 @@
 """日志"""
 
+from os import getenv
 from pathlib import Path
 from sys import stderr
 
@@ -7,48 +8,53 @@ from loguru import logger
 from scraper_utils.utils.time_util import now_str
 
 _cwd = Path.cwd()
-
-logger.remove()
 _log_dir = _cwd / 'logs/'
 _log_dir.mkdir(exist_ok=True)
-_log_file = _log_dir / f'{now_str('%Y_%m_%d-%H_%M_%S')}.log'
-logger.add(
-    stderr,
-    format=(
-        '[<green>{time:HH:mm:ss}</green>] [<level>{level:.3}</level>] '
-        '[<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan>] >>> '
-        '<level>{message}</level>'
-    ),
-    filter=lambda record: len(record['extra']) == 0,
-)
-logger.add(
-    _log_file,
-    format=(
-        '[<green>{time:HH:mm:ss}</green>] [<level>{level:.3}</level>] '
-        '[<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan>] >>> '
-        '<level>{message}</level>'
-    ),
-    filter=lambda record: len(record['extra']) == 0,
-    enqueue=True,
-)
-logger.add(
-    stderr,
-    format=(
-        '[<green>{time:HH:mm:ss}</green>] [<level>{level:.3}</level>] '
-        '[<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan>] '
-        '[<green>{extra[category]}</green>] >>> '
-        '<level>{message}</level>'
-    ),
-    filter=lambda record: 'category' in record['extra'],
-)
-logger.add(
-    _log_file,
-    format=(
-        '[<green>{time:HH:mm:ss}</green>] [<level>{level:.3}</level>] '
-        '[<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan>] '
-        '[<green>{extra[category]}</green>] >>> '
-        '<level>{message}</level>'
-    ),
-    filter=lambda record: 'category' in record['extra'],
-    enqueue=True,
-)
+log_dir = _log_dir  # 其他模块的诊断输出（如性能分析）也保存在日志目录下
+
+# 多进程运行时，子进程的日志由 runners.multi_process 转发到主进程统一输出
+WORKER_ID_ENV = 'EMAG_CRAWLER_WORKER_ID'
+
+logger.remove()
+if getenv(WORKER_ID_ENV) is None:
+    _log_file = _log_dir / f'{now_str('%Y_%m_%d-%H_%M_%S')}.log'
+    logger.add(
+        stderr,
+        format=(
+            '[<green>{time:HH:mm:ss}</green>] [<level>{level:.3}</level>] '
+            '[<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan>] >>> '
+            '<level>{message}</level>'
+        ),
+        filter=lambda record: len(record['extra']) == 0,
+    )
+    logger.add(
+        _log_file,
+        format=(
+            '[<green>{time:HH:mm:ss}</green>] [<level>{level:.3}</level>] '
+            '[<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan>] >>> '
+            '<level>{message}</level>'
+        ),
+        filter=lambda record: len(record['extra']) == 0,
+        enqueue=True,
+    )
+    logger.add(
+        stderr,
+        format=(
+            '[<green>{time:HH:mm:ss}</green>] [<level>{level:.3}</level>] '
+            '[<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan>] '
+            '[<green>{extra[category]}</green>] >>> '
+            '<level>{message}</level>'
+        ),
+        filter=lambda record: 'category' in record['extra'],
+    )
+    logger.add(
+        _log_file,
+        format=(
+            '[<green>{time:HH:mm:ss}</green>] [<level>{level:.3}</level>] '
+            '[<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan>] '
+            '[<green>{extra[category]}</green>] >>> '
+            '<level>{message}</level>'
+        ),
+        filter=lambda record: 'category' in record['extra'],
+        enqueue=True,
+    )
@@ -2,15 +2,15 @@
 
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, Optional
+from typing import TYPE_CHECKING, Any, Literal, Optional
 
-from pydantic import BaseModel, Field, field_validator
+from pydantic import BaseModel, Field, TypeAdapter, field_validator
 from scraper_utils.utils.emag_util import validate_pnk
 
 from .exceptions import ParsePNKError
 
 if TYPE_CHECKING:
-    pass
+    from typing import Iterable
 
 
 class ProductCardItem(BaseModel):
@@ -49,3 +49,57 @@ class ProductCardItem(BaseModel):
         if not validate_pnk(v):
             raise ParsePNKError(v)
         return v
+
+
+_product_card_list_adapter = TypeAdapter(list[ProductCardItem])
+_product_card_fields = frozenset(ProductCardItem.model_fields)
+
+
+def _construct_trusted(r: dict[str, Any]) -> ProductCardItem:
+    """不经验证直接构造，字段不完整时退回 model_construct 来填充默认值"""
+    if r.keys() != _product_card_fields:
+        return ProductCardItem.model_construct(**r)
+    # model_construct 会逐个字段处理默认值和别名，比批量验证还慢，完整的数据直接写入实例属性要快得多；
+    # 这依赖 pydantic 实例的内部属性，test_product_cards.py 保证结果与验证构造的一致
+    item = ProductCardItem.__new__(ProductCardItem)
+    object.__setattr__(item, '__dict__', dict(r))
+    object.__setattr__(item, '__pydantic_fields_set__', set(r))
+    object.__setattr__(item, '__pydantic_extra__', None)
+    object.__setattr__(item, '__pydantic_private__', None)
+    return item
+
+
+def load_product_cards(raw: Iterable[dict[str, Any]], trusted: bool = False) -> list[ProductCardItem]:
+    """
+    批量构造 ProductCardItem
+
+    - 默认一次性验证整批数据，比逐个构造少了每个对象的 Python 层调用开销
+    - `trusted` 为 True 时跳过验证，只用于本程序自己生成的数据（如缓存、日志、子进程的结果）
+    """
+    if trusted:
+        return [_construct_trusted(r) for r in raw]
+    return _product_card_list_adapter.validate_python(raw if isinstance(raw, list) else list(raw))
+
+
+def dump_product_cards(items: Iterable[ProductCardItem]) -> list[dict[str, Any]]:
+    """批量序列化 ProductCardItem"""
+    return _product_card_list_adapter.dump_python(items if isinstance(items, list) else list(items))
+
+
+class ProductChange(BaseModel):
+    """
+    增量输出：与上一次快照相比发生变化的产品
+
+    ---
+
+    1. insert：快照中没有的产品，`item` 为完整的产品数据
+    2. update：跟踪字段发生变化的产品，`changed_fields` 为变化的字段，`previous` 为这些字段的旧值
+    3. delete：完整爬取后该类目中已不存在的产品，`item` 为 None
+    """
+
+    change: Literal['insert', 'update', 'delete'] = Field(..., description='变化类型')
+    category: str = Field(..., description='产品类目')
+    pnk: str = Field(..., description='产品编号')
+    item: Optional[ProductCardItem] = Field(None, description='本次爬取到的产品数据')
+    changed_fields: list[str] = Field(default_factory=list, description='发生变化的字段')
+    previous: dict[str, Any] = Field(default_factory=dict, description='变化字段的旧值')
@@ -0,0 +1,179 @@
+"""浏览器配置和标签页资源统计"""
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional
+
+from pydantic import BaseModel, Field
+from scraper_utils.exceptions.browser_exception import PlaywrightError
+from scraper_utils.utils.file_util import read_file
+
+from .context_lifecycle import page_js_heap
+from .logger import logger
+from .utils import cwd
+
+if TYPE_CHECKING:
+    from typing import Any, Iterable
+
+    from playwright.async_api import Browser, BrowserContext, Page
+
+
+# 爬取时用不到的浏览器功能
+LEAN_ARGS: tuple[str, ...] = (
+    '--disable-gpu',
+    '--disable-dev-shm-usage',
+    '--disable-extensions',
+    '--disable-background-networking',
+    # 无头模式下的标签页都在后台，不关闭后台节流时定时器、渲染都会被降频
+    '--disable-background-timer-throttling',
+    '--disable-backgrounding-occluded-windows',
+    '--disable-renderer-backgrounding',
+    '--disable-features=Translate,MediaRouter,OptimizationHints,AutofillServerCommunication',
+    '--mute-audio',
+    '--no-first-run',
+    '--no-default-browser-check',
+    '--window-size=1280,720',
+)
+
+
+class BrowserProfile(BaseModel):
+    """浏览器的启动参数和上下文调优"""
+
+    name: str = Field(..., description='配置名')
+    headless: bool = Field(..., description='是否无头')
+    args: tuple[str, ...] = Field((), description='浏览器启动参数')
+    viewport: Optional[tuple[int, int]] = Field(None, description='页面视口（宽, 高），None 为不修改')
+    reduced_motion: bool = Field(False, description='是否模拟 prefers-reduced-motion')
+    disable_animations: bool = Field(False, description='是否注入关闭 CSS 动画、过渡的样式')
+
+    def browser_kwargs(self) -> dict[str, Any]:
+        """传给 BrowserManager 的关键字参数"""
+        return {'headless': self.headless, 'args': list(self.args)}
+
+    async def _setup_page(self, page: Page) -> None:
+        try:
+            if self.viewport is not None:
+                await page.set_viewport_size({'width': self.viewport[0], 'height': self.viewport[1]})
+            if self.reduced_motion:
+                await page.emulate_media(reduced_motion='reduce')
+        except PlaywrightError as pe:
+            logger.debug(f'设置页面时出错\n{pe}')
+
+    async def apply(self, context: BrowserContext) -> None:
+        """对上下文应用配置，之后打开的页面都会生效"""
+        if self.disable_animations:
+            await context.add_init_script(script=await _read_js('disable-animations.js'))
+        if self.viewport is not None or self.reduced_motion:
+            context.on('page', self._setup_page)
+
+
+_js_cache: dict[str, str] = dict()
+
+
+async def _read_js(name: str) -> str:
+    if name not in _js_cache:
+        _js_cache[name] = await read_file(file=cwd / 'js' / name, mode='str', async_mode=True)
+    return _js_cache[name]
+
+
+# 原有的配置：有界面、窗口最大化
+FULL_PROFILE = BrowserProfile(name='full', headless=False, args=('--start-maximized',))
+
+# 为爬取调优的配置：无头、小视口、关闭 GPU 和动画，可以在同一台机器上开更多标签页
+LEAN_PROFILE = BrowserProfile(
+    name='lean',
+    headless=True,
+    args=LEAN_ARGS,
+    viewport=(1280, 720),
+    reduced_motion=True,
+    disable_animations=True,
+)
+
+PROFILES: dict[str, BrowserProfile] = {p.name: p for p in (FULL_PROFILE, LEAN_PROFILE)}
+
+
+class TabMetrics(BaseModel):
+    """一个标签页的资源占用"""
+
+    url: str = Field(..., description='页面链接')
+    load_seconds: Optional[float] = Field(None, description='从导航开始到 load 事件结束的秒数')
+    dom_content_loaded_seconds: Optional[float] = Field(None, description='到 DOMContentLoaded 结束的秒数')
+    js_heap_mb: float = Field(..., description='JS 堆已用内存（MB）')
+    dom_nodes: Optional[int] = Field(None, description='DOM 节点数')
+
+
+async def measure_tab(page: Page) -> TabMetrics:
+    """统计标签页的加载耗时和内存"""
+    timing: dict = dict()
+    nodes = None
+    try:
+        timing = await page.evaluate('''() => {
+                const nav = performance.getEntriesByType('navigation')[0];
+                return nav ? {load: nav.loadEventEnd, dcl: nav.domContentLoadedEventEnd} : {};
+            }''')
+        nodes = await page.evaluate('document.getElementsByTagName("*").length')
+    except PlaywrightError as pe:
+        logger.debug(f'统计 "{page.url}" 时出错\n{pe}')
+
+    # 事件还未结束时为 0
+    load = timing.get('load') or None
+    dcl = timing.get('dcl') or None
+    return TabMetrics(
+        url=page.url,
+        load_seconds=None if load is None else load / 1000,
+        dom_content_loaded_seconds=None if dcl is None else dcl / 1000,
+        js_heap_mb=await page_js_heap(page) / 1024 / 1024,
+        dom_nodes=nodes,
+    )
+
+
+def _process_rss_mb(pid: int) -> Optional[float]:
+    """读取 /proc 中进程的常驻内存，非 Linux 或进程已退出时返回 None"""
+    try:
+        status = Path(f'/proc/{pid}/status').read_text()
+    except OSError:
+        return None
+    for line in status.splitlines():
+        if line.startswith('VmRSS:'):
+            return int(line.split()[1]) / 1024
+    return None
+
+
+async def renderer_rss_mb(browser: Browser) -> Optional[float]:
+    """浏览器全部渲染进程的常驻内存之和（MB），无法统计时返回 None"""
+    try:
+        cdp = await browser.new_browser_cdp_session()
+        try:
+            info = await cdp.send('SystemInfo.getProcessInfo')
+        finally:
+            await cdp.detach()
+    except PlaywrightError as pe:
+        logger.debug(f'读取浏览器进程信息时出错\n{pe}')
+        return None
+
+    rss = [_process_rss_mb(p['id']) for p in info['processInfo'] if p['type'] == 'renderer']
+    if not rss or None in rss:
+        return None
+    return sum(rss)  # type: ignore
+
+
+async def report_tabs(contexts: Iterable[BrowserContext]) -> list[TabMetrics]:
+    """统计所有标签页的资源占用，并输出各标签页的平均内存和加载耗时"""
+    pages = [p for c in contexts for p in c.pages if not p.is_closed()]
+    metrics = [await measure_tab(p) for p in pages]
+    if not metrics:
+        return metrics
+
+    message = f'{len(metrics)} 个标签页，平均 JS 堆 {sum(m.js_heap_mb for m in metrics) / len(metrics):.1f}MB'
+    loads = [m.load_seconds for m in metrics if m.load_seconds is not None]
+    if loads:
+        message += f'，平均加载耗时 {sum(loads) / len(loads):.2f}s'
+
+    browser = pages[0].context.browser
+    rss = None if browser is None else await renderer_rss_mb(browser)
+    if rss is not None:
+        # 渲染进程按站点划分，可能被多个标签页共用，无法对应到单个标签页，这里只是平均值
+        message += f'，渲染进程共 {rss:.0f}MB，按标签页数平均 {rss / len(metrics):.1f}MB'
+    logger.info(message)
+    return metrics
@@ -0,0 +1,115 @@
+"""按采样率对类目爬取做性能分析"""
+
+from __future__ import annotations
+
+from cProfile import Profile
+from io import StringIO
+from pathlib import Path
+from pstats import SortKey, Stats
+from random import random
+from typing import TYPE_CHECKING
+
+from scraper_utils.exceptions.browser_exception import PlaywrightError
+from scraper_utils.utils.time_util import now_str
+
+from .logger import log_dir, logger
+
+if TYPE_CHECKING:
+    from typing import Iterable, Optional
+
+    from .models import ProductCardItem
+    from .storage import StrOrPath
+    from .workers.category_page import CategoryPageWorker
+
+
+class CategoryProfiler:
+    """
+    对一部分类目的 `CategoryPageWorker.start_scrape` 做性能分析
+
+    ---
+
+    1. 每个类目以 `sample_rate` 的概率被采样，`categories` 中的类目总是被采样
+    2. 被采样的类目同时记录 cProfile 和 Playwright trace（`trace=True` 时），
+       保存为 `out_dir` 下的 `{类目}-{时间}.prof`、`.txt`（按累计耗时排序的摘要）和 `.trace.zip`
+    3. 未被采样的类目直接调用 start_scrape，没有额外开销；不使用 CategoryProfiler 时则完全没有开销
+    4. 用 `python -m pstats` 或 snakeviz 查看 .prof，用 `playwright show-trace` 查看 .trace.zip
+
+    NOTICE cProfile 记录的是整个事件循环线程，同时在爬取的其他类目也会计入；
+    同一线程同时只能有一个 cProfile，已有类目在分析时，新采样的类目只记录 trace
+    """
+
+    def __init__(
+        self,
+        sample_rate: float = 0.05,
+        categories: Optional[Iterable[str]] = None,
+        out_dir: StrOrPath = log_dir / 'profiles',
+        trace: bool = True,
+        summary_lines: int = 40,
+    ):
+        if not 0 <= sample_rate <= 1:
+            raise ValueError(f'采样率必须在 [0, 1] 之间，而不是 {sample_rate}')
+
+        self.sample_rate = sample_rate
+        self.categories = frozenset(categories or ())
+        self.out_dir = Path(out_dir)
+        self.trace = trace
+        self.summary_lines = summary_lines  # 摘要中保留的函数数
+
+        self.sampled = 0
+        self._profiling = False  # 当前线程是否已有 cProfile 在运行
+
+    def should_sample(self, category: str) -> bool:
+        return category in self.categories or random() < self.sample_rate
+
+    async def scrape(self, worker: CategoryPageWorker) -> list[ProductCardItem]:
+        """爬取类目，被采样时记录性能分析数据"""
+        if not self.should_sample(worker.category):
+            return await worker.start_scrape()
+
+        self.sampled += 1
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        stem = self.out_dir / f'{worker.category}-{now_str("%Y_%m_%d-%H_%M_%S")}'
+
+        tracing = False
+        if self.trace:
+            try:
+                await worker.context.tracing.start(
+                    title=worker.category, screenshots=False, snapshots=True, sources=False
+                )
+                tracing = True
+            except PlaywrightError as pe:
+                # 同一个上下文同时只能有一个 trace
+                logger.warning(f'无法为 "{worker.category}" 启动 trace\n{pe}')
+
+        profile: Optional[Profile] = None
+        if not self._profiling:
+            profile = Profile()
+            try:
+                profile.enable()
+            except ValueError as ve:
+                # 进程中已有其他分析器（如外部的 cProfile）
+                logger.warning(f'无法为 "{worker.category}" 启动 cProfile\n{ve}')
+                profile = None
+            else:
+                self._profiling = True
+
+        try:
+            return await worker.start_scrape()
+        finally:
+            if profile is not None:
+                profile.disable()
+                self._profiling = False
+                self._dump_profile(profile, stem)
+            if tracing:
+                try:
+                    await worker.context.tracing.stop(path=stem.with_suffix('.trace.zip'))
+                except PlaywrightError as pe:
+                    logger.warning(f'保存 "{worker.category}" 的 trace 时出错\n{pe}')
+            logger.info(f'"{worker.category}" 的性能分析已保存到 "{stem}.*"')
+
+    def _dump_profile(self, profile: Profile, stem: Path) -> None:
+        profile.dump_stats(stem.with_suffix('.prof'))
+
+        summary = StringIO()
+        Stats(profile, stream=summary).sort_stats(SortKey.CUMULATIVE).print_stats(self.summary_lines)
+        stem.with_suffix('.txt').write_text(summary.getvalue(), encoding='utf-8')
@@ -0,0 +1,326 @@
+"""代理池：按代理的延迟和验证率分配出口"""
+
+from __future__ import annotations
+
+import asyncio
+from base64 import b64encode
+from contextlib import contextmanager
+from time import perf_counter, time
+from typing import TYPE_CHECKING, Optional
+from urllib.parse import quote, urlsplit
+from zlib import crc32
+
+from pydantic import BaseModel, Field
+
+from .exceptions import NoProxyAvailableError
+from .logger import logger
+from .storage import connect_sqlite, transaction
+
+if TYPE_CHECKING:
+    from sqlite3 import Connection
+    from typing import Any, Iterable, Iterator
+
+    from .storage import StrOrPath
+
+
+class ProxyEndpoint(BaseModel):
+    """一个上游 HTTP 代理"""
+
+    server: str = Field(..., description='代理地址，如 http://127.0.0.1:8080')
+    username: Optional[str] = Field(None, description='用户名')
+    password: Optional[str] = Field(None, description='密码')
+
+    @property
+    def host(self) -> str:
+        return urlsplit(self.server).hostname or ''
+
+    @property
+    def port(self) -> int:
+        return urlsplit(self.server).port or 80
+
+    def playwright_proxy(self) -> dict[str, str]:
+        """BrowserContext 的 proxy 参数"""
+        proxy = {'server': self.server}
+        if self.username is not None:
+            proxy['username'] = self.username
+            proxy['password'] = self.password or ''
+        return proxy
+
+    def url(self) -> str:
+        """带认证信息的代理链接，用于 httpx"""
+        if self.username is None:
+            return self.server
+        parts = urlsplit(self.server)
+        auth = f'{quote(self.username, safe="")}:{quote(self.password or "", safe="")}'
+        return f'{parts.scheme}://{auth}@{parts.netloc}'
+
+
+class ProxyHealth(BaseModel):
+    """代理的健康状况"""
+
+    requests: int = Field(0, ge=0, description='报告过结果的请求数')
+    captchas: int = Field(0, ge=0, description='遇到验证的次数')
+    consecutive_captchas: int = Field(0, ge=0, description='连续遇到验证的次数')
+    consecutive_failures: int = Field(0, ge=0, description='连续连接失败的次数')
+    latency: Optional[float] = Field(None, ge=0, description='延迟（秒，EWMA）')
+    cooldown_until: float = Field(0, description='冷却结束的时间戳')
+    removed: bool = Field(False, description='是否已因不健康被移出代理池')
+
+    @property
+    def captcha_rate(self) -> float:
+        return self.captchas / self.requests if self.requests else 0.0
+
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS proxy_health (
+    server TEXT PRIMARY KEY,
+    health TEXT NOT NULL
+);
+'''
+
+
+class ProxyPool:
+    """
+    上游代理池，让验证率随出口数量分摊
+
+    ---
+
+    1. 每个使用者（上下文、HTTP 客户端）用 `key` 领取代理，之后总是分到同一个代理（粘性），直到该代理冷却或被移除
+    2. 分配时优先选择 延迟 × (1 + 4 × 验证率) × (1 + 已分配的使用者数) 最小的代理
+    3. 遇到验证（511）的代理冷却 `cooldown` 秒，连续遇到验证时冷却时间加倍，最多 `max_cooldown` 秒
+    4. 至少 `min_samples` 次请求后验证率超过 `max_captcha_rate`，或连续 `max_failures` 次连接失败的代理被移除
+    5. 使用者不应在没有代理时直接连接（暴露本机出口），`wait_acquire` 会等到有代理结束冷却，代理全部被移除时抛出异常
+    6. `probe` 只用标准库通过代理发起 CONNECT 请求测量延迟，可以对着本地的替身代理测试
+    7. 传入 `file` 时健康状况保存在 SQLite 中，多个进程各自持有代理池的副本（如通过 MultiProcessRunner 的 lifecycle_kwargs
+       传给子进程）时共用同一份健康状况，一个进程报告的冷却和移除对所有进程生效；领取（粘性分配）仍是各进程自己的
+    """
+
+    def __init__(
+        self,
+        proxies: Iterable[ProxyEndpoint],
+        cooldown: float = 300,
+        max_cooldown: float = 3600,
+        max_captcha_rate: float = 0.5,
+        min_samples: int = 5,
+        max_failures: int = 3,
+        latency_alpha: float = 0.3,
+        file: Optional[StrOrPath] = None,
+    ):
+        self.proxies = list({p.server: p for p in proxies}.values())
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.max_captcha_rate = max_captcha_rate
+        self.min_samples = min_samples
+        self.max_failures = max_failures
+        self.latency_alpha = latency_alpha
+
+        self.health: dict[str, ProxyHealth] = {p.server: ProxyHealth() for p in self.proxies}
+        self.assignments: dict[str, str] = dict()  # 使用者 -> 代理地址
+
+        self.file = file
+        self.conn: Optional[Connection] = None
+        if file is not None:
+            self._connect()
+
+    def _connect(self) -> None:
+        assert self.file is not None
+        self.conn = connect_sqlite(self.file)
+        self.conn.execute('PRAGMA busy_timeout=30000')
+        self.conn.executescript(_SCHEMA)
+        with transaction(self.conn):
+            self.conn.executemany(
+                'INSERT INTO proxy_health (server, health) VALUES (?, ?) ON CONFLICT (server) DO NOTHING',
+                ((server, health.model_dump_json()) for server, health in self.health.items()),
+            )
+        self._refresh()
+
+    def close(self) -> None:
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def __enter__(self) -> ProxyPool:
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def __getstate__(self) -> dict[str, Any]:
+        # 连接不能跨进程，子进程中重新打开同一个数据库
+        return {**self.__dict__, 'conn': None}
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        if self.file is not None:
+            self._connect()
+
+    def _refresh(self) -> None:
+        """从数据库读取其他进程报告后的健康状况"""
+        if self.conn is None:
+            return
+        for server, health in self.conn.execute('SELECT server, health FROM proxy_health'):
+            if server in self.health:
+                self.health[server] = ProxyHealth.model_validate_json(health)
+
+    @contextmanager
+    def _updating(self, proxy: ProxyEndpoint) -> Iterator[ProxyHealth]:
+        """修改代理的健康状况；共用数据库时在写事务中读取最新的状况再写回，不会覆盖其他进程的报告"""
+        if self.conn is None:
+            yield self.health[proxy.server]
+            return
+        with transaction(self.conn):
+            (raw,) = self.conn.execute(
+                'SELECT health FROM proxy_health WHERE server=?', (proxy.server,)
+            ).fetchone()
+            health = ProxyHealth.model_validate_json(raw)
+            yield health
+            self.conn.execute(
+                'UPDATE proxy_health SET health=? WHERE server=?', (health.model_dump_json(), proxy.server)
+            )
+        self.health[proxy.server] = health
+
+    def available(self) -> list[ProxyEndpoint]:
+        """未移除、不在冷却中的代理"""
+        self._refresh()
+        now = time()
+        return [
+            p
+            for p in self.proxies
+            if not self.health[p.server].removed and self.health[p.server].cooldown_until <= now
+        ]
+
+    def _score(self, proxy: ProxyEndpoint) -> float:
+        health = self.health[proxy.server]
+        users = sum(1 for s in self.assignments.values() if s == proxy.server)
+        latency = health.latency if health.latency is not None else 1.0
+        return latency * (1 + 4 * health.captcha_rate) * (1 + users)
+
+    def acquire(self, key: str) -> Optional[ProxyEndpoint]:
+        """为使用者分配代理，没有可用代理时返回 None"""
+        available = self.available()
+        server = self.assignments.get(key)
+        for p in available:
+            if p.server == server:
+                return p
+
+        self.assignments.pop(key, None)
+        if not available:
+            logger.warning(f'没有可用的代理分配给 "{key}"')
+            return None
+        # 分数相同时按 key 散列选择，多个进程各自持有代理池的副本时也能分散到不同代理
+        proxy = min(available, key=lambda p: (self._score(p), crc32(f'{key}@{p.server}'.encode())))
+        self.assignments[key] = proxy.server
+        logger.debug(f'"{key}" 分配到代理 {proxy.server}')
+        return proxy
+
+    async def wait_acquire(self, key: str, timeout: Optional[float] = None) -> ProxyEndpoint:
+        """
+        为使用者分配代理，没有可用代理时等到最早的冷却结束
+
+        代理全部被移除或等待超过 `timeout` 秒时抛出 NoProxyAvailableError
+        """
+        deadline = None if timeout is None else time() + timeout
+        while (proxy := self.acquire(key)) is None:
+            cooling = [h.cooldown_until for h in self.health.values() if not h.removed]
+            if not cooling:
+                raise NoProxyAvailableError(key, f'代理池中的代理已全部被移除，无法为 "{key}" 分配代理')
+            wake = min(cooling)
+            if deadline is not None and wake > deadline:
+                raise NoProxyAvailableError(key, f'等待 {timeout}s 后仍没有可用的代理分配给 "{key}"')
+            logger.info(f'"{key}" 等待代理冷却结束，{max(wake - time(), 0):.0f}s')
+            await asyncio.sleep(max(wake - time(), 0))
+        return proxy
+
+    def release(self, key: str) -> None:
+        self.assignments.pop(key, None)
+
+    def context_kwargs(self, key: str, context_kwargs: Optional[dict[str, Any]] = None) -> dict[str, Any]:
+        """在上下文参数中加上分配到的代理，没有可用代理时抛出 NoProxyAvailableError"""
+        proxy = self.acquire(key)
+        if proxy is None:
+            raise NoProxyAvailableError(key, f'没有可用的代理分配给 "{key}"')
+        return {**(context_kwargs or dict()), 'proxy': proxy.playwright_proxy()}
+
+    def _check_removal(self, proxy: ProxyEndpoint, health: ProxyHealth) -> None:
+        if health.removed:
+            return
+        if health.requests >= self.min_samples and health.captcha_rate > self.max_captcha_rate:
+            reason = f'验证率 {health.captcha_rate:.0%}'
+        elif health.consecutive_failures >= self.max_failures:
+            reason = f'连续 {health.consecutive_failures} 次连接失败'
+        else:
+            return
+        health.removed = True
+        logger.error(f'移除代理 {proxy.server}：{reason}')
+
+    def report_success(self, proxy: ProxyEndpoint, latency: Optional[float] = None) -> None:
+        with self._updating(proxy) as health:
+            health.requests += 1
+            health.consecutive_captchas = 0
+            health.consecutive_failures = 0
+            if latency is not None:
+                health.latency = (
+                    latency
+                    if health.latency is None
+                    else self.latency_alpha * latency + (1 - self.latency_alpha) * health.latency
+                )
+
+    def report_captcha(self, proxy: ProxyEndpoint) -> None:
+        """代理遇到验证，冷却后再分配"""
+        with self._updating(proxy) as health:
+            health.requests += 1
+            health.captchas += 1
+            health.consecutive_captchas += 1
+            cooldown = min(self.cooldown * 2 ** (health.consecutive_captchas - 1), self.max_cooldown)
+            health.cooldown_until = time() + cooldown
+            logger.warning(f'代理 {proxy.server} 遇到验证，冷却 {cooldown:.0f}s')
+            self._check_removal(proxy, health)
+
+    def report_failure(self, proxy: ProxyEndpoint) -> None:
+        """通过代理连接失败"""
+        with self._updating(proxy) as health:
+            health.consecutive_failures += 1
+            self._check_removal(proxy, health)
+
+    async def probe(
+        self, proxy: ProxyEndpoint, target: str = 'www.emag.ro:443', timeout: float = 10
+    ) -> Optional[float]:
+        """通过代理发起 CONNECT 请求，返回延迟（秒），失败时返回 None；结果会计入代理的健康状况"""
+        start = perf_counter()
+        writer = None
+        try:
+            async with asyncio.timeout(timeout):
+                reader, writer = await asyncio.open_connection(proxy.host, proxy.port)
+                request = f'CONNECT {target} HTTP/1.1\r\nHost: {target}\r\n'
+                if proxy.username is not None:
+                    credentials = b64encode(f'{proxy.username}:{proxy.password or ""}'.encode()).decode()
+                    request += f'Proxy-Authorization: Basic {credentials}\r\n'
+                writer.write(f'{request}\r\n'.encode())
+                await writer.drain()
+                status_line = await reader.readline()
+        except (OSError, TimeoutError) as e:
+            logger.warning(f'探测代理 {proxy.server} 失败 {e!r}')
+            self.report_failure(proxy)
+            return None
+        finally:
+            if writer is not None:
+                writer.close()
+
+        parts = status_line.decode('latin-1').split()
+        if len(parts) < 2 or parts[1] != '200':
+            logger.warning(f'代理 {proxy.server} 拒绝了 CONNECT "{status_line.decode("latin-1").strip()}"')
+            self.report_failure(proxy)
+            return None
+
+        latency = perf_counter() - start
+        self.report_success(proxy, latency)
+        return latency
+
+    async def probe_all(
+        self, target: str = 'www.emag.ro:443', timeout: float = 10
+    ) -> dict[str, Optional[float]]:
+        """并发探测全部未移除的代理"""
+        self._refresh()
+        proxies = [p for p in self.proxies if not self.health[p.server].removed]
+        latencies = await asyncio.gather(*(self.probe(p, target, timeout) for p in proxies))
+        return {p.server: latency for p, latency in zip(proxies, latencies)}
@@ -0,0 +1,132 @@
+"""有界的重试策略"""
+
+from __future__ import annotations
+
+import asyncio
+from collections import Counter
+from random import uniform
+from time import perf_counter
+from typing import TYPE_CHECKING
+
+from scraper_utils.exceptions.browser_exception import PlaywrightError
+
+from .exceptions import RetryableError, RetryExhaustedError
+from .logger import logger as _logger
+
+if TYPE_CHECKING:
+    from typing import Awaitable, Callable, Optional
+
+    from loguru import Logger
+
+
+class RetryStats:
+    """各操作的尝试、重试、成功、放弃次数"""
+
+    def __init__(self):
+        self.counters: dict[str, Counter[str]] = dict()
+
+    def record(self, operation: str, event: str) -> None:
+        self.counters.setdefault(operation, Counter())[event] += 1
+
+    def give_ups(self, operation: Optional[str] = None) -> int:
+        if operation is not None:
+            return self.counters.get(operation, Counter())['give_up']
+        return sum(c['give_up'] for c in self.counters.values())
+
+    def report(self) -> str:
+        return '，'.join(
+            f'{operation} 尝试 {c["attempt"]} 次、重试 {c["retry"]} 次、成功 {c["success"]} 次、放弃 {c["give_up"]} 次'
+            for operation, c in sorted(self.counters.items())
+        )
+
+
+# 同一进程内的所有操作共享统计
+retry_stats = RetryStats()
+
+
+class RetryPolicy:
+    """
+    有界的重试策略
+
+    ---
+
+    1. 最多尝试 `max_attempts` 次，第 n 次失败后等待 `base_delay * 2 ** (n - 1)` 秒（不超过 `max_delay`），
+       并乘以 [1 - `jitter`, 1] 之间的随机系数，避免多个任务同时重试
+    2. 传入 `deadline` 时，所有尝试和等待的总耗时不超过该秒数，超时的尝试会被取消
+    3. 只重试 `retry_on` 中的异常，其他异常（如 CaptchaError）直接抛出；用尽次数或超过期限时抛出 RetryExhaustedError
+    """
+
+    def __init__(
+        self,
+        operation: str,
+        max_attempts: int = 5,
+        base_delay: float = 0.5,
+        max_delay: float = 8,
+        jitter: float = 0.5,
+        deadline: Optional[float] = None,
+        retry_on: tuple[type[BaseException], ...] = (PlaywrightError, RetryableError),
+        stats: RetryStats = retry_stats,
+    ):
+        if max_attempts < 1:
+            raise ValueError(f'最大尝试次数必须为正整数，而不是 {max_attempts}')
+        if not 0 <= jitter <= 1:
+            raise ValueError(f'jitter 必须在 [0, 1] 之间，而不是 {jitter}')
+
+        self.operation = operation
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.deadline = deadline
+        self.retry_on = retry_on
+        self.stats = stats
+
+    def backoff(self, attempt: int) -> float:
+        """第 `attempt` 次失败后的等待秒数"""
+        delay = min(self.base_delay * 2 ** (attempt - 1), self.max_delay)
+        return delay * uniform(1 - self.jitter, 1)
+
+    async def run[T](self, fn: Callable[[], Awaitable[T]], logger: Logger = _logger) -> T:
+        """按策略执行 `fn`，返回第一次成功的结果"""
+        start = perf_counter()
+        reason = ''
+        attempt = 0
+        while attempt < self.max_attempts:
+            remaining = None if self.deadline is None else self.deadline - (perf_counter() - start)
+            if remaining is not None and remaining <= 0:
+                reason = f'超过 {self.deadline}s 的期限'
+                break
+
+            attempt += 1
+            self.stats.record(self.operation, 'attempt')
+            timeout = asyncio.timeout(remaining)
+            try:
+                async with timeout:
+                    result = await fn()
+            except TimeoutError:
+                if not timeout.expired():
+                    raise
+                reason = f'超过 {self.deadline}s 的期限'
+                break
+            except self.retry_on as e:
+                reason = f'{e}'
+                if attempt >= self.max_attempts:
+                    break
+                delay = self.backoff(attempt)
+                # 等待后已经超过期限，不再重试
+                if self.deadline is not None and perf_counter() - start + delay >= self.deadline:
+                    reason = f'{reason}，下次重试将超过 {self.deadline}s 的期限'
+                    break
+                logger.warning(
+                    f'{self.operation} 第 {attempt}/{self.max_attempts} 次失败，{delay:.2f}s 后重试\n{e}'
+                )
+                self.stats.record(self.operation, 'retry')
+                await asyncio.sleep(delay)
+            else:
+                self.stats.record(self.operation, 'success')
+                return result
+
+        self.stats.record(self.operation, 'give_up')
+        raise RetryExhaustedError(
+            self.operation, attempt, f'{self.operation} 尝试 {attempt} 次后放弃：{reason}'
+        )
@@ -0,0 +1 @@
+"""运行器"""
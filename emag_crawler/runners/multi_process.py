@@ -0,0 +1,387 @@
+"""多进程分片爬取"""
+
+from __future__ import annotations
+
+import asyncio
+from collections import Counter, deque
+from multiprocessing import get_context
+from os import cpu_count, environ
+from queue import Empty
+from typing import TYPE_CHECKING
+
+from ..logger import WORKER_ID_ENV, logger
+from ..models import dump_product_cards, load_product_cards
+from ..profiles import PROFILES
+
+if TYPE_CHECKING:
+    from multiprocessing.context import SpawnProcess
+    from multiprocessing.queues import Queue
+    from typing import Any, Iterable, Optional
+
+    from loguru import Message, Record
+    from playwright.async_api import BrowserContext
+
+    from ..freshness import CrawlPlanItem
+    from ..models import ProductCardItem
+    from ..profiling import CategoryProfiler
+
+
+_spawn = get_context('spawn')  # Playwright 不能在 fork 出的子进程中使用
+
+
+def _worker_log_format(worker_id: int):
+    """子进程日志格式，带上进程编号，类目日志再带上类目"""
+
+    def fmt(record: Record) -> str:
+        category = ' [{extra[category]}]' if 'category' in record['extra'] else ''
+        return (
+            f'[{{time:HH:mm:ss}}] [{{level:.3}}] [W{worker_id}] '
+            f'[{{name}}:{{function}}:{{line}}]{category} >>> {{message}}\n{{exception}}'
+        )
+
+    return fmt
+
+
+def _worker_main(
+    worker_id: int,
+    inbox: Queue,
+    outbox: Queue,
+    browser_args: tuple,
+    browser_kwargs: dict[str, Any],
+    context_kwargs: dict[str, Any],
+    lifecycle_kwargs: dict[str, Any],
+    concurrency: int,
+    http_listing: bool,
+    cart_shards: int,
+    profiler: Optional[CategoryProfiler],
+) -> None:
+    """子进程入口：独立的浏览器和事件循环，从 inbox 取类目，把结果和日志发到 outbox"""
+
+    def sink(message: Message) -> None:
+        outbox.put(('log', worker_id, message.record['level'].name, str(message)))
+
+    logger.add(sink, format=_worker_log_format(worker_id), colorize=False)
+
+    asyncio.run(
+        _worker_loop(
+            worker_id,
+            inbox,
+            outbox,
+            browser_args,
+            browser_kwargs,
+            context_kwargs,
+            lifecycle_kwargs,
+            concurrency,
+            http_listing,
+            cart_shards,
+            profiler,
+        )
+    )
+
+
+async def _worker_loop(
+    worker_id: int,
+    inbox: Queue,
+    outbox: Queue,
+    browser_args: tuple,
+    browser_kwargs: dict[str, Any],
+    context_kwargs: dict[str, Any],
+    lifecycle_kwargs: dict[str, Any],
+    concurrency: int,
+    http_listing: bool,
+    cart_shards: int,
+    profiler: Optional[CategoryProfiler],
+) -> None:
+    from contextlib import AsyncExitStack
+
+    from scraper_utils.exceptions.browser_exception import PlaywrightError
+    from scraper_utils.utils.browser_util import BrowserManager
+
+    from ..context_lifecycle import ManagedContext
+    from ..exceptions import CaptchaError
+    from ..http_fetch import HttpListingFetcher
+    from ..workers.category_page import CategoryPageWorker
+
+    async def warm_fetcher(managed: ManagedContext, context: BrowserContext) -> Optional[HttpListingFetcher]:
+        """用当前上下文预热 HTTP 会话，出错时返回 None，该类目改用浏览器"""
+        fetcher = HttpListingFetcher(context, proxy_pool=managed.proxy_pool, proxy_key=managed.proxy_key)
+        try:
+            await fetcher.warm()
+        except (CaptchaError, PlaywrightError) as e:
+            logger.warning(f'预热 HTTP 会话时出错，改用浏览器\n{e}')
+            await fetcher.close()
+            return None
+        return fetcher
+
+    async def consume(slot: int) -> None:
+        # 每个并发的上下文用不同的 key 领取代理
+        managed = ManagedContext(
+            bm, context_kwargs, **{'proxy_key': f'W{worker_id}-{slot}', **lifecycle_kwargs}
+        )
+        # 分担加购阶段的上下文，各自有独立的购物车、会话槽位和代理
+        cart_managed = [
+            ManagedContext(
+                bm, context_kwargs, **{'proxy_key': f'W{worker_id}-{slot}-{k}', **lifecycle_kwargs}
+            )
+            for k in range(1, cart_shards + 1)
+        ]
+        fetcher: Optional[HttpListingFetcher] = None  # 上下文回收后重新预热
+        while True:
+            task: Optional[tuple[str, dict[str, Any]]] = await asyncio.to_thread(inbox.get)
+            if task is None:
+                break
+            category, worker_kwargs = task
+            # 单个类目出错（包括打开上下文时）只让该类目失败，不影响进程中的其他类目
+            try:
+                async with AsyncExitStack() as stack:
+                    context = await stack.enter_async_context(managed.use())
+                    if not worker_kwargs.get('skip_cart'):
+                        worker_kwargs = {
+                            **worker_kwargs,
+                            'cart_contexts': [await stack.enter_async_context(m.use()) for m in cart_managed],
+                        }
+                    # 跳过加购阶段的类目用 HTTP 获取类目页
+                    if http_listing and worker_kwargs.get('skip_cart'):
+                        if fetcher is None or fetcher.context is not context:
+                            if fetcher is not None:
+                                await fetcher.close()
+                            fetcher = await warm_fetcher(managed, context)
+                        worker_kwargs = {**worker_kwargs, 'listing_fetcher': fetcher}
+                    w = CategoryPageWorker(context, category, **worker_kwargs)
+                    result = await (w.start_scrape() if profiler is None else profiler.scrape(w))
+            except Exception as e:
+                logger.error(f'爬取 "{category}" 出错\n{e!r}')
+                outbox.put(('failed', worker_id, category, repr(e)))
+                continue
+            if w.error is not None:
+                outbox.put(('failed', worker_id, category, w.error))
+                continue
+            # 验证率按类目计算，成功和验证都要报告给代理池
+            for m in (managed, *cart_managed):
+                if w.continuable:
+                    m.report_success()
+                else:
+                    m.report_captcha()
+            outbox.put(('done', worker_id, category, dump_product_cards(result), w.complete))
+        if fetcher is not None:
+            await fetcher.close()
+        for m in (managed, *cart_managed):
+            await m.close()
+
+    logger.info(f'进程 W{worker_id} 启动')
+    async with BrowserManager(*browser_args, **browser_kwargs) as bm:
+        await asyncio.gather(*(consume(i) for i in range(concurrency)))
+    logger.info(f'进程 W{worker_id} 结束')
+
+
+class MultiProcessRunner:
+    """
+    把类目分片到 N 个子进程中爬取，每个子进程有自己的浏览器和事件循环
+
+    ---
+
+    1. 每个子进程同时最多分配 `concurrency` 个类目，做完一个再分配下一个，爬得快的进程自然会分到更多类目
+    2. 子进程的结果和日志都汇总到主进程
+    3. 子进程崩溃时，把它未完成的类目放回队首并重启一个子进程，每个类目最多尝试 `max_category_attempts` 次
+    4. 单个类目爬取出错时只把该类目放回队首，同样最多尝试 `max_category_attempts` 次
+    5. 传入 `plan`（FreshnessPlanner.plan 的结果）时，计划中的类目按计划的页数爬取、按计划决定是否加购；
+       `http_listing` 为 True 时，跳过加购阶段的类目用 HttpListingFetcher 获取类目页，不在浏览器中渲染
+    6. `cart_shards` 大于 0 时，每个并发的类目另外打开 `cart_shards` 个上下文，与主上下文一起分担每一页的加购阶段
+    7. 传入 `profile`（PROFILES 中的配置名）时，子进程的浏览器用该配置的启动参数，上下文也都应用该配置
+    8. 传入 `profiler` 时，每个子进程用它的副本对采样到的类目做性能分析，分析结果由子进程保存
+    """
+
+    worker_main = staticmethod(_worker_main)  # 子进程入口，测试时可以换成不启动浏览器的替身
+
+    def __init__(
+        self,
+        categories: Iterable[str],
+        browser_args: tuple = (),
+        browser_kwargs: Optional[dict[str, Any]] = None,
+        context_kwargs: Optional[dict[str, Any]] = None,
+        lifecycle_kwargs: Optional[dict[str, Any]] = None,
+        processes: Optional[int] = None,
+        concurrency: int = 1,
+        max_restarts: int = 3,
+        max_category_attempts: int = 2,
+        plan: Optional[Iterable[CrawlPlanItem]] = None,
+        http_listing: bool = False,
+        cart_shards: int = 0,
+        profile: Optional[str] = None,
+        profiler: Optional[CategoryProfiler] = None,
+    ):
+        self.categories = list(dict.fromkeys(categories))
+        self.browser_args = browser_args
+        self.browser_kwargs = browser_kwargs or dict()
+        self.context_kwargs = context_kwargs or dict()
+        self.lifecycle_kwargs = lifecycle_kwargs or dict()  # 传给 ManagedContext 的回收上限
+        if profile is not None:
+            if profile not in PROFILES:
+                raise ValueError(f'没有名为 "{profile}" 的浏览器配置，可选 {list(PROFILES)}')
+            # 显式传入的参数优先
+            self.browser_kwargs = {**PROFILES[profile].browser_kwargs(), **self.browser_kwargs}
+            self.lifecycle_kwargs = {'profile': PROFILES[profile], **self.lifecycle_kwargs}
+        self.processes = min(processes or cpu_count() or 1, max(len(self.categories), 1))
+        self.concurrency = concurrency
+        self.max_restarts = max_restarts
+        self.max_category_attempts = max_category_attempts
+        self.worker_kwargs: dict[str, dict[str, Any]] = {i.category: i.worker_kwargs() for i in plan or ()}
+        self.http_listing = http_listing
+        self.cart_shards = cart_shards
+        self.profiler = profiler
+
+        self.results: dict[str, list[ProductCardItem]] = dict()
+        self.completes: dict[str, bool] = dict()  # 各类目是否完整爬取（未出错、未触发验证）
+        self.failed: list[str] = list()  # 多次出错或导致子进程崩溃而放弃的类目
+
+        self.logger = logger
+
+        self._outbox: Queue = _spawn.Queue()
+        self._workers: dict[int, tuple[SpawnProcess, Queue]] = dict()
+        self._in_flight: dict[int, set[str]] = dict()
+        self._attempts: Counter[str] = Counter()
+        self._restarts = 0
+        self._next_worker_id = 0
+
+    def _spawn_worker(self) -> None:
+        worker_id = self._next_worker_id
+        self._next_worker_id += 1
+
+        inbox: Queue = _spawn.Queue()
+        process = _spawn.Process(
+            target=self.worker_main,
+            args=(
+                worker_id,
+                inbox,
+                self._outbox,
+                self.browser_args,
+                self.browser_kwargs,
+                self.context_kwargs,
+                self.lifecycle_kwargs,
+                self.concurrency,
+                self.http_listing,
+                self.cart_shards,
+                self.profiler,
+            ),
+            name=f'emag-crawler-W{worker_id}',
+            daemon=True,
+        )
+        # 子进程启动时继承环境变量，导入 logger 时就不会再自己写日志文件
+        environ[WORKER_ID_ENV] = str(worker_id)
+        try:
+            process.start()
+        finally:
+            del environ[WORKER_ID_ENV]
+        self._workers[worker_id] = (process, inbox)
+        self._in_flight[worker_id] = set()
+
+    def _retry(self, category: str, pending: deque[str]) -> None:
+        """未完成的类目放回队首，尝试次数用尽时放弃"""
+        if self._attempts[category] >= self.max_category_attempts:
+            self.logger.error(f'"{category}" 已尝试 {self._attempts[category]} 次，放弃')
+            self.failed.append(category)
+        else:
+            pending.appendleft(category)
+
+    def _handle_message(self, message: tuple, pending: deque[str]) -> None:
+        kind, worker_id = message[0], message[1]
+
+        if kind == 'log':
+            _, _, level, text = message
+            self.logger.opt(raw=True).log(level, text)
+
+        elif kind == 'done':
+            _, _, category, items, complete = message
+            self._in_flight.get(worker_id, set()).discard(category)
+            # 子进程崩溃前发出的结果可能和重新分配后的结果重复，只保留第一份
+            if category in self.results:
+                return
+            # 子进程中已经验证过，这里不再重复验证
+            self.results[category] = load_product_cards(items, trusted=True)
+            self.completes[category] = complete
+            self.logger.info(
+                f'W{worker_id} 完成 "{category}"，共 {len(items)} 个产品 '
+                f'({len(self.results)}/{len(self.categories)})'
+            )
+
+        elif kind == 'failed':
+            _, _, category, error = message
+            self._in_flight.get(worker_id, set()).discard(category)
+            if category in self.results:
+                return
+            self.logger.error(f'W{worker_id} 爬取 "{category}" 出错 {error}')
+            self._retry(category, pending)
+
+    def _drain(self, timeout: Optional[float], pending: deque[str]) -> None:
+        """处理 outbox 中的消息，最多阻塞 `timeout` 秒等待第一条"""
+        try:
+            message = self._outbox.get(timeout=timeout)
+        except Empty:
+            return
+        self._handle_message(message, pending)
+        while True:
+            try:
+                message = self._outbox.get_nowait()
+            except Empty:
+                return
+            self._handle_message(message, pending)
+
+    def _reap(self, pending: deque[str]) -> None:
+        """回收崩溃的子进程，把它未完成的类目放回队首，按需重启"""
+        for worker_id, (process, _) in list(self._workers.items()):
+            if process.is_alive():
+                continue
+
+            del self._workers[worker_id]
+            lost = self._in_flight.pop(worker_id) - self.results.keys()
+            self.logger.error(
+                f'进程 W{worker_id} 异常退出 exitcode={process.exitcode}，未完成 {sorted(lost)}'
+            )
+
+            for category in lost:
+                self._retry(category, pending)
+
+            if self._restarts < self.max_restarts and (pending or any(self._in_flight.values())):
+                self._restarts += 1
+                self.logger.warning(f'重启子进程 ({self._restarts}/{self.max_restarts})')
+                self._spawn_worker()
+
+    def _assign(self, pending: deque[str]) -> None:
+        """给空闲的子进程分配类目"""
+        for worker_id, (_, inbox) in self._workers.items():
+            in_flight = self._in_flight[worker_id]
+            while pending and len(in_flight) < self.concurrency:
+                category = pending.popleft()
+                self._attempts[category] += 1
+                in_flight.add(category)
+                inbox.put((category, self.worker_kwargs.get(category, {})))
+
+    def run(self) -> dict[str, list[ProductCardItem]]:
+        """开始爬取，返回各类目的爬取结果"""
+        pending = deque(self.categories)
+        self.logger.info(f'启动 {self.processes} 个子进程爬取 {len(pending)} 个类目')
+
+        for _ in range(self.processes):
+            self._spawn_worker()
+
+        try:
+            while self._workers and (pending or any(self._in_flight.values())):
+                self._assign(pending)
+                self._drain(timeout=1, pending=pending)
+                self._reap(pending)
+
+            if pending:
+                self.logger.error(f'没有可用的子进程，{len(pending)} 个类目未爬取')
+                self.failed.extend(pending)
+
+        finally:
+            for process, inbox in self._workers.values():
+                for _ in range(self.concurrency):
+                    inbox.put(None)
+            for process, _ in self._workers.values():
+                process.join(timeout=30)
+                if process.is_alive():
+                    process.terminate()
+            self._drain(timeout=0, pending=pending)
+
+        return self.results
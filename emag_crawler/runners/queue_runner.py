@@ -0,0 +1,145 @@
+"""从任务队列领取类目爬取"""
+
+from __future__ import annotations
+
+import asyncio
+from os import getpid
+from socket import gethostname
+from typing import TYPE_CHECKING
+
+from ..exceptions import LeaseLostError
+from ..logger import logger
+from ..workers.category_page import CategoryPageWorker
+
+if TYPE_CHECKING:
+    from typing import Any, Awaitable, Callable, Iterable, Optional, Sequence
+
+    from playwright.async_api import BrowserContext
+
+    from ..freshness import CrawlPlanItem
+    from ..http_fetch import HttpListingFetcher
+    from ..models import ProductCardItem
+    from ..profiling import CategoryProfiler
+    from ..work_queue import Lease, WorkQueue
+
+    type ResultCallback = Callable[[str, list[ProductCardItem], bool], Awaitable[None]]
+    type WorkerFactory = Callable[..., CategoryPageWorker]
+
+
+class QueueRunner:
+    """
+    从 WorkQueue 不断领取类目并爬取，多个 QueueRunner（可在不同进程或机器上）可以共享同一个队列
+
+    爬取期间每隔 `heartbeat_interval` 秒续约一次；续约失败说明任务已被收回，立即放弃该类目
+
+    队列的操作都在线程中执行，数据库繁忙时不会阻塞同一进程中正在爬取的页面
+
+    传入 `plan`（FreshnessPlanner.plan 的结果）时，计划中的类目按计划的页数爬取、按计划决定是否加购；
+    同时传入 `listing_fetcher` 时，跳过加购阶段的类目用它获取类目页，不在浏览器中渲染
+
+    传入 `cart_contexts` 时，这些上下文与 `context` 一起分担每一页的加购阶段
+    """
+
+    def __init__(
+        self,
+        queue: WorkQueue,
+        context: BrowserContext,
+        on_result: Optional[ResultCallback] = None,
+        owner: Optional[str] = None,
+        visibility_timeout: float = 300,
+        heartbeat_interval: float = 60,
+        idle_interval: float = 10,
+        profiler: Optional[CategoryProfiler] = None,
+        worker_factory: WorkerFactory = CategoryPageWorker,
+        plan: Optional[Iterable[CrawlPlanItem]] = None,
+        listing_fetcher: Optional[HttpListingFetcher] = None,
+        cart_contexts: Sequence[BrowserContext] = (),
+    ):
+        self.queue = queue
+        self.context = context
+        self.on_result = on_result
+        self.owner = owner or f'{gethostname()}:{getpid()}'
+        self.visibility_timeout = visibility_timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.idle_interval = idle_interval  # 队列暂时为空时的等待间隔
+        self.profiler = profiler  # 对采样到的类目做性能分析
+        self.worker_factory = worker_factory  # 用上下文、类目和计划的参数创建 worker
+        self.worker_kwargs: dict[str, dict[str, Any]] = {i.category: i.worker_kwargs() for i in plan or ()}
+        self.listing_fetcher = listing_fetcher  # 应使用与 context 相同的上下文预热
+        self.cart_contexts = cart_contexts
+
+    async def _heartbeat(self, lease: Lease) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            lease = await asyncio.to_thread(self.queue.heartbeat, lease, self.visibility_timeout)
+
+    async def run_one(self, lease: Lease) -> None:
+        """爬取一个已领取的类目，爬完后确认或报告失败"""
+        category = lease.category
+        worker_kwargs = self.worker_kwargs.get(category, {})
+        if self.listing_fetcher is not None and worker_kwargs.get('skip_cart'):
+            worker_kwargs = {**worker_kwargs, 'listing_fetcher': self.listing_fetcher}
+        if self.cart_contexts and not worker_kwargs.get('skip_cart'):
+            worker_kwargs = {**worker_kwargs, 'cart_contexts': self.cart_contexts}
+        worker = self.worker_factory(self.context, category, **worker_kwargs)
+
+        scrape_task = asyncio.create_task(
+            worker.start_scrape() if self.profiler is None else self.profiler.scrape(worker)
+        )
+        heartbeat_task = asyncio.create_task(self._heartbeat(lease))
+        await asyncio.wait((scrape_task, heartbeat_task), return_when=asyncio.FIRST_COMPLETED)
+
+        # 续约失败，任务可能已被其他实例领取，不能再提交结果
+        if heartbeat_task.done():
+            scrape_task.cancel()
+            await asyncio.gather(scrape_task, return_exceptions=True)
+            logger.error(f'"{category}" 续约失败，放弃\n{heartbeat_task.exception()}')
+            return
+
+        heartbeat_task.cancel()
+        await asyncio.gather(heartbeat_task, return_exceptions=True)
+
+        try:
+            result = scrape_task.result()
+        except Exception as e:
+            logger.error(f'爬取 "{category}" 出错\n{e}')
+            try:
+                if await asyncio.to_thread(self.queue.fail, lease, repr(e)):
+                    logger.error(f'"{category}" 已进入死信')
+            except LeaseLostError as lle:
+                logger.error(lle)
+            return
+
+        if self.on_result is not None:
+            await self.on_result(category, result, worker.complete)
+
+        try:
+            if worker.error is not None:
+                dead = await asyncio.to_thread(self.queue.fail, lease, worker.error)
+                logger.error(f'"{category}" 爬取出错{"，已进入死信" if dead else "，稍后重试"}')
+            elif not worker.continuable:
+                dead = await asyncio.to_thread(self.queue.fail, lease, '触发验证', captcha=True)
+                logger.warning(f'"{category}" 触发验证{"，已进入死信" if dead else "，稍后重试"}')
+            elif worker.timed_out:
+                dead = await asyncio.to_thread(self.queue.fail, lease, '超过时间预算')
+                logger.warning(f'"{category}" 超过时间预算{"，已进入死信" if dead else "，稍后重试"}')
+            else:
+                await asyncio.to_thread(self.queue.ack, lease)
+                logger.success(f'"{category}" 完成')
+        except LeaseLostError as lle:
+            logger.error(lle)
+
+    async def run(self, stop_when_empty: bool = True) -> None:
+        """不断领取类目爬取，`stop_when_empty` 为 True 时队列为空就结束"""
+        logger.info(f'{self.owner} 开始从任务队列领取类目')
+        while True:
+            lease = await asyncio.to_thread(self.queue.lease, self.owner, self.visibility_timeout)
+            if lease is None:
+                if stop_when_empty:
+                    break
+                await asyncio.sleep(self.idle_interval)
+                continue
+
+            logger.info(f'领取 "{lease.category}"，第 {lease.attempts} 次')
+            await self.run_one(lease)
+        logger.info(f'{self.owner} 结束，队列状态 {dict(await asyncio.to_thread(self.queue.stats))}')
@@ -0,0 +1,243 @@
+"""会话的持久化与热启动"""
+
+from __future__ import annotations
+
+from json import dumps, loads
+from os import replace
+from pathlib import Path
+from re import search as re_search
+from time import perf_counter, time
+from typing import TYPE_CHECKING
+from uuid import uuid4
+
+from playwright.async_api import async_playwright
+from scraper_utils.constants.time_constant import MS1000
+from scraper_utils.exceptions.browser_exception import PlaywrightError
+from scraper_utils.utils.browser_util import abort_resources
+
+from .handlers.category_page import open_url as open_category_page
+from .logger import logger
+from .storage import data_dir
+from .utils import hide_cookie_banner, hide_webdriver
+
+if TYPE_CHECKING:
+    from typing import Any, Literal, Optional
+
+    from loguru import Logger
+    from playwright.async_api import Browser, BrowserContext, Page, Playwright
+    from scraper_utils.utils.browser_util import BrowserManager
+
+    from .storage import StrOrPath
+
+    type StorageState = dict[str, Any]
+    type StartMode = Literal['cold', 'warm', 'cdp']
+
+
+async def apply_storage_state(context: BrowserContext, state: StorageState) -> tuple[int, int]:
+    """把 storage_state 中的 cookies 和 localStorage 恢复到上下文，返回恢复的 cookies 数、源数"""
+    cookies = state.get('cookies') or list()
+    if cookies:
+        await context.add_cookies(cookies)
+
+    # localStorage 只能在对应源的页面中写入，所以用初始化脚本在页面加载前写入
+    origins = {
+        o['origin']: {i['name']: i['value'] for i in o.get('localStorage', ())}
+        for o in state.get('origins') or ()
+    }
+    origins = {k: v for k, v in origins.items() if v}
+    if origins:
+        await context.add_init_script(
+            script=(
+                f'(() => {{ const items = ({dumps(origins)})[location.origin]; if (!items) return; '
+                'for (const [k, v] of Object.entries(items)) '
+                '{ if (localStorage.getItem(k) === null) localStorage.setItem(k, v); } })();'
+            )
+        )
+    return len(cookies), len(origins)
+
+
+class SessionStore:
+    """
+    按槽位保存浏览器上下文的 storage_state（cookies 和 localStorage）
+
+    每个并发的上下文应该使用不同的槽位，避免多个上下文共用同一份 cookies
+    """
+
+    def __init__(self, root: StrOrPath = data_dir / 'sessions', max_age: Optional[float] = 24 * 3600):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_age = max_age  # 超过该秒数的会话视为过期，不再恢复
+
+    def path(self, slot: str) -> Path:
+        if re_search(r'^[A-Za-z0-9_-]+$', slot) is None:
+            raise ValueError(f'"{slot}" 不符合槽位规范')
+        return self.root / f'{slot}.json'
+
+    def load(self, slot: str) -> Optional[StorageState]:
+        """读取槽位的 storage_state，不存在、已过期或已损坏时返回 None"""
+        path = self.path(slot)
+        if not path.exists():
+            return None
+        if self.max_age is not None and time() - path.stat().st_mtime > self.max_age:
+            logger.info(f'会话槽位 "{slot}" 已过期')
+            return None
+        try:
+            return loads(path.read_text(encoding='utf-8'))
+        except ValueError:
+            logger.warning(f'会话槽位 "{slot}" 的文件已损坏')
+            return None
+
+    def save(self, slot: str, state: StorageState) -> None:
+        path = self.path(slot)
+        # 先写临时文件再改名，中途退出不会留下写了一半的文件
+        temp = path.with_name(f'{slot}.{uuid4().hex}.tmp')
+        temp.write_text(dumps(state), encoding='utf-8')
+        replace(temp, path)
+
+    def discard(self, slot: str) -> None:
+        """删除槽位，遇到验证后保存的 cookies 不应该再被恢复"""
+        self.path(slot).unlink(missing_ok=True)
+
+    async def restore(self, context: BrowserContext, slot: str) -> bool:
+        """把槽位的 cookies 和 localStorage 恢复到上下文，返回是否恢复成功"""
+        state = self.load(slot)
+        if state is None:
+            return False
+
+        cookies, origins = await apply_storage_state(context, state)
+        logger.info(f'从会话槽位 "{slot}" 恢复了 {cookies} 个 cookies、{origins} 个源的 localStorage')
+        return True
+
+    async def persist(self, context: BrowserContext, slot: str) -> bool:
+        """保存上下文当前的 storage_state 到槽位，返回是否保存成功"""
+        try:
+            state = await context.storage_state()
+        except PlaywrightError as pe:
+            logger.warning(f'读取会话槽位 "{slot}" 的 storage_state 时出错\n{pe}')
+            return False
+        self.save(slot, state)
+        return True
+
+
+class WarmSession:
+    """
+    热启动的浏览器上下文
+
+    ---
+
+    1. 传入 `cdp_endpoint` 时先尝试连接该地址上常驻的浏览器（如 `chrome --remote-debugging-port=9222`），
+       直接使用它的默认上下文，连接失败时再用 `bm` 新建上下文
+    2. 新建的上下文会从 `store` 的 `slot` 槽位恢复 cookies 和 localStorage，没有可恢复的会话时为冷启动；
+       常驻浏览器的上下文同样会恢复会话、隐藏 cookie 提示，并补上 bm 新建上下文时的资源屏蔽和隐身
+    3. 退出时把上下文的 storage_state 保存回槽位，下次运行即可热启动
+    4. `first_product` 记录从启动到第一个产品卡片出现的耗时，用于比较冷、热启动
+    """
+
+    def __init__(
+        self,
+        bm: Optional[BrowserManager] = None,
+        context_kwargs: Optional[dict[str, Any]] = None,
+        store: Optional[SessionStore] = None,
+        slot: str = 'default',
+        cdp_endpoint: Optional[str] = None,
+    ):
+        if bm is None and cdp_endpoint is None:
+            raise ValueError('bm 和 cdp_endpoint 至少要传入一个')
+
+        self.bm = bm
+        self.context_kwargs = context_kwargs or dict()
+        self.store = store or SessionStore()
+        self.slot = slot
+        self.cdp_endpoint = cdp_endpoint
+
+        self.mode: Optional[StartMode] = None
+        self.context: Optional[BrowserContext] = None
+        self.startup_seconds: Optional[float] = None  # 获得可用上下文的耗时
+        self.time_to_first_product: Optional[float] = None
+
+        self._started_at = 0.0
+        self._playwright: Optional[Playwright] = None
+        self._browser: Optional[Browser] = None
+
+    async def _attach(self) -> Optional[BrowserContext]:
+        """连接常驻浏览器，失败时返回 None"""
+        assert self.cdp_endpoint is not None
+        self._playwright = await async_playwright().start()
+        try:
+            self._browser = await self._playwright.chromium.connect_over_cdp(
+                self.cdp_endpoint, timeout=5 * MS1000
+            )
+        except PlaywrightError as pe:
+            logger.warning(f'连接常驻浏览器 "{self.cdp_endpoint}" 失败\n{pe}')
+            await self._playwright.stop()
+            self._playwright = None
+            return None
+
+        if self._browser.contexts:
+            context = self._browser.contexts[0]
+        else:
+            context = await self._browser.new_context()
+        # 常驻浏览器的上下文不是由 bm 创建的，这里补上资源屏蔽和隐身
+        abort_res_types = self.context_kwargs.get('abort_res_types')
+        if abort_res_types:
+            await abort_resources(context, abort_res_types)
+        if self.context_kwargs.get('need_stealth'):
+            await hide_webdriver(context)
+        return context
+
+    async def _prepare(self, context: BrowserContext) -> bool:
+        """两种启动方式共同的准备：隐藏 cookie 提示、从槽位恢复会话，返回是否恢复了会话"""
+        await hide_cookie_banner(context)
+        return await self.store.restore(context, self.slot)
+
+    async def open(self) -> BrowserContext:
+        self._started_at = perf_counter()
+
+        context = None
+        if self.cdp_endpoint is not None:
+            context = await self._attach()
+            if context is not None:
+                await self._prepare(context)
+                self.mode = 'cdp'
+
+        if context is None:
+            if self.bm is None:
+                raise RuntimeError(f'无法连接常驻浏览器 "{self.cdp_endpoint}"，也没有传入 bm')
+            context = await self.bm.new_context(**self.context_kwargs)
+            self.mode = 'warm' if await self._prepare(context) else 'cold'
+
+        self.context = context
+        self.startup_seconds = perf_counter() - self._started_at
+        logger.info(f'会话槽位 "{self.slot}" {self.mode} 启动，耗时 {self.startup_seconds:.2f}s')
+        return context
+
+    async def first_product(self, url: str, logger: Logger = logger) -> Page:
+        """打开类目页，等到第一个产品卡片出现，记录从启动到此刻的耗时，返回该页面"""
+        assert self.context is not None
+        page = await open_category_page(self.context, url, logger, 'domcontentloaded')
+        await page.locator('css=div.card-item[data-offer-id]').first.wait_for(state='attached')
+        self.time_to_first_product = perf_counter() - self._started_at
+        logger.info(f'{self.mode} 启动后 {self.time_to_first_product:.2f}s 出现第一个产品')
+        return page
+
+    async def close(self, persist: bool = True) -> None:
+        """保存会话（`persist` 为 True 时）并关闭上下文；常驻浏览器只断开连接，不会关闭"""
+        if self.context is not None:
+            if persist:
+                await self.store.persist(self.context, self.slot)
+            if self.mode != 'cdp':
+                await self.context.close()
+            self.context = None
+        if self._browser is not None:
+            await self._browser.close()
+            self._browser = None
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+
+    async def __aenter__(self) -> BrowserContext:
+        return await self.open()
+
+    async def __aexit__(self, exc_type, *_) -> None:
+        # 出错退出时的会话可能已经触发了验证，不保存
+        await self.close(persist=exc_type is None)
@@ -0,0 +1,178 @@
+"""产品快照索引，用于增量（CDC）输出"""
+
+from __future__ import annotations
+
+from hashlib import blake2b
+from struct import pack
+from time import time
+from typing import TYPE_CHECKING
+
+from .models import ProductChange
+from .storage import connect_sqlite, data_dir, transaction
+
+if TYPE_CHECKING:
+    from typing import Iterable, Optional
+
+    from .models import ProductCardItem
+    from .storage import StrOrPath
+
+    type TrackedValues = tuple[Optional[float], Optional[float], Optional[int], Optional[int]]
+
+
+# 需要跟踪变化的字段，顺序与 TrackedValues 一致
+TRACKED_FIELDS: tuple[str, ...] = ('price', 'rating', 'rank', 'max_qty')
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS snapshot (
+    category TEXT NOT NULL,
+    pnk TEXT NOT NULL,
+    digest BLOB NOT NULL,
+    price REAL,
+    rating REAL,
+    rank INTEGER,
+    max_qty INTEGER,
+    updated_at REAL NOT NULL,
+    gone_at REAL,
+    PRIMARY KEY (category, pnk)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS snapshot_gone_at ON snapshot (gone_at) WHERE gone_at IS NOT NULL;
+'''
+
+
+def _digest(values: TrackedValues) -> bytes:
+    """计算跟踪字段的紧凑哈希（8 字节）"""
+    h = blake2b(digest_size=8)
+    for v in values:
+        # None 与任何数值都不会产生相同的字节
+        h.update(b'\x00' if v is None else b'\x01' + pack('<d', v))
+    return h.digest()
+
+
+class SnapshotIndex:
+    """
+    以 (类目, pnk) 为键的产品快照索引
+
+    每个产品只保存跟踪字段的值和它们的紧凑哈希，每次爬取后与索引对比，只输出新增、变化、消失的产品
+    """
+
+    def __init__(self, file: StrOrPath = data_dir / 'snapshot.db'):
+        # compact 时可以增量回收空闲页而不用整库 VACUUM
+        self.conn = connect_sqlite(file, auto_vacuum='INCREMENTAL')
+        self.conn.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self) -> SnapshotIndex:
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def update(
+        self,
+        category: str,
+        items: Iterable[ProductCardItem],
+        complete: bool = True,
+        fields: Iterable[str] = TRACKED_FIELDS,
+    ) -> list[ProductChange]:
+        """
+        将一次爬取结果与索引对比，写入索引并返回变化
+
+        - `complete` 为 False 时（如中途遇到验证）不会输出消失的产品
+        - `fields` 为本次参与对比的字段，其余跟踪字段沿用旧值（如未执行加购阶段时不对比 max_qty）
+        """
+        fields = set(fields)
+        compared = tuple(f in fields for f in TRACKED_FIELDS)
+        now = time()
+
+        old_rows: dict[str, tuple[bytes, TrackedValues, Optional[float]]] = {
+            pnk: (digest, (price, rating, rank, max_qty), gone_at)
+            for pnk, digest, price, rating, rank, max_qty, gone_at in self.conn.execute(
+                'SELECT pnk, digest, price, rating, rank, max_qty, gone_at FROM snapshot WHERE category=?',
+                (category,),
+            )
+        }
+
+        changes: list[ProductChange] = list()
+        upserts: list[tuple] = list()
+        seen: set[str] = set()
+
+        for item in items:
+            # 同一类目中重复出现的产品只取第一次（排行最靠前）
+            if item.pnk in seen:
+                continue
+            seen.add(item.pnk)
+
+            new_values: TrackedValues = (item.price, item.rating, item.rank, item.max_qty)
+            old = old_rows.get(item.pnk)
+
+            # 快照中没有，或者之前已经消失
+            if old is None or old[2] is not None:
+                values = new_values
+                changes.append(ProductChange(change='insert', category=category, pnk=item.pnk, item=item))
+            else:
+                old_digest, old_values, _ = old
+                values = tuple(n if c else o for n, o, c in zip(new_values, old_values, compared))  # type: ignore
+                digest = _digest(values)
+                if digest == old_digest:
+                    continue
+                changed = [i for i, (n, o) in enumerate(zip(values, old_values)) if n != o]
+                changes.append(
+                    ProductChange(
+                        change='update',
+                        category=category,
+                        pnk=item.pnk,
+                        item=item,
+                        changed_fields=[TRACKED_FIELDS[i] for i in changed],
+                        previous={TRACKED_FIELDS[i]: old_values[i] for i in changed},
+                    )
+                )
+
+            upserts.append((category, item.pnk, _digest(values), *values, now))
+
+        gone: list[tuple] = list()
+        if complete:
+            for pnk, (_, _, gone_at) in old_rows.items():
+                if pnk not in seen and gone_at is None:
+                    gone.append((now, category, pnk))
+                    changes.append(ProductChange(change='delete', category=category, pnk=pnk))
+
+        with transaction(self.conn):
+            self.conn.executemany(
+                'INSERT INTO snapshot (category, pnk, digest, price, rating, rank, max_qty, updated_at, gone_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, NULL) '
+                'ON CONFLICT (category, pnk) DO UPDATE SET '
+                'digest=excluded.digest, price=excluded.price, rating=excluded.rating, rank=excluded.rank, '
+                'max_qty=excluded.max_qty, updated_at=excluded.updated_at, gone_at=NULL',
+                upserts,
+            )
+            self.conn.executemany('UPDATE snapshot SET gone_at=? WHERE category=? AND pnk=?', gone)
+
+        return changes
+
+    def compact(self, retention: float = 30 * 24 * 3600) -> int:
+        """
+        压缩索引：删除消失超过 `retention` 秒的产品，增量回收空闲页，返回删除的行数
+
+        只扫描 gone_at 的部分索引，耗时与待删除的行数有关，与索引总量无关
+        """
+        with transaction(self.conn):
+            deleted = self.conn.execute(
+                'DELETE FROM snapshot WHERE gone_at IS NOT NULL AND gone_at < ?', (time() - retention,)
+            ).rowcount
+        # 每次 step 只回收一页，要取完全部结果
+        self.conn.execute('PRAGMA incremental_vacuum').fetchall()
+        self.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        self.conn.execute('PRAGMA optimize')
+        return deleted
+
+    def count(self, category: Optional[str] = None) -> int:
+        """索引中现存（未消失）的产品数"""
+        if category is None:
+            row = self.conn.execute('SELECT COUNT(*) FROM snapshot WHERE gone_at IS NULL').fetchone()
+        else:
+            row = self.conn.execute(
+                'SELECT COUNT(*) FROM snapshot WHERE category=? AND gone_at IS NULL', (category,)
+            ).fetchone()
+        return row[0]
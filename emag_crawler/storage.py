@@ -0,0 +1,57 @@
+"""本地持久化存储"""
+
+from __future__ import annotations
+
+import sqlite3
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from typing import Iterator, Literal, Optional
+
+    type StrOrPath = str | Path
+
+
+data_dir = Path.cwd() / 'data/'
+
+
+_AUTO_VACUUM_MODES = {'NONE': 0, 'FULL': 1, 'INCREMENTAL': 2}
+
+
+def connect_sqlite(
+    file: StrOrPath, auto_vacuum: Optional[Literal['NONE', 'FULL', 'INCREMENTAL']] = None
+) -> sqlite3.Connection:
+    """
+    打开（不存在时创建）一个 SQLite 数据库
+
+    使用 WAL 模式，读写互不阻塞，适合爬虫运行时频繁的小批量写入
+
+    `auto_vacuum` 只在新建数据库、切换到 WAL 之前设置才会生效，已有的数据库模式不同时会 VACUUM 一次
+    """
+    file = Path(file)
+    if str(file) != ':memory:':
+        file.parent.mkdir(parents=True, exist_ok=True)
+
+    conn = sqlite3.connect(file, isolation_level=None, check_same_thread=False)
+    if auto_vacuum is not None:
+        conn.execute(f'PRAGMA auto_vacuum={auto_vacuum}')
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != _AUTO_VACUUM_MODES[auto_vacuum]:
+            conn.execute('VACUUM')
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    return conn
+
+
+@contextmanager
+def transaction(conn: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+    """在一个事务内执行，出错时回滚"""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    else:
+        conn.execute('COMMIT')
@@ -3,6 +3,7 @@
 from __future__ import annotations
 
 from asyncio import sleep as async_sleep
+from math import ceil
 from pathlib import Path
 from re import compile as re_compile, search as re_search
 from time import perf_counter
@@ -25,6 +26,9 @@ if TYPE_CHECKING:
 
 cwd = Path.cwd()
 CART_PAGE_URL = 'https://www.emag.ro/cart/products'
+PAGE_SIZE = 60  # 类目页每页的产品数
+MAX_CRAWLABLE_PAGE = 5  # 每个类目最多爬取的页数
+SORT_ORDERS = ('priceasc', 'pricedesc', 'reviewsdesc', 'newest')  # 类目页支持的排序
 
 
 _track_url_patterns: tuple[Pattern[str], ...] = (
@@ -64,6 +68,17 @@ async def hide_cookie_banner(context_page: BrowserContextOrPage) -> None:
     await context_page.add_init_script(script=_hide_cookie_banner_js)
 
 
+_hide_webdriver_js: Optional[str] = None
+
+
+async def hide_webdriver(context_page: BrowserContextOrPage) -> None:
+    """隐藏 navigator.webdriver，用于没有经过 BrowserManager 隐身处理的上下文"""
+    global _hide_webdriver_js
+    if _hide_webdriver_js is None:
+        _hide_webdriver_js = await read_file(file=cwd / 'js/hide-webdriver.js', mode='str', async_mode=True)
+    await context_page.add_init_script(script=_hide_webdriver_js)
+
+
 async def wait_for_element(locator: Locator, interval: int = 1_000, timeout: int = 30_000) -> bool:
     """以 `interval` 的周期检查有无特定元素"""
     start_time = perf_counter()
@@ -74,8 +89,22 @@ async def wait_for_element(locator: Locator, interval: int = 1_000, timeout: int
     return False
 
 
-def build_category_url(category: str, page: int = 1) -> str:
-    """构造类目页链接"""
+def build_category_url(
+    category: str,
+    page: int = 1,
+    brand: Optional[str] = None,
+    price_range: Optional[tuple[int, int]] = None,
+    sort: Optional[str] = None,
+) -> str:
+    """
+    构造类目页链接，可以带上筛选条件
+
+    ---
+
+    1. `brand` 品牌，如 "daco" -> /brand/daco
+    2. `price_range` 价格区间（列伊），如 (10, 50) -> /pret,intre-10-si-50
+    3. `sort` 排序，如 "priceasc" -> /sort-priceasc
+    """
     category = category.lower()
     if re_search(r'^[a-z0-9-]+$', category) is None:
         raise ValueError(f'"{category}" 不符合类目规范')
@@ -83,9 +112,35 @@ def build_category_url(category: str, page: int = 1) -> str:
     if page <= 0:
         raise ValueError(f'页码必须为正整数，而不是 {page}')
 
-    if page == 1:
-        return f'https://www.emag.ro/{category}/c'
-    return f'https://www.emag.ro/{category}/p{page}/c'
+    parts = [f'https://www.emag.ro/{category}']
+
+    if brand is not None:
+        brand = brand.lower()
+        if re_search(r'^[a-z0-9-]+$', brand) is None:
+            raise ValueError(f'"{brand}" 不符合品牌规范')
+        parts.append(f'brand/{brand}')
+
+    if price_range is not None:
+        low, high = price_range
+        if low < 0 or high < low:
+            raise ValueError(f'价格区间 {price_range} 不合法')
+        parts.append(f'pret,intre-{low}-si-{high}')
+
+    if sort is not None:
+        if sort not in SORT_ORDERS:
+            raise ValueError(f'排序必须是 {SORT_ORDERS} 之一，而不是 "{sort}"')
+        parts.append(f'sort-{sort}')
+
+    if page > 1:
+        parts.append(f'p{page}')
+
+    parts.append('c')
+    return '/'.join(parts)
+
+
+def count_crawlable_pages(total_product_count: int) -> int:
+    """根据类目的产品总数计算最多能爬多少页"""
+    return min(ceil(total_product_count / PAGE_SIZE), MAX_CRAWLABLE_PAGE)
 
 
 def parse_pnk_from_url(v) -> str:
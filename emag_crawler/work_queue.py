@@ -0,0 +1,268 @@
+"""基于租约的持久化任务队列"""
+
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+from collections import Counter
+from functools import wraps
+from threading import RLock
+from time import time
+from typing import TYPE_CHECKING, Optional
+from uuid import uuid4
+
+from pydantic import BaseModel, Field
+
+from .exceptions import LeaseLostError
+from .storage import connect_sqlite, data_dir, transaction
+
+if TYPE_CHECKING:
+    from typing import Callable, Iterable
+
+    from .storage import StrOrPath
+
+
+class Lease(BaseModel):
+    """一次任务租约，只有持有有效租约的实例才能续约、确认或报告失败"""
+
+    task_id: int = Field(..., description='任务编号')
+    category: str = Field(..., description='类目')
+    token: str = Field(..., description='租约凭证，每次领取都会重新生成')
+    owner: str = Field(..., description='领取任务的实例')
+    attempts: int = Field(..., ge=1, description='包括本次在内的领取次数')
+    expires_at: float = Field(..., description='租约到期时间戳')
+
+
+class DeadLetter(BaseModel):
+    """多次失败后不再重试的任务"""
+
+    category: str = Field(..., description='类目')
+    attempts: int = Field(..., description='领取次数')
+    captcha_count: int = Field(..., description='触发验证的次数')
+    last_error: Optional[str] = Field(None, description='最后一次失败的原因')
+
+
+class WorkQueue(ABC):
+    """
+    类目任务队列
+
+    ---
+
+    1. lease 领取一个可见的任务，任务在 `visibility_timeout` 秒内对其他实例不可见
+    2. 持有者需要在租约到期前 heartbeat 续约，否则任务会重新可见，被其他实例领取
+    3. 完成后 ack；失败时 fail，未超过重试次数的任务在退避后重新可见，否则进入死信
+    """
+
+    @abstractmethod
+    def put(self, categories: Iterable[str]) -> int:
+        """放入任务，已存在的类目会被忽略，返回新增的任务数"""
+
+    @abstractmethod
+    def lease(self, owner: str, visibility_timeout: float = 300) -> Optional[Lease]:
+        """领取一个任务，没有可领取的任务时返回 None"""
+
+    @abstractmethod
+    def heartbeat(self, lease: Lease, visibility_timeout: float = 300) -> Lease:
+        """续约，租约已失效时抛出 LeaseLostError"""
+
+    @abstractmethod
+    def ack(self, lease: Lease) -> None:
+        """确认任务完成，租约已失效时抛出 LeaseLostError"""
+
+    @abstractmethod
+    def fail(self, lease: Lease, error: str, captcha: bool = False) -> bool:
+        """报告任务失败，返回任务是否进入了死信，租约已失效时抛出 LeaseLostError"""
+
+    @abstractmethod
+    def dead_letters(self) -> list[DeadLetter]:
+        """全部死信"""
+
+    @abstractmethod
+    def requeue_dead(self, categories: Optional[Iterable[str]] = None) -> int:
+        """把死信（默认全部）重新放回队列，重置计数，返回放回的任务数"""
+
+    @abstractmethod
+    def stats(self) -> Counter[str]:
+        """各状态的任务数"""
+
+
+def _locked[F: Callable](method: F) -> F:
+    """持有实例的 `_lock` 时才执行，同一个连接上的操作串行执行"""
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+
+    return wrapper  # type: ignore
+
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS task (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    category TEXT NOT NULL UNIQUE,
+    state TEXT NOT NULL DEFAULT 'ready',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    captcha_count INTEGER NOT NULL DEFAULT 0,
+    token TEXT,
+    owner TEXT,
+    visible_at REAL NOT NULL,
+    last_error TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS task_visible ON task (visible_at) WHERE state IN ('ready', 'leased');
+'''
+
+
+class SQLiteWorkQueue(WorkQueue):
+    """
+    SQLite 实现的任务队列，多个进程可以共享同一个数据库文件
+
+    领取在写事务中完成，同一时刻只有一个实例能领到同一个任务；实例崩溃时租约到期后任务自动重新可见
+
+    各方法可以在线程中调用（如 asyncio.to_thread），同一个连接上的操作会串行执行
+
+    NOTICE SQLite 不适合放在网络文件系统上，跨机器部署时应换成其他 WorkQueue 实现
+    """
+
+    def __init__(
+        self,
+        file: StrOrPath = data_dir / 'work_queue.db',
+        max_attempts: int = 5,
+        max_captchas: int = 3,
+        retry_backoff: float = 60,
+        max_retry_backoff: float = 3600,
+    ):
+        self.conn = connect_sqlite(file)
+        self.conn.execute('PRAGMA busy_timeout=30000')
+        self.conn.executescript(_SCHEMA)
+        self._lock = RLock()
+
+        self.max_attempts = max_attempts  # 超过该领取次数的任务进入死信
+        self.max_captchas = max_captchas  # 触发验证达到该次数的任务进入死信
+        self.retry_backoff = retry_backoff
+        self.max_retry_backoff = max_retry_backoff
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self) -> SQLiteWorkQueue:
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    @_locked
+    def put(self, categories: Iterable[str]) -> int:
+        now = time()
+        with transaction(self.conn):
+            before = self.conn.total_changes
+            self.conn.executemany(
+                'INSERT INTO task (category, visible_at, updated_at) VALUES (?, ?, ?) '
+                'ON CONFLICT (category) DO NOTHING',
+                ((c, now, now) for c in categories),
+            )
+            return self.conn.total_changes - before
+
+    @_locked
+    def lease(self, owner: str, visibility_timeout: float = 300) -> Optional[Lease]:
+        now = time()
+        with transaction(self.conn):
+            while True:
+                row = self.conn.execute(
+                    "SELECT id, category, attempts FROM task WHERE state IN ('ready', 'leased') AND visible_at <= ? "
+                    'ORDER BY visible_at, id LIMIT 1',
+                    (now,),
+                ).fetchone()
+                if row is None:
+                    return None
+
+                task_id, category, attempts = row
+                # 租约过期未确认的任务同样计入领取次数，反复导致实例崩溃的任务最终会进入死信
+                if attempts >= self.max_attempts:
+                    self.conn.execute(
+                        "UPDATE task SET state='dead', token=NULL, last_error=COALESCE(last_error, ?), "
+                        'updated_at=? WHERE id=?',
+                        ('租约多次过期', now, task_id),
+                    )
+                    continue
+
+                token = uuid4().hex
+                expires_at = now + visibility_timeout
+                self.conn.execute(
+                    "UPDATE task SET state='leased', attempts=attempts+1, token=?, owner=?, visible_at=?, "
+                    'updated_at=? WHERE id=?',
+                    (token, owner, expires_at, now, task_id),
+                )
+                return Lease(
+                    task_id=task_id,
+                    category=category,
+                    token=token,
+                    owner=owner,
+                    attempts=attempts + 1,
+                    expires_at=expires_at,
+                )
+
+    def _update_leased(self, lease: Lease, sql: str, params: tuple) -> None:
+        """只有租约仍然有效时才执行更新"""
+        cursor = self.conn.execute(
+            f"{sql} WHERE id=? AND token=? AND state='leased' AND visible_at > ?",
+            (*params, lease.task_id, lease.token, time()),
+        )
+        if cursor.rowcount == 0:
+            raise LeaseLostError(lease.category, f'"{lease.category}" 的租约已失效')
+
+    @_locked
+    def heartbeat(self, lease: Lease, visibility_timeout: float = 300) -> Lease:
+        now = time()
+        expires_at = now + visibility_timeout
+        self._update_leased(lease, 'UPDATE task SET visible_at=?, updated_at=?', (expires_at, now))
+        return lease.model_copy(update={'expires_at': expires_at})
+
+    @_locked
+    def ack(self, lease: Lease) -> None:
+        self._update_leased(lease, "UPDATE task SET state='done', token=NULL, updated_at=?", (time(),))
+
+    @_locked
+    def fail(self, lease: Lease, error: str, captcha: bool = False) -> bool:
+        now = time()
+        with transaction(self.conn):
+            (captcha_count,) = self.conn.execute(
+                'SELECT captcha_count FROM task WHERE id=?', (lease.task_id,)
+            ).fetchone()
+            captcha_count += int(captcha)
+
+            dead = lease.attempts >= self.max_attempts or captcha_count >= self.max_captchas
+            backoff = min(self.retry_backoff * 2 ** (lease.attempts - 1), self.max_retry_backoff)
+            self._update_leased(
+                lease,
+                'UPDATE task SET state=?, token=NULL, captcha_count=?, last_error=?, visible_at=?, updated_at=?',
+                ('dead' if dead else 'ready', captcha_count, error, now + backoff, now),
+            )
+        return dead
+
+    @_locked
+    def dead_letters(self) -> list[DeadLetter]:
+        return [
+            DeadLetter(
+                category=category, attempts=attempts, captcha_count=captcha_count, last_error=last_error
+            )
+            for category, attempts, captcha_count, last_error in self.conn.execute(
+                "SELECT category, attempts, captcha_count, last_error FROM task WHERE state='dead' ORDER BY id"
+            )
+        ]
+
+    @_locked
+    def requeue_dead(self, categories: Optional[Iterable[str]] = None) -> int:
+        now = time()
+        sql = (
+            "UPDATE task SET state='ready', attempts=0, captcha_count=0, last_error=NULL, visible_at=?, "
+            "updated_at=? WHERE state='dead'"
+        )
+        with transaction(self.conn):
+            if categories is None:
+                return self.conn.execute(sql, (now, now)).rowcount
+            return sum(self.conn.execute(f'{sql} AND category=?', (now, now, c)).rowcount for c in categories)
+
+    @_locked
+    def stats(self) -> Counter[str]:
+        return Counter(dict(self.conn.execute('SELECT state, COUNT(*) FROM task GROUP BY state').fetchall()))
@@ -2,44 +2,123 @@
 
 from __future__ import annotations
 
-from math import ceil
+import asyncio
+from time import perf_counter
 from typing import TYPE_CHECKING
 
 from scraper_utils.exceptions.browser_exception import PlaywrightError
 
 from ..exceptions import CaptchaError
 from ..handlers.category_page import (
-    handle_products,
+    handle_products_sharded,
     open_url as open_category_page,
     get_total_product_count,
+    parse_products,
 )
 
 from ..logger import logger
 from ..models import ProductCardItem
-from ..utils import build_category_url
+from ..retry import retry_stats
+from ..utils import build_category_url, count_crawlable_pages
 
 if TYPE_CHECKING:
-    from playwright.async_api import BrowserContext
+    from typing import Optional, Sequence
+
+    from playwright.async_api import BrowserContext, Page
+
+    from ..category_index import CategoryIndex, CrawlStatus
+    from ..http_fetch import HttpListingFetcher
 
 
 class CategoryPageWorker:
     # TODO 发生异常时保存已经爬取的数据
 
-    def __init__(self, context: BrowserContext, category: str):
+    def __init__(
+        self,
+        context: BrowserContext,
+        category: str,
+        category_index: Optional[CategoryIndex] = None,
+        time_budget: Optional[float] = None,
+        cart_contexts: Sequence[BrowserContext] = (),
+        pages: int = 1,
+        skip_cart: bool = False,
+        listing_fetcher: Optional[HttpListingFetcher] = None,
+    ):
         self.context = context
 
         self.category = category
+        self.total_product_count: Optional[int] = None  # 这个类目共有多少产品
         self.max_crawlable_page: int = 1  # 这个类目最多能爬多少页
+        self.pages = pages  # 最多爬取多少页，不超过 max_crawlable_page
+        self.skip_cart = skip_cart  # 是否跳过加购阶段，只解析产品卡片（没有最大可加购数）
+        self.listing_fetcher = listing_fetcher  # 跳过加购阶段时用它获取类目页，不在浏览器中渲染
+
+        self.category_index = category_index  # 爬取结束后把类目元数据写入该索引
+
+        self.cart_contexts = cart_contexts  # 与 context 一起分担加购阶段的其他上下文
+        self.time_budget = time_budget  # 爬取一个类目最多用多少秒，超过时取消爬取
+        self.timed_out: bool = False  # 是否因超过时间预算而中止
 
         self.continuable: bool = True  # 是否允许继续爬取（没检测到需要验证）时可以继续爬取
+        self.error: Optional[str] = None  # 爬取出错（如打开第 1 页失败）时的错误信息
 
-        self.result: list[ProductCardItem] = list()
+        self.result: list[ProductCardItem] = list()  # 解析到的产品会随时追加到其中，中止时保留已爬取的部分
+        self._page_start = 0  # 正在处理的这一页的产品在 result 中的起始位置
 
         self.logger = logger.bind(category=category)
 
+    @property
+    def complete(self) -> bool:
+        """是否完整爬取了这个类目（没有出错、没有触发验证、没有超时）"""
+        return self.continuable and self.error is None and not self.timed_out
+
     async def start_scrape(self) -> list[ProductCardItem]:
-        """开始爬取"""
+        """开始爬取，超过时间预算时取消，页面和后台任务会随之关闭"""
+        give_ups = retry_stats.give_ups()
+        try:
+            async with asyncio.timeout(self.time_budget):
+                return await self._scrape()
+        except TimeoutError:
+            self.timed_out = True
+            self.logger.error(
+                f'"{self.category}" 超过 {self.time_budget}s 的时间预算，中止爬取，已爬取 {len(self.result)} 个产品'
+            )
+            # 各分片的产品按完成顺序追加，排行是页内的，只排序正在处理的这一页
+            self.result[self._page_start :] = sorted(self.result[self._page_start :], key=lambda p: p.rank)
+            return self.result
+        finally:
+            if retry_stats.give_ups() > give_ups:
+                self.logger.error(f'"{self.category}" 有操作放弃重试：{retry_stats.report()}')
+
+    async def _scrape(self) -> list[ProductCardItem]:
         logger.info(f'开始爬取 "{self.category}"')
+        start_time = perf_counter()
+        finished = False  # 是否正常结束（没有抛出异常、没有被取消）
+        try:
+            result = await self._scrape_pages()
+            finished = True
+            return result
+        finally:
+            self.logger.info(f'爬取结束 "{self.category}"')
+            if self.category_index is not None:
+                self.category_index.record_crawl(
+                    self.category,
+                    perf_counter() - start_time,
+                    self._crawl_status(finished),
+                    self.total_product_count,
+                )
+
+    def _crawl_status(self, finished: bool) -> CrawlStatus:
+        if not self.continuable:
+            return 'captcha'
+        if not finished or self.error is not None:
+            return 'error'
+        return 'complete'
+
+    async def _scrape_pages(self) -> list[ProductCardItem]:
+        # 加购要在渲染后的类目页上点击，只有跳过加购阶段时才能不用浏览器
+        if self.skip_cart and self.listing_fetcher is not None:
+            return await self._fetch_listings(self.listing_fetcher)
 
         # BUG 抓不到 PlaywrightError
         # TODO 在 KeyboardInterrupt 时能中止爬取并保存已爬取结果
@@ -55,60 +134,96 @@ class CategoryPageWorker:
             )
         except CaptchaError as ce:
             logger.error(f'爬取第 1 页时触发验证\n{ce}')
+            self.continuable = False
         except PlaywrightError as pe:
             logger.error(f'爬取第 1 页时出错\n{pe}')
-        except BaseException as be:
-            logger.error(be)
+            self.error = repr(pe)
+        except Exception as e:
+            logger.error(e)
+            self.error = repr(e)
 
         else:
             # 这个类目能爬取多少页
-            total_product_count = await get_total_product_count(first_page)
-            self.max_crawlable_page = min(ceil(total_product_count / 60), 5)
+            self.total_product_count = await get_total_product_count(first_page)
+            self.max_crawlable_page = count_crawlable_pages(self.total_product_count)
             self.logger.debug(f'"{self.category}" 最大爬取页码 {self.max_crawlable_page}')
 
-            # 第一页的解析结果和是否触发验证
-            result, first_captcha_flag = await handle_products(
-                first_page,
-                self.category,
-                True,
-                self.logger,
-            )
+            pages = min(self.pages, self.max_crawlable_page)
+
+            # 第一页是否触发验证
+            if await self._handle_page(first_page):
+                self.continuable = False
+                return self.result
+
+            # 爬取 2-5 页
+            for i in range(2, pages + 1):
+                self.logger.info(f'开始爬取 "{self.category}" 第 {i} 页')
+
+                url = build_category_url(self.category, i)
+                try:
+                    page = await open_category_page(
+                        self.context,
+                        url,
+                        self.logger,
+                        'networkidle',
+                    )
+                except CaptchaError as ce:
+                    logger.error(f'爬取第 {i} 页时触发验证\n{ce}')
+                    self.continuable = False
+                    break
+                except PlaywrightError as pe:
+                    logger.error(f'爬取第 {i} 页时出错\n{pe}')
+                    self.error = repr(pe)
+                    break
+
+                # 爬取 2-5 页时触发了验证
+                if await self._handle_page(page):
+                    self.continuable = False
+                    break
 
-            # 触发验证
-            if first_captcha_flag:
-                return result
-
-            # # 爬取 2-5 页
-            # for i in range(2, self.max_crawlable_page + 1):
-            #     self.logger.info(f'开始爬取 "{self.category}" 第 {i} 页')
-
-            #     url = build_category_url(self.category, i)
-            #     try:
-            #         page = await open_category_page(
-            #             self.context,
-            #             url,
-            #             self.logger,
-            #             'networkidle',
-            #         )
-            #     except CaptchaError as ce:
-            #         logger.error(f'爬取第 {i} 页时触发验证\n{ce}')
-            #         break
-            #     except PlaywrightError as pe:
-            #         logger.error(f'爬取第 {i} 页时出错\n{pe}')
-            #         break
-            #     except BaseException as be:
-            #         logger.error(be)
-            #         break
-
-            #     else:
-            #         res, flag = await handle_products(page, self.category, True, self.logger)
-            #         result.extend(res)
-
-            #         # 爬取 2-5 页时触发了验证
-            #         if flag:
-            #             break
-
-            self.result = result
-
-        self.logger.info(f'爬取结束 "{self.category}"')
         return self.result
+
+    async def _fetch_listings(self, fetcher: HttpListingFetcher) -> list[ProductCardItem]:
+        """用 HTTP 获取并解析各页的产品卡片，遇到验证时 fetcher 会改用浏览器"""
+        i = 1
+        while i <= min(self.pages, self.max_crawlable_page):
+            self.logger.info(f'开始获取 "{self.category}" 第 {i} 页')
+            url = build_category_url(self.category, i)
+            try:
+                total_product_count, items = await fetcher.fetch_listing(url, self.category, self.logger)
+            except CaptchaError as ce:
+                logger.error(f'获取第 {i} 页时触发验证\n{ce}')
+                self.continuable = False
+                break
+            except PlaywrightError as pe:
+                logger.error(f'获取第 {i} 页时出错\n{pe}')
+                self.error = repr(pe)
+                break
+
+            if i == 1:
+                # 只有一页的类目没有分页栏
+                self.total_product_count = len(items) if total_product_count is None else total_product_count
+                self.max_crawlable_page = count_crawlable_pages(self.total_product_count)
+                self.logger.debug(f'"{self.category}" 最大爬取页码 {self.max_crawlable_page}')
+
+            self.result.extend(items)
+            i += 1
+
+        return self.result
+
+    async def _handle_page(self, page: Page) -> bool:
+        """处理一页类目页，解析到的产品追加到 self.result，返回是否触发验证"""
+        self._page_start = len(self.result)
+        if self.skip_cart:
+            await parse_products(page, self.category, self.logger, result=self.result)
+            return False
+
+        _, captcha_flag = await handle_products_sharded(
+            page,
+            self.cart_contexts,
+            self.category,
+            True,
+            self.logger,
+            result=self.result,
+        )
+        return captcha_flag
@@ -0,0 +1,94 @@
+"""按筛选切片爬取大类目"""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from scraper_utils.exceptions.browser_exception import PlaywrightError
+
+from ..exceptions import CaptchaError
+from ..facets import FacetPlanner, merge_slice_results
+from ..handlers.category_page import count_products, handle_products, open_url as open_category_page
+from ..logger import logger
+
+if TYPE_CHECKING:
+    from typing import Iterable, Optional
+
+    from playwright.async_api import BrowserContext
+
+    from ..facets import FacetSlice
+    from ..models import ProductCardItem
+
+
+class FacetCategoryWorker:
+    """先把类目拆分成不超过 5 页的筛选切片，再逐个切片、逐页爬取，按 pnk 去重合并结果"""
+
+    def __init__(self, context: BrowserContext, category: str, brands: Optional[Iterable[str]] = None):
+        self.context = context
+
+        self.category = category
+        self.brands = brands
+
+        self.slices: list[FacetSlice] = list()
+        self.continuable: bool = True  # 是否允许继续爬取（没检测到需要验证）时可以继续爬取
+        self.error: Optional[str] = None  # 规划切片或打开某一页出错时的错误信息
+
+        self.result: list[ProductCardItem] = list()
+
+        self.logger = logger.bind(category=category)
+
+    @property
+    def complete(self) -> bool:
+        """是否完整爬取了这个类目（没有出错、没有触发验证）"""
+        return self.continuable and self.error is None
+
+    async def _probe(self, url: str) -> int:
+        return await count_products(self.context, url, self.logger)
+
+    async def _scrape_slice(self, facet: FacetSlice) -> list[ProductCardItem]:
+        result: list[ProductCardItem] = list()
+        for i in range(1, facet.pages + 1):
+            url = facet.url(i)
+            self.logger.info(f'开始爬取 "{url}"')
+            try:
+                page = await open_category_page(self.context, url, self.logger, 'networkidle')
+            except CaptchaError as ce:
+                self.logger.error(f'爬取 "{url}" 时触发验证\n{ce}')
+                self.continuable = False
+                break
+            except PlaywrightError as pe:
+                self.logger.error(f'爬取 "{url}" 时出错\n{pe}')
+                self.error = repr(pe)
+                break
+
+            res, captcha_flag = await handle_products(page, self.category, True, self.logger)
+            result.extend(res)
+            if captcha_flag:
+                self.continuable = False
+                break
+        return result
+
+    async def start_scrape(self) -> list[ProductCardItem]:
+        """开始爬取"""
+        self.logger.info(f'开始规划 "{self.category}" 的切片')
+        try:
+            self.slices = await FacetPlanner(self._probe).plan(self.category, self.brands)
+        except CaptchaError as ce:
+            self.logger.error(f'规划切片时触发验证\n{ce}')
+            self.continuable = False
+            return self.result
+        except (PlaywrightError, ValueError) as e:
+            # 探测产品总数时打开页面失败，或页面上没有可解析的产品总数
+            self.logger.error(f'规划切片时出错\n{e!r}')
+            self.error = repr(e)
+            return self.result
+
+        slice_results: list[list[ProductCardItem]] = list()
+        for facet in self.slices:
+            slice_results.append(await self._scrape_slice(facet))
+            if not self.continuable or self.error is not None:
+                break
+
+        self.result = merge_slice_results(slice_results)
+        self.logger.info(f'爬取结束 "{self.category}"，去重后共 {len(self.result)} 个产品')
+        return self.result
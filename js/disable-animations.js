@@ -0,0 +1,19 @@
+// 关闭 CSS 动画和过渡，减少渲染开销，也避免点击时元素还在移动
+(function disableAnimations() {
+    const style = document.createElement('style');
+    style.textContent =
+        '*, *::before, *::after { animation: none !important; transition: none !important; scroll-behavior: auto !important; }';
+
+    function inject() {
+        const parent = document.head || document.documentElement;
+        if (!parent) return false;
+        parent.appendChild(style);
+        return true;
+    }
+
+    // 文档开始时可能还没有根元素，等根元素插入后再注入
+    if (!inject()) {
+        const observer = new MutationObserver(() => inject() && observer.disconnect());
+        observer.observe(document, { childList: true });
+    }
+})();
@@ -1,18 +1,19 @@
-itv = null;
-
 // 自动隐藏 eMAG 的 cookie 提示
-function hideCookieBanner() {
-    const xpath = '//div[starts-with(@class, "gdpr-cookie-banner")]';
-    const result = document.evaluate(xpath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null);
+// 在文档开始时注入样式，之后动态加载的提示也会被隐藏，不需要定时检查
+(function hideCookieBanner() {
+    const style = document.createElement('style');
+    style.textContent = 'div[class^="gdpr-cookie-banner"] { visibility: hidden !important; }';
 
-    if (result.singleNodeValue) {
-        result.singleNodeValue.style.visibility = 'hidden';
-        clearInterval(itv);
+    function inject() {
+        const parent = document.head || document.documentElement;
+        if (!parent) return false;
+        parent.appendChild(style);
+        return true;
     }
-}
-
-// 在DOM加载完成后立即执行
-document.addEventListener('DOMContentLoaded', hideCookieBanner);
 
-// 每500ms检查一次（应对动态加载内容）
-itv = setInterval(hideCookieBanner, 500);
+    // 文档开始时可能还没有根元素，等根元素插入后再注入
+    if (!inject()) {
+        const observer = new MutationObserver(() => inject() && observer.disconnect());
+        observer.observe(document, { childList: true });
+    }
+})();
@@ -0,0 +1,5 @@
+// 隐藏 navigator.webdriver
+// 只用于不是由 BrowserManager 新建（没有经过隐身处理）的上下文，如通过 CDP 连接的常驻浏览器
+(function hideWebdriver() {
+    Object.defineProperty(Navigator.prototype, 'webdriver', { get: () => undefined, configurable: true });
+})();
@@ -0,0 +1,124 @@
+"""测试 AssetCache 的缓存规则、去重和淘汰"""
+
+import asyncio
+from types import SimpleNamespace
+
+from emag_crawler.asset_cache import STATIC_URL_PATTERN, AssetCache, freshness_lifetime
+
+CDN = 'https://s13emagst.akamaized.net/layout/ro/static-upload'
+
+
+def test_freshness_lifetime():
+    assert freshness_lifetime({'cache-control': 'public, max-age=600'}) == 600
+    assert freshness_lifetime({'cache-control': 'max-age=60, s-maxage=3600'}) == 3600
+    assert freshness_lifetime({'cache-control': 'public, max-age=31536000, immutable'}) == 365 * 24 * 3600
+    assert freshness_lifetime({'cache-control': 'private, max-age=600'}) is None
+    assert freshness_lifetime({'cache-control': 'no-cache'}) is None
+    assert freshness_lifetime({'cache-control': 'max-age=0'}) is None
+    assert freshness_lifetime({}) is None
+
+    assert STATIC_URL_PATTERN.match(f'{CDN}/main.min.js?v=123')
+    assert STATIC_URL_PATTERN.match(f'{CDN}/style.css')
+    assert not STATIC_URL_PATTERN.match(f'{CDN}/logo.png')
+    assert not STATIC_URL_PATTERN.match('https://www.emag.ro/main.js')
+
+
+def _blobs(cache: AssetCache) -> int:
+    return sum(1 for p in cache.blob_dir.rglob('*') if p.is_file())
+
+
+def test_asset_cache_dedup_and_replace(tmp_path):
+    cache = AssetCache(tmp_path, max_bytes=1024)
+    headers = {'Cache-Control': 'max-age=600', 'ETag': '"v1"', 'Set-Cookie': 'a=b'}
+
+    # 内容相同的资源只保存一份
+    cache._store(f'{CDN}/a.js', headers, b'x' * 100, 600)
+    cache._store(f'{CDN}/b.js?v=2', headers, b'x' * 100, 600)
+    assert _blobs(cache) == 1
+    assert cache.total_bytes == 100
+
+    digest, kept, _ = cache._lookup(f'{CDN}/a.js')
+    assert kept == {'cache-control': 'max-age=600', 'etag': '"v1"'}
+
+    # 链接的内容变化：仍被其他链接引用的旧内容保留
+    cache._store(f'{CDN}/a.js', headers, b'y' * 100, 600)
+    assert _blobs(cache) == 2
+    assert cache.total_bytes == 200
+    assert cache._blob_path(digest).exists()
+
+    # 不再被引用的旧内容被删除
+    cache._store(f'{CDN}/b.js?v=2', headers, b'z' * 100, 600)
+    assert _blobs(cache) == 2
+    assert not cache._blob_path(digest).exists()
+    assert cache.total_bytes == 200
+    cache.close()
+
+    # 总大小保存在索引中，重新打开后不用重新统计
+    reopened = AssetCache(tmp_path)
+    assert reopened.total_bytes == 200
+    reopened.close()
+
+
+def test_asset_cache_evict(tmp_path):
+    cache = AssetCache(tmp_path, max_bytes=250)
+    for i, name in enumerate(('old', 'mid', 'new')):
+        cache._store(f'{CDN}/{name}.js', {}, bytes([i]) * 100, 600)
+        cache.conn.execute('UPDATE entry SET last_access=? WHERE url=?', (i, f'{CDN}/{name}.js'))
+
+    # 写入第三个时超过上限，按最近访问时间淘汰最早的
+    assert cache._lookup(f'{CDN}/old.js') is None
+    assert cache._lookup(f'{CDN}/mid.js') is not None
+    assert _blobs(cache) == 2
+
+    # 访问过的条目不会被先淘汰
+    cache._touch(f'{CDN}/mid.js')
+    cache.max_bytes = 100
+    assert cache.evict() == 100
+    assert cache._lookup(f'{CDN}/new.js') is None
+    assert cache._lookup(f'{CDN}/mid.js') is not None
+    assert cache.evict() == 0
+    assert cache.total_bytes == 100
+    cache.close()
+
+
+class _Route:
+    """只实现 handle_route 用到的部分的替身"""
+
+    def __init__(self, url: str, response: SimpleNamespace):
+        self.request = SimpleNamespace(method='GET', url=url, headers={})
+        self.response = response
+        self.fetches = 0
+        self.fulfilled: dict = dict()
+
+    async def fetch(self, headers=None):
+        self.fetches += 1
+        return self.response
+
+    async def fulfill(self, **kwargs):
+        self.fulfilled = kwargs
+
+    async def fallback(self):
+        pass
+
+    async def abort(self):
+        pass
+
+
+def test_asset_cache_handle_route(tmp_path):
+    async def body():
+        return b'js' * 50
+
+    response = SimpleNamespace(status=200, headers={'cache-control': 'max-age=600'}, body=body)
+    cache = AssetCache(tmp_path)
+
+    async def main() -> None:
+        miss = _Route(f'{CDN}/main.js', response)
+        await cache.handle_route(miss)  # type: ignore
+        hit = _Route(f'{CDN}/main.js', response)
+        await cache.handle_route(hit)  # type: ignore
+        assert (miss.fetches, hit.fetches) == (1, 0)
+        assert hit.fulfilled['body'] == b'js' * 50
+
+    asyncio.run(main())
+    assert (cache.hits, cache.misses, cache.total_bytes) == (1, 1, 100)
+    cache.close()
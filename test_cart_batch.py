@@ -0,0 +1,39 @@
+"""测试 CartBatchSizer 和购物车已满的判断"""
+
+from emag_crawler.handlers.cart_page import CartBatchSizer
+from emag_crawler.handlers.category_page import is_cart_full_body
+
+
+def test_cart_batch_sizer():
+    sizer = CartBatchSizer(initial=40, step=10, maximum=60, recover_after=2)
+
+    # 没有被拒绝时满额的批次让批量增长
+    sizer.on_flush(40)
+    assert sizer.size == 50
+    sizer.on_flush(20)
+    assert sizer.size == 50
+
+    # 被拒绝时降为当时购物车内的产品数，以最近一次为准
+    sizer.on_full(3)
+    assert (sizer.capacity, sizer.size) == (3, 3)
+    sizer.on_full(45)
+    assert (sizer.capacity, sizer.size) == (45, 45)
+
+    # 连续 recover_after 批满额都没有被拒绝后重新增长
+    sizer.on_flush(45)
+    assert sizer.size == 45
+    sizer.on_flush(45)
+    assert (sizer.capacity, sizer.size) == (None, 55)
+    sizer.on_flush(55)
+    assert sizer.size == 60
+
+
+def test_is_cart_full_body():
+    assert is_cart_full_body({'error': 'Ai atins numărul maxim de produse în coș'})
+    assert is_cart_full_body({'errors': [{'message': 'Cart limit reached'}]})
+    assert is_cart_full_body({'status': 'error', 'message': 'Coșul tău este plin'})
+
+    assert not is_cart_full_body({'error': 'Too many requests'})
+    assert not is_cart_full_body({'error': 'Costul maxim de livrare'})
+    assert not is_cart_full_body({'status': 'ok', 'cart': {'count': 3}})
+    assert not is_cart_full_body(None)
@@ -0,0 +1,143 @@
+"""测试 handle_products_sharded 按 data-offer-id 分配产品、合并结果和处理出错的分片，用替身代替浏览器"""
+
+import asyncio
+
+from scraper_utils.exceptions.browser_exception import PlaywrightError
+
+from emag_crawler.handlers import category_page as handlers
+from emag_crawler.handlers.category_page import handle_products_sharded
+from emag_crawler.logger import logger
+
+URL = 'https://www.emag.ro/laptopuri/c'
+
+
+class _Empty:
+    async def count(self) -> int:
+        return 0
+
+
+class _Price:
+    async def inner_text(self, **kwargs) -> str:
+        return '99,99 Lei'
+
+
+class _Card:
+    def __init__(self, offer_id: str):
+        self.attributes = {
+            'data-url': f'https://www.emag.ro/x/pd/D{offer_id:0>7}M/',
+            'data-offer-id': offer_id,
+        }
+
+    async def get_attribute(self, name: str, **kwargs) -> str:
+        return self.attributes[name]
+
+    def locator(self, selector: str, **kwargs):
+        return _Price() if selector == 'css=p.product-new-price' else _Empty()
+
+
+class _Cards:
+    def __init__(self, offer_ids: list[str]):
+        self.cards = [_Card(o) for o in offer_ids]
+
+    async def count(self) -> int:
+        return len(self.cards)
+
+    def nth(self, i: int) -> _Card:
+        return self.cards[i]
+
+    async def evaluate_all(self, expression: str) -> list[str]:
+        return [c.attributes['data-offer-id'] for c in self.cards]
+
+
+class _Page:
+    def __init__(self, context: '_Context'):
+        self.context = context
+        self.url = URL
+        self.cards = _Cards(context.offer_ids)
+        self.closed = False
+
+    def locator(self, selector: str, **kwargs) -> _Cards:
+        return self.cards
+
+    async def close(self) -> None:
+        self.closed = True
+
+
+class _Context:
+    """每个上下文渲染出的产品卡片顺序可以不同，前 `open_failures` 次打开类目页出错"""
+
+    def __init__(self, offer_ids: list[str], open_failures: int = 0):
+        self.offer_ids = offer_ids
+        self.open_failures = open_failures
+        self.opens = 0
+        self.added: list[int] = list()  # 在这个上下文中加购的排行
+
+
+def _run(main: _Context, contexts: list[_Context], monkeypatch) -> list:
+    async def open_url(context: _Context, url: str, logger, wait_until) -> _Page:
+        context.opens += 1
+        if context.opens <= context.open_failures:
+            raise PlaywrightError('net::ERR_CONNECTION_RESET')
+        return _Page(context)
+
+    async def add_cart(page: _Page, card_div, rank: int, logger, *args) -> None:
+        page.context.added.append(rank)
+
+    async def handle_added_products(page: _Page, products, need_clear_cart: bool, logger) -> None:
+        for p in products:
+            p.max_qty = 10
+
+    async def handle_cart_dialog(page: _Page, logger) -> None:
+        pass
+
+    monkeypatch.setattr(handlers, 'open_url', open_url)
+    monkeypatch.setattr(handlers, 'add_cart', add_cart)
+    monkeypatch.setattr(handlers, 'handle_added_products', handle_added_products)
+    monkeypatch.setattr(handlers, 'handle_cart_dialog', handle_cart_dialog)
+
+    result, captcha_flag = asyncio.run(
+        handle_products_sharded(_Page(main), contexts, 'laptopuri', True, logger)  # type: ignore
+    )
+    assert not captcha_flag
+    return result
+
+
+OFFER_IDS = [str(i) for i in range(1, 8)]
+
+
+def test_merge_by_main_page_rank(monkeypatch):
+    main = _Context(OFFER_IDS)
+    # 其他上下文渲染出的顺序不同，其中一个少了一个产品
+    a = _Context(OFFER_IDS[::-1])
+    b = _Context([o for o in OFFER_IDS if o != '3'])
+    result = _run(main, [a, b], monkeypatch)
+
+    # 排行以主页面为准，每个产品只加购一次
+    assert [(p.product_id, p.rank) for p in result] == [
+        (o, i) for i, o in enumerate(OFFER_IDS, start=1) if o != '3'
+    ]
+    assert (main.added, sorted(a.added), b.added) == ([1, 4, 7], [2, 5], [6])
+    assert all(p.cart_added and p.max_qty == 10 for p in result)
+
+
+def test_failed_shard_is_spread_over_succeeded_contexts(monkeypatch):
+    main = _Context(OFFER_IDS)
+    a = _Context(OFFER_IDS)
+    # 重试一次仍然出错
+    b = _Context(OFFER_IDS, open_failures=2)
+    result = _run(main, [a, b], monkeypatch)
+
+    assert [p.rank for p in result] == list(range(1, 8))
+    assert b.opens == 2 and b.added == []
+    # b 的产品 (3, 6) 分给 main 和 a，main 重新打开一次类目页
+    assert (main.opens, a.opens) == (1, 2)
+    assert (main.added, a.added) == ([1, 4, 7, 3], [2, 5, 6])
+
+
+def test_retry_on_same_context(monkeypatch):
+    main = _Context(OFFER_IDS)
+    a = _Context(OFFER_IDS, open_failures=1)
+    result = _run(main, [a], monkeypatch)
+
+    assert [p.rank for p in result] == list(range(1, 8))
+    assert a.opens == 2 and a.added == [2, 4, 6]
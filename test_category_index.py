@@ -0,0 +1,31 @@
+"""测试 CategoryIndex"""
+
+from emag_crawler.category_index import CategoryIndex
+
+
+def test_record_crawl(tmp_path):
+    with CategoryIndex(tmp_path / 'category_index.db') as index:
+        # 出错的爬取只记录产品总数
+        index.record_crawl('a', 1, 'error', 300)
+        meta = index.get('a')
+        assert meta.total_product_count == 300
+        assert (meta.crawl_count, meta.crawled_at, meta.avg_duration) == (0, None, None)
+
+        # 触发验证的爬取计入验证率，不更新爬取时间，耗时不参与平均
+        index.record_crawl('a', 5, 'captcha')
+        meta = index.get('a')
+        assert (meta.crawl_count, meta.captcha_count, meta.crawled_at, meta.avg_duration) == (
+            1,
+            1,
+            None,
+            None,
+        )
+
+        index.record_crawl('a', 100, 'complete')
+        index.record_crawl('a', 5, 'captcha')
+        index.record_crawl('a', 200, 'complete')
+        meta = index.get('a')
+        assert (meta.crawl_count, meta.captcha_count, meta.avg_duration) == (4, 2, 150)
+        assert meta.crawled_at is not None
+        assert meta.captcha_rate == 0.5
+        assert index.estimate_duration('a') == 150
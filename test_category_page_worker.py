@@ -5,6 +5,8 @@ from asyncio import run
 from scraper_utils.utils.browser_util import BrowserManager, ResourceType, MS1000
 from scraper_utils.utils.json_util import write_json
 
+from emag_crawler.models import dump_product_cards
+from emag_crawler.snapshot import SnapshotIndex
 from emag_crawler.utils import logger
 from emag_crawler.workers.category_page import CategoryPageWorker
 
@@ -32,7 +34,12 @@ async def main():
         resuls = await w.start_scrape()
         resuls.sort(key=lambda r: (r.source_url, r.rank))
 
-        write_json('temp.json', list(r.model_dump() for r in resuls), indent=4, async_mode=False)
+        write_json('temp.json', dump_product_cards(resuls), indent=4, async_mode=False)
+
+        # 只输出与上次爬取相比发生变化的产品
+        with SnapshotIndex() as index:
+            changes = index.update(w.category, resuls, complete=w.complete)
+        write_json('changes.json', list(c.model_dump() for c in changes), indent=4, async_mode=False)
 
 
 if __name__ == '__main__':
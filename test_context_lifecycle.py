@@ -0,0 +1,211 @@
+"""测试 ManagedContext 的回收和会话保存，用替身代替浏览器"""
+
+import asyncio
+
+from emag_crawler import context_lifecycle
+from emag_crawler.context_lifecycle import ManagedContext
+from emag_crawler.proxies import ProxyEndpoint, ProxyPool
+from emag_crawler.session import SessionStore
+
+
+class _Context:
+    """只实现 ManagedContext 用到的部分的替身上下文"""
+
+    def __init__(self, kwargs: dict):
+        self.kwargs = kwargs
+        self.pages: list = list()
+        self.cookies: list = list()
+        self.closed = False
+        self.listeners: dict[str, list] = dict()
+
+    def on(self, event: str, callback) -> None:
+        self.listeners.setdefault(event, list()).append(callback)
+
+    def emit(self, event: str, arg) -> None:
+        for callback in self.listeners.get(event, []):
+            callback(arg)
+
+    async def add_cookies(self, cookies: list) -> None:
+        self.cookies.extend(cookies)
+
+    async def add_init_script(self, script: str) -> None:
+        pass
+
+    async def storage_state(self) -> dict:
+        return {'cookies': self.cookies, 'origins': []}
+
+    async def close(self) -> None:
+        self.closed = True
+
+
+class _BrowserManager:
+    def __init__(self):
+        self.contexts: list[_Context] = list()
+
+    async def new_context(self, **kwargs) -> _Context:
+        self.contexts.append(_Context(kwargs))
+        return self.contexts[-1]
+
+
+class _Request:
+    def __init__(self, url: str, navigation: bool = True):
+        self.url = url
+        self.navigation = navigation
+
+    def is_navigation_request(self) -> bool:
+        return self.navigation
+
+
+COOKIE = {'name': 'sid', 'value': '1', 'domain': '.emag.ro', 'path': '/'}
+
+
+def test_captcha_session_is_not_kept(tmp_path):
+    store = SessionStore(tmp_path)
+    store.save('W0-0', {'cookies': [COOKIE], 'origins': []})
+    bm = _BrowserManager()
+    managed = ManagedContext(bm, max_memory_mb=None, session_store=store, proxy_key='W0-0')  # type: ignore
+
+    async def main() -> None:
+        # 槽位默认与 proxy_key 相同
+        async with managed.use() as context:
+            assert context.cookies == [COOKIE]
+        managed.report_captcha()
+
+        # 遇到验证后回收，新的上下文不带旧的 cookies，槽位被删除
+        async with managed.use() as context:
+            assert context is bm.contexts[1] and context.cookies == []
+        assert bm.contexts[0].closed
+        assert store.load('W0-0') is None
+
+        # 之后没有遇到验证，close 时保存新的会话
+        await managed.close()
+        assert store.load('W0-0') == {'cookies': [], 'origins': []}
+
+    asyncio.run(main())
+
+
+def test_close_discards_captcha_session(tmp_path):
+    store = SessionStore(tmp_path)
+    managed = ManagedContext(_BrowserManager(), max_memory_mb=None, session_store=store)  # type: ignore
+
+    async def main() -> None:
+        async with managed.use():
+            pass
+        managed.report_captcha()
+        await managed.close()
+
+    asyncio.run(main())
+    assert store.load('default') is None and not store.path('default').exists()
+
+
+def test_recycle_when_proxy_cools_down_elsewhere(tmp_path):
+    proxies = [ProxyEndpoint(server=f'http://127.0.0.1:{8000 + i}') for i in range(2)]
+    pool = ProxyPool(proxies, cooldown=60, file=tmp_path / 'proxies.db')
+    other = ProxyPool(proxies, cooldown=60, file=tmp_path / 'proxies.db')  # 另一个进程中的副本
+    bm = _BrowserManager()
+    managed = ManagedContext(bm, max_memory_mb=None, proxy_pool=pool, proxy_key='W0-0')  # type: ignore
+
+    async def main() -> None:
+        async with managed.use():
+            pass
+        first = managed.proxy
+        assert first is not None and bm.contexts[0].kwargs['proxy'] == first.playwright_proxy()
+
+        # 代理可用时检查是否回收不会重新领取代理
+        async with managed.use() as context:
+            assert context is bm.contexts[0] and pool.assignments == {'W0-0': first.server}
+
+        # 其他进程报告验证后，下次使用时回收并换用其他代理
+        other.report_captcha(first)
+        async with managed.use() as context:
+            assert context is bm.contexts[1] and managed.proxy != first
+            assert context.kwargs['proxy'] == managed.proxy.playwright_proxy()
+        await managed.close()
+
+    asyncio.run(main())
+    pool.close()
+    other.close()
+
+
+def test_recycle_limits(monkeypatch):
+    async def page_js_heap(page) -> int:
+        return 300 * 1024 * 1024
+
+    monkeypatch.setattr(context_lifecycle, 'page_js_heap', page_js_heap)
+    bm = _BrowserManager()
+    managed = ManagedContext(bm, max_pages=2, max_cart_cycles=2, max_memory_mb=500, sample_interval=3600)  # type: ignore
+
+    async def main() -> None:
+        # 打开的页面数
+        async with managed.use() as context:
+            context.emit('page', object())
+            assert managed._recycle_reason() is None
+            context.emit('page', object())
+        assert managed._recycle_reason() == '已打开 2 个页面'
+        async with managed.use() as context:
+            assert context is bm.contexts[1] and bm.contexts[0].closed
+            assert managed.pages_opened == 0
+
+            # 只计入打开购物车页的导航请求
+            context.emit('request', _Request('https://www.emag.ro/cart/products'))
+            context.emit('request', _Request('https://www.emag.ro/cart/products?x=1', navigation=False))
+            context.emit('request', _Request('https://www.emag.ro/laptopuri/c'))
+            assert managed._recycle_reason() is None
+            context.emit('request', _Request('https://www.emag.ro/cart/products'))
+        assert managed._recycle_reason() == '已访问 2 次购物车页'
+        async with managed.use() as context:
+            assert context is bm.contexts[2] and managed.cart_cycles == 0
+
+            # 内存按采样到的峰值计算，页面关闭后仍然回收
+            context.pages = [object()]
+            assert await managed.sample_memory() == 300
+            assert managed._recycle_reason() is None
+            context.pages = [object(), object()]
+            await managed.sample_memory()
+            context.pages = []
+            await managed.sample_memory()
+        assert (managed.memory_mb, managed.peak_memory_mb) == (0, 600)
+        assert managed._recycle_reason() == '内存峰值 600MB'
+        async with managed.use() as context:
+            assert context is bm.contexts[3] and managed.peak_memory_mb == 0
+        assert managed.recycles == 3
+        await managed.close()
+
+    asyncio.run(main())
+
+
+def test_recycle_waits_for_users():
+    bm = _BrowserManager()
+    managed = ManagedContext(bm, max_pages=1, max_memory_mb=None)  # type: ignore
+    events: list[str] = list()
+
+    async def holder(entered: asyncio.Event, release: asyncio.Event) -> None:
+        async with managed.use() as context:
+            entered.set()
+            context.emit('page', object())
+            await release.wait()
+            # 回收前仍在使用的上下文没有被关闭
+            assert not context.closed
+            events.append('holder exit')
+
+    async def waiter() -> None:
+        async with managed.use() as context:
+            events.append('waiter enter')
+            assert context is bm.contexts[1] and bm.contexts[0].closed
+
+    async def main() -> None:
+        entered, release = asyncio.Event(), asyncio.Event()
+        holding = asyncio.create_task(holder(entered, release))
+        await entered.wait()
+
+        # 已达上限，新的使用者等当前的使用者结束后才回收
+        waiting = asyncio.create_task(waiter())
+        await asyncio.sleep(0.01)
+        assert not waiting.done() and managed._recycling
+
+        release.set()
+        await asyncio.gather(holding, waiting)
+        assert events == ['holder exit', 'waiter enter'] and not managed._recycling
+        await managed.close()
+
+    asyncio.run(main())
@@ -0,0 +1,76 @@
+"""测试 FacetPlanner"""
+
+import asyncio
+from re import search
+
+from emag_crawler.facets import SLICE_CAPACITY, FacetPlanner
+from emag_crawler.utils import build_category_url
+from emag_crawler.workers.facet_category import FacetCategoryWorker
+
+
+def test_build_category_url():
+    assert build_category_url('bare-transversale') == 'https://www.emag.ro/bare-transversale/c'
+    assert (
+        build_category_url(
+            'acuarele-pensule-si-blocuri-de-desen', 2, brand='daco', price_range=(10, 50), sort='priceasc'
+        )
+        == 'https://www.emag.ro/acuarele-pensule-si-blocuri-de-desen/brand/daco/pret,intre-10-si-50/sort-priceasc/p2/c'
+    )
+
+
+def test_plan_partitions():
+    # 每个价格 1 个产品，共 1000 个
+    prices = range(1000)
+    probed: list[str] = list()
+
+    async def probe(url: str) -> int:
+        probed.append(url)
+        m = search(r'pret,intre-(\d+)-si-(\d+)', url)
+        if m is None:
+            return len(prices)
+        low, high = int(m.group(1)), int(m.group(2))
+        return sum(1 for p in prices if low <= p <= high)
+
+    slices = asyncio.run(FacetPlanner(probe, max_price=1024).plan('bare-transversale'))
+
+    assert all(s.total_product_count <= SLICE_CAPACITY for s in slices)
+    # 切片首尾相接，覆盖全部价格
+    assert slices[0].price_range[0] == 0 and slices[-1].price_range[1] >= 999  # type: ignore
+    assert all(a.price_range[1] == b.price_range[0] for a, b in zip(slices, slices[1:]))  # type: ignore
+    # 同一个链接只探测一次
+    assert len(probed) == len(set(probed))
+
+
+def test_small_category_is_not_split():
+    async def probe(url: str) -> int:
+        return 120
+
+    [facet] = asyncio.run(FacetPlanner(probe).plan('bare-transversale'))
+    assert facet.url() == 'https://www.emag.ro/bare-transversale/c'
+    assert facet.pages == 2
+
+
+def test_price_ceiling_grows():
+    # 有 3 个产品比 max_price 贵，上限翻倍后不会漏掉
+    prices = [*range(0, 1000, 2), 1500, 2500, 3000]
+
+    async def probe(url: str) -> int:
+        m = search(r'pret,intre-(\d+)-si-(\d+)', url)
+        if m is None:
+            return len(prices)
+        low, high = int(m.group(1)), int(m.group(2))
+        return sum(1 for p in prices if low <= p <= high)
+
+    slices = asyncio.run(FacetPlanner(probe, max_price=1000).plan('bare-transversale'))
+    assert slices[-1].price_range[1] >= 3000  # type: ignore
+    assert sum(s.total_product_count for s in slices) >= len(prices)
+
+
+def test_worker_records_plan_error():
+    async def probe(url: str) -> int:
+        raise ValueError('页面上没有产品总数')
+
+    worker = FacetCategoryWorker(None, 'bare-transversale')  # type: ignore
+    worker._probe = probe  # type: ignore
+    assert asyncio.run(worker.start_scrape()) == []
+    assert worker.error is not None and not worker.complete
@@ -0,0 +1,141 @@
+"""测试 FreshnessTracker、FreshnessPlanner，以及计划传给 CategoryPageWorker 的参数"""
+
+import asyncio
+from math import isinf
+
+from emag_crawler.category_index import CategoryIndex
+from emag_crawler.freshness import CrawlPlanItem, FreshnessPlanner, FreshnessTracker
+from emag_crawler.handlers import category_page as handlers
+from emag_crawler.models import ProductChange
+from emag_crawler.workers import category_page as workers
+from emag_crawler.workers.category_page import CategoryPageWorker
+
+HOUR = 3600
+
+
+def _updates(category: str, count: int, fields: list[str]) -> list[ProductChange]:
+    return [
+        ProductChange(change='update', category=category, pnk=f'D{i:08d}', changed_fields=fields)
+        for i in range(count)
+    ]
+
+
+def test_tracker_rates(tmp_path):
+    with FreshnessTracker(tmp_path / 'freshness.db', alpha=0.5) as tracker:
+        tracker.observe('a', [], 100, now=0)
+        assert tracker.rates('a')['price'].rate is None
+
+        # 1 小时内一半的产品价格变化
+        tracker.observe('a', _updates('a', 50, ['price']), 100, now=HOUR)
+        rates = tracker.rates('a')
+        assert abs(rates['price'].rate - 0.6931) < 1e-3
+        assert rates['rank'].rate == 0
+        assert abs(rates['price'].changed_probability(2 * HOUR) - 0.5) < 1e-9
+
+        # 不执行加购阶段时 max_qty 不变
+        tracker.observe('a', [], 100, fields=('price', 'rank'), now=2 * HOUR)
+        rates = tracker.rates('a')
+        assert rates['max_qty'].observed_at == HOUR
+        assert abs(rates['price'].rate - 0.3466) < 1e-3
+
+
+def test_planner_budget(tmp_path):
+    with (
+        FreshnessTracker(tmp_path / 'freshness.db') as tracker,
+        CategoryIndex(tmp_path / 'category_index.db') as index,
+    ):
+        for category in ('volatile', 'stable'):
+            index.record_crawl(category, 100, 'complete', 300)
+            tracker.observe(category, [], 300, now=0)
+        tracker.observe('volatile', _updates('volatile', 150, ['price', 'max_qty']), 300, now=HOUR)
+        tracker.observe('stable', _updates('stable', 1, ['price']), 300, now=HOUR)
+
+        planner = FreshnessPlanner(tracker, index)
+        plan = planner.plan(['stable', 'volatile', 'new'], time_budget=1000, now=2 * HOUR)
+
+        # 从未爬取过的类目最先，变化多的类目全量爬取并加购
+        assert [i.category for i in plan] == ['new', 'volatile', 'stable']
+        assert isinf(plan[0].expected_changes)
+        assert (plan[1].pages, plan[1].cart) == (5, True)
+        assert (plan[2].pages, plan[2].cart) == (1, False)
+        assert 'max_qty' not in plan[2].fields
+
+        # 预算不够时只保留优先级高的
+        plan = planner.plan(['stable', 'volatile'], time_budget=100, now=2 * HOUR)
+        assert [i.category for i in plan] == ['volatile']
+
+
+class _Empty:
+    async def count(self) -> int:
+        return 0
+
+
+class _Price:
+    async def inner_text(self, **kwargs) -> str:
+        return '1.299,99 Lei'
+
+
+class _Card:
+    """只有链接、offer-id 和价格的产品卡片"""
+
+    def __init__(self, pnk: str):
+        self.attributes = {'data-url': f'https://www.emag.ro/x/pd/{pnk}/', 'data-offer-id': '1'}
+
+    async def get_attribute(self, name: str, **kwargs) -> str:
+        return self.attributes[name]
+
+    def locator(self, selector: str, **kwargs):
+        return _Price() if selector == 'css=p.product-new-price' else _Empty()
+
+
+class _Cards:
+    def __init__(self, cards: list[_Card]):
+        self.cards = cards
+
+    async def count(self) -> int:
+        return len(self.cards)
+
+    def nth(self, i: int) -> _Card:
+        return self.cards[i]
+
+
+class _Page:
+    def __init__(self, url: str, pnks: list[str]):
+        self.url = url
+        self.cards = _Cards([_Card(pnk) for pnk in pnks])
+        self.closed = False
+
+    def locator(self, selector: str, **kwargs) -> _Cards:
+        return self.cards
+
+    async def close(self) -> None:
+        self.closed = True
+
+
+def test_plan_without_cart_skips_add_cart(monkeypatch):
+    opened: list[_Page] = list()
+    add_cart_calls: list[int] = list()
+
+    async def open_url(context, url: str, logger, wait_until) -> _Page:
+        opened.append(_Page(url, [f'D{len(opened)}{i:07d}M' for i in range(3)]))
+        return opened[-1]
+
+    async def get_total_product_count(page) -> int:
+        return 1000
+
+    async def add_cart(page, card_div, rank: int, logger, *args) -> None:
+        add_cart_calls.append(rank)
+
+    monkeypatch.setattr(workers, 'open_category_page', open_url)
+    monkeypatch.setattr(workers, 'get_total_product_count', get_total_product_count)
+    monkeypatch.setattr(handlers, 'add_cart', add_cart)
+
+    item = CrawlPlanItem(category='laptopuri', pages=2, cart=False, expected_changes=1, estimated_duration=10)
+    worker = CategoryPageWorker(None, item.category, **item.worker_kwargs())  # type: ignore
+    result = asyncio.run(worker.start_scrape())
+
+    # 按计划爬取 2 页，只解析产品卡片，没有加购
+    assert worker.complete and len(opened) == 2 and all(p.closed for p in opened)
+    assert add_cart_calls == []
+    assert len(result) == 6 and not any(p.cart_added for p in result)
+    assert [p.rank for p in result] == [1, 2, 3, 1, 2, 3]
@@ -0,0 +1,116 @@
+"""测试不经过浏览器解析类目页 HTML，以及跳过加购阶段时 CategoryPageWorker 用 HTTP 获取类目页"""
+
+import asyncio
+
+from emag_crawler.http_fetch import parse_listing_html
+from emag_crawler.logger import logger
+from emag_crawler.workers import category_page as workers
+from emag_crawler.workers.category_page import CategoryPageWorker
+
+SOURCE_URL = 'https://www.emag.ro/bare-transversale/c'
+
+PAGINATION = (
+    '<div class="control-label js-listing-pagination">'
+    '<strong>1 - 60</strong> din <strong>1234</strong> de produse</div>'
+)
+
+
+def _card(pnk: str, offer_id: str, body: str) -> str:
+    return (
+        f'<div class="card-item card-standard js-product-data" '
+        f'data-url="https://www.emag.ro/bara-transversala/pd/{pnk}/" data-offer-id="{offer_id}">{body}</div>'
+    )
+
+
+ADD_CART = (
+    '<button class="btn yeahIWantThisProduct" data-offer-id="{0}" data-pnk="{1}">Adauga in Cos</button>'
+)
+
+NORMAL = _card(
+    'D5X4Y2BBM',
+    '100001',
+    '<div class="card-v2-badges"><span class="card-v2-badge-cmp">Top Favorite</span></div>'
+    '<span class="average-rating">4.67</span> <span class="visible-xs-inline-block">(123)</span>'
+    '<p class="product-new-price">1.234,56 Lei</p>' + ADD_CART.format('100001', 'D5X4Y2BBM'),
+)
+PROMOVAT = _card(
+    'DPROMO1BM',
+    '100002',
+    '<span class="card-v2-badge-cmp bg-light">Promovat</span>'
+    '<p class="product-new-price">10,00 Lei</p>' + ADD_CART.format('100002', 'DPROMO1BM'),
+)
+VEZI_DETALII = _card(
+    'DVEZI01BM',
+    '100003',
+    '<p class="product-new-price">20,00 Lei</p><a class="btn" href="#">Vezi detalii</a>',
+)
+# 内层的 div 和 p 没有闭合
+UNCLOSED = _card(
+    'DQ1LZ2MBM',
+    '100004',
+    '<div class="card-v2-info"><p class="product-new-price">9,99 Lei'
+    + ADD_CART.format('100004', 'DQ1LZ2MBM'),
+)
+LAST = _card(
+    'DLAST01BM',
+    '100005',
+    '<p class="product-new-price">5,50 Lei</p>' + ADD_CART.format('100005', 'DLAST01BM'),
+)
+
+
+def test_parse_listing_html():
+    html = f'<html><body>{PAGINATION}<div class="page-container">{NORMAL}{PROMOVAT}{VEZI_DETALII}{UNCLOSED}{LAST}</div></body></html>'
+    total, items = parse_listing_html(html, 'bare-transversale', SOURCE_URL, logger)
+
+    assert total == 1234
+    # Promovat 和 Vezi detalii 的卡片不计入排行
+    assert [(i.pnk, i.rank) for i in items] == [('D5X4Y2BBM', 1), ('DQ1LZ2MBM', 2), ('DLAST01BM', 3)]
+
+    normal = items[0]
+    assert normal.product_id == '100001'
+    assert normal.price == 1234.56
+    assert (normal.rating, normal.review_count, normal.is_top_favorite) == (4.67, 123, True)
+    assert normal.category == 'bare-transversale' and normal.source_url == SOURCE_URL
+
+    # 未闭合的标签不影响当前卡片和下一个卡片
+    assert items[1].price == 9.99
+    assert (items[1].rating, items[1].review_count, items[1].is_top_favorite) == (None, None, False)
+    assert items[2].price == 5.5
+
+
+def test_parse_listing_html_without_pagination():
+    # HTML 在卡片内截断
+    total, items = parse_listing_html(f'<html><body>{NORMAL[:-6]}', 'bare-transversale', SOURCE_URL, logger)
+    assert total is None
+    assert [i.pnk for i in items] == ['D5X4Y2BBM']
+
+
+class _Fetcher:
+    """每页都返回同样的 HTML 的替身 HttpListingFetcher"""
+
+    def __init__(self, html: str):
+        self.html = html
+        self.urls: list[str] = list()
+
+    async def fetch_listing(self, url: str, category: str, logger):
+        self.urls.append(url)
+        return parse_listing_html(self.html, category, url, logger)
+
+
+def test_worker_fetches_listing_over_http(monkeypatch):
+    async def open_url(*args, **kwargs):
+        raise AssertionError('跳过加购阶段时不应在浏览器中打开类目页')
+
+    monkeypatch.setattr(workers, 'open_category_page', open_url)
+
+    fetcher = _Fetcher(f'<html><body>{PAGINATION}{NORMAL}{LAST}</body></html>')
+    worker = CategoryPageWorker(None, 'bare-transversale', pages=3, skip_cart=True, listing_fetcher=fetcher)  # type: ignore
+    result = asyncio.run(worker.start_scrape())
+
+    assert worker.complete and worker.total_product_count == 1234
+    assert fetcher.urls == [
+        'https://www.emag.ro/bare-transversale/c',
+        'https://www.emag.ro/bare-transversale/p2/c',
+        'https://www.emag.ro/bare-transversale/p3/c',
+    ]
+    assert len(result) == 6 and not any(p.cart_added for p in result)
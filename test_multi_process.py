@@ -0,0 +1,45 @@
+"""测试 MultiProcessRunner 在子进程崩溃、类目出错时的重试，用不启动浏览器的替身子进程"""
+
+import os
+
+from emag_crawler.runners.multi_process import MultiProcessRunner
+
+
+def _stub_worker_main(worker_id: int, inbox, outbox, *args) -> None:
+    """按类目名决定结果：crash 让子进程直接退出，error 报告出错，其余完成"""
+    while (task := inbox.get()) is not None:
+        category, _ = task
+        if category == 'crash':
+            # 先发完已放入 outbox 的消息，避免退出时还持有 outbox 的锁
+            outbox.close()
+            outbox.join_thread()
+            os._exit(1)
+        if category == 'error':
+            outbox.put(('failed', worker_id, category, 'boom'))
+        else:
+            outbox.put(('done', worker_id, category, [], True))
+
+
+class _Runner(MultiProcessRunner):
+    worker_main = staticmethod(_stub_worker_main)
+
+
+def test_crashed_category_is_requeued():
+    runner = _Runner(['ok1', 'crash', 'error', 'ok2'], processes=1, max_restarts=5, max_category_attempts=2)
+    results = runner.run()
+
+    # 崩溃和出错的类目各尝试 max_category_attempts 次后放弃，其余类目不受影响
+    assert set(results) == {'ok1', 'ok2'} and all(runner.completes.values())
+    assert sorted(runner.failed) == ['crash', 'error']
+    assert (runner._attempts['crash'], runner._attempts['error']) == (2, 2)
+    # 每次崩溃都重启了子进程
+    assert runner._restarts == 2
+
+
+def test_max_restarts():
+    runner = _Runner(['crash', 'ok'], processes=1, max_restarts=0, max_category_attempts=3)
+    results = runner.run()
+
+    # 不能再重启时剩余的类目都算失败
+    assert results == {} and sorted(runner.failed) == ['crash', 'ok']
+    assert runner._attempts['crash'] == 1
@@ -0,0 +1,63 @@
+"""测试 ProductCardItem 的批量构造和序列化"""
+
+import pytest
+
+from emag_crawler.exceptions import ParsePNKError
+from emag_crawler.models import ProductCardItem, dump_product_cards, load_product_cards
+
+RAW = [
+    {
+        'pnk': 'D5X4Y2BBM',
+        'product_id': '100001',
+        'category': 'bare-transversale',
+        'source_url': 'https://www.emag.ro/bare-transversale/c',
+        'rank': 1,
+        'is_top_favorite': True,
+        'price': 1234.56,
+        'rating': 4.5,
+        'review_count': 12,
+        'cart_added': True,
+        'max_qty': 5,
+    },
+    {
+        'pnk': 'DQ1LZ2MBM',
+        'product_id': '100002',
+        'category': 'bare-transversale',
+        'source_url': 'https://www.emag.ro/bare-transversale/c',
+        'rank': 2,
+    },
+]
+
+
+def test_load_product_cards():
+    validated = load_product_cards(RAW)
+    assert validated == [ProductCardItem(**r) for r in RAW]
+    assert dump_product_cards(validated)[1]['max_qty'] is None
+
+    with pytest.raises(ParsePNKError):
+        load_product_cards([{**RAW[0], 'pnk': 'bad'}])
+
+
+def test_load_product_cards_trusted():
+    # 跳过验证构造的对象必须与验证构造的完全一致，pydantic 升级后改变了实例的内部结构时这里会失败
+    validated = load_product_cards(dump_product_cards(load_product_cards(RAW)))
+    trusted = load_product_cards(dump_product_cards(validated), trusted=True)
+
+    assert trusted == validated
+    for t, v in zip(trusted, validated):
+        assert type(t) is ProductCardItem
+        assert t.model_dump() == v.model_dump()
+        assert t.model_dump_json() == v.model_dump_json()
+        assert t.model_fields_set == v.model_fields_set
+        assert t.model_copy(update={'max_qty': 1}) == v.model_copy(update={'max_qty': 1})
+
+    # 修改其中一个对象不影响传入的数据
+    raw = dump_product_cards(validated)
+    trusted = load_product_cards(raw, trusted=True)
+    trusted[0].cart_added = False
+    assert raw[0]['cart_added'] is True
+    assert dump_product_cards(trusted)[1] == raw[1]
+
+    # 字段不完整时填充默认值
+    partial = load_product_cards(RAW[1:], trusted=True)
+    assert partial == validated[1:]
@@ -0,0 +1,73 @@
+"""测试浏览器配置、进程内存统计，以及 MultiProcessRunner 按配置名应用配置"""
+
+import asyncio
+from os import getpid
+from pathlib import Path
+
+import pytest
+
+from emag_crawler import profiles
+from emag_crawler.profiles import FULL_PROFILE, LEAN_PROFILE, PROFILES, _process_rss_mb
+from emag_crawler.runners.multi_process import MultiProcessRunner
+
+
+class _Context:
+    def __init__(self):
+        self.scripts: list[str] = list()
+        self.handlers: list[tuple[str, object]] = list()
+
+    async def add_init_script(self, script: str) -> None:
+        self.scripts.append(script)
+
+    def on(self, event: str, callback) -> None:
+        self.handlers.append((event, callback))
+
+
+def test_process_rss_mb(tmp_path, monkeypatch):
+    # 当前进程一定有常驻内存
+    rss = _process_rss_mb(getpid())
+    assert rss is not None and rss > 0
+
+    # 进程已退出
+    assert _process_rss_mb(2**31 - 1) is None
+
+    # VmRSS 的单位为 kB
+    proc = tmp_path / 'proc' / '42'
+    proc.mkdir(parents=True)
+    (proc / 'status').write_text('Name:\tchrome\nVmPeak:\t  999 kB\nVmRSS:\t  204800 kB\n')
+    monkeypatch.setattr(profiles, 'Path', lambda p: tmp_path / p.lstrip('/'))
+    assert _process_rss_mb(42) == 200
+
+
+def test_browser_kwargs():
+    assert FULL_PROFILE.browser_kwargs() == {'headless': False, 'args': ['--start-maximized']}
+    kwargs = LEAN_PROFILE.browser_kwargs()
+    assert kwargs['headless'] is True and '--disable-gpu' in kwargs['args']
+
+
+def test_apply(monkeypatch):
+    async def read_file(file: Path, **kwargs) -> str:
+        return file.read_text()
+
+    monkeypatch.setattr(profiles, 'read_file', read_file)
+    monkeypatch.setattr(profiles, '_js_cache', dict())
+
+    lean, full = _Context(), _Context()
+    asyncio.run(LEAN_PROFILE.apply(lean))  # type: ignore
+    asyncio.run(FULL_PROFILE.apply(full))  # type: ignore
+
+    # 精简配置注入关闭动画的脚本，并在新页面上设置视口
+    assert len(lean.scripts) == 1 and 'animation' in lean.scripts[0]
+    assert [event for event, _ in lean.handlers] == ['page']
+    # 原有的配置不修改上下文
+    assert (full.scripts, full.handlers) == ([], [])
+
+
+def test_runner_profile():
+    runner = MultiProcessRunner(['a'], browser_kwargs={'headless': False}, profile='lean')
+    # 显式传入的参数优先，上下文也应用该配置
+    assert runner.browser_kwargs == {'headless': False, 'args': list(LEAN_PROFILE.args)}
+    assert runner.lifecycle_kwargs['profile'] is PROFILES['lean']
+
+    with pytest.raises(ValueError):
+        MultiProcessRunner(['a'], profile='tiny')
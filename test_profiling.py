@@ -0,0 +1,96 @@
+"""测试 CategoryProfiler 的采样和输出，用替身代替 worker 和浏览器上下文"""
+
+import asyncio
+from pathlib import Path
+
+import pytest
+from scraper_utils.exceptions.browser_exception import PlaywrightError
+
+from emag_crawler.profiling import CategoryProfiler
+
+
+class _Tracing:
+    def __init__(self, fail_start: bool = False):
+        self.fail_start = fail_start
+        self.started: list[str] = list()
+        self.stopped: list[Path] = list()
+
+    async def start(self, title: str, **kwargs) -> None:
+        if self.fail_start:
+            raise PlaywrightError('Tracing has been already started')
+        self.started.append(title)
+
+    async def stop(self, path: Path) -> None:
+        self.stopped.append(path)
+
+
+class _Context:
+    def __init__(self, tracing: _Tracing):
+        self.tracing = tracing
+
+
+class _Worker:
+    def __init__(self, category: str, tracing: _Tracing, delay: float = 0):
+        self.category = category
+        self.context = _Context(tracing)
+        self.delay = delay
+        self.scraped = False
+
+    async def start_scrape(self) -> list:
+        await asyncio.sleep(self.delay)
+        sum(i * i for i in range(1000))
+        self.scraped = True
+        return ['item']
+
+
+def test_sampled_category(tmp_path):
+    profiler = CategoryProfiler(sample_rate=0, categories=['laptopuri'], out_dir=tmp_path)
+    tracing = _Tracing()
+    worker = _Worker('laptopuri', tracing)
+
+    assert asyncio.run(profiler.scrape(worker)) == ['item']  # type: ignore
+    assert profiler.sampled == 1 and not profiler._profiling
+
+    # cProfile 数据、摘要和 trace 使用同一个文件名
+    [prof] = tmp_path.glob('laptopuri-*.prof')
+    summary = prof.with_suffix('.txt').read_text(encoding='utf-8')
+    assert 'start_scrape' in summary and 'cumulative' in summary
+    assert tracing.started == ['laptopuri'] and tracing.stopped == [prof.with_suffix('.trace.zip')]
+
+
+def test_unsampled_category(tmp_path):
+    profiler = CategoryProfiler(sample_rate=0, out_dir=tmp_path / 'profiles')
+    tracing = _Tracing()
+    worker = _Worker('telefoane', tracing)
+
+    asyncio.run(profiler.scrape(worker))  # type: ignore
+    # 未被采样时直接爬取，不创建输出目录、不记录 trace
+    assert worker.scraped and profiler.sampled == 0
+    assert not (tmp_path / 'profiles').exists() and tracing.started == []
+
+
+def test_concurrent_and_trace_failure(tmp_path):
+    profiler = CategoryProfiler(sample_rate=1, out_dir=tmp_path)
+    slow = _Worker('slow', _Tracing(), delay=0.05)
+    # 同一个上下文已有 trace 时仍然记录 cProfile
+    busy = _Worker('busy', _Tracing(fail_start=True))
+
+    async def main() -> None:
+        task = asyncio.create_task(profiler.scrape(slow))  # type: ignore
+        await asyncio.sleep(0.01)
+        # 已有类目在分析时，新采样的类目只记录 trace
+        fast = _Worker('fast', _Tracing())
+        await profiler.scrape(fast)  # type: ignore
+        assert fast.context.tracing.stopped and not list(tmp_path.glob('fast-*.prof'))
+        await task
+        await profiler.scrape(busy)  # type: ignore
+
+    asyncio.run(main())
+    assert profiler.sampled == 3
+    assert list(tmp_path.glob('slow-*.prof')) and list(tmp_path.glob('busy-*.prof'))
+    assert busy.scraped and busy.context.tracing.stopped == []
+
+
+def test_invalid_sample_rate():
+    with pytest.raises(ValueError):
+        CategoryProfiler(sample_rate=1.5)
@@ -0,0 +1,87 @@
+"""测试 QueueRunner 对爬取结果的确认、失败、死信和租约失效的处理"""
+
+import asyncio
+from typing import Optional
+
+from emag_crawler.freshness import CrawlPlanItem
+from emag_crawler.runners.queue_runner import QueueRunner
+from emag_crawler.work_queue import SQLiteWorkQueue
+
+
+class _Worker:
+    """按类目名决定爬取结果的替身 worker"""
+
+    def __init__(self, context, category: str, **kwargs):
+        self.category = category
+        self.kwargs = kwargs
+        self.error: Optional[str] = 'boom' if category == 'error' else None
+        self.continuable = category != 'captcha'
+        self.timed_out = False
+        self.cancelled = False
+
+    @property
+    def complete(self) -> bool:
+        return self.continuable and self.error is None and not self.timed_out
+
+    async def start_scrape(self) -> list:
+        if self.category == 'slow':
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                self.cancelled = True
+                raise
+        return []
+
+
+def _run(queue: SQLiteWorkQueue, **kwargs) -> tuple[list[str], list[_Worker]]:
+    results: list[str] = list()
+    workers: list[_Worker] = list()
+
+    async def on_result(category: str, result: list, complete: bool) -> None:
+        results.append(category)
+
+    def factory(context, category: str, **kwargs) -> _Worker:
+        workers.append(_Worker(context, category, **kwargs))
+        return workers[-1]
+
+    runner = QueueRunner(queue, None, on_result, worker_factory=factory, **kwargs)  # type: ignore
+    asyncio.run(runner.run())
+    return results, workers
+
+
+def test_ack_fail_and_dead_letter(tmp_path):
+    with SQLiteWorkQueue(tmp_path / 'queue.db', max_attempts=2, max_captchas=1, retry_backoff=0) as queue:
+        queue.put(['ok', 'error', 'captcha'])
+        results, _ = _run(queue)
+
+        # 出错的类目重试到 max_attempts 次后进入死信，触发验证的类目一次就进入死信
+        assert sorted(results) == ['captcha', 'error', 'error', 'ok']
+        assert queue.stats() == {'done': 1, 'dead': 2}
+        dead = {d.category: d for d in queue.dead_letters()}
+        assert (dead['error'].attempts, dead['error'].last_error) == (2, 'boom')
+        assert dead['captcha'].captcha_count == 1
+
+
+def test_lease_lost(tmp_path):
+    with SQLiteWorkQueue(tmp_path / 'queue.db', max_attempts=1) as queue:
+        queue.put(['slow'])
+        # 租约在第一次续约前就过期，续约失败后放弃该类目，不提交结果
+        results, [worker] = _run(queue, visibility_timeout=0.01, heartbeat_interval=0.05)
+
+        assert results == [] and worker.cancelled
+        # 过期的租约计入领取次数，再次领取时进入死信
+        [dead] = queue.dead_letters()
+        assert (dead.category, dead.last_error) == ('slow', '租约多次过期')
+
+
+def test_plan_worker_kwargs(tmp_path):
+    with SQLiteWorkQueue(tmp_path / 'queue.db') as queue:
+        queue.put(['planned', 'ok'])
+        plan = [
+            CrawlPlanItem(category='planned', pages=3, cart=False, expected_changes=1, estimated_duration=1)
+        ]
+        _, workers = _run(queue, plan=plan)
+
+        # 计划中的类目按计划的页数爬取、跳过加购，不在计划中的类目用默认参数
+        kwargs = {w.category: w.kwargs for w in workers}
+        assert kwargs == {'planned': {'pages': 3, 'skip_cart': True}, 'ok': {}}
@@ -0,0 +1,73 @@
+"""测试 RetryPolicy"""
+
+import asyncio
+
+import pytest
+
+from emag_crawler.exceptions import CaptchaError, RetryableError, RetryExhaustedError
+from emag_crawler.retry import RetryPolicy, RetryStats
+
+
+def test_retry_until_success():
+    stats = RetryStats()
+    policy = RetryPolicy('op', max_attempts=3, base_delay=0.01, stats=stats)
+    calls: list[int] = list()
+
+    async def fn() -> str:
+        calls.append(1)
+        if len(calls) < 3:
+            raise RetryableError('失败')
+        return 'ok'
+
+    assert asyncio.run(policy.run(fn)) == 'ok'
+    assert stats.counters['op'] == {'attempt': 3, 'retry': 2, 'success': 1}
+
+
+def test_retry_exhausted():
+    stats = RetryStats()
+    policy = RetryPolicy('op', max_attempts=2, base_delay=0.01, stats=stats)
+
+    async def fn() -> None:
+        raise RetryableError('失败')
+
+    with pytest.raises(RetryExhaustedError) as ei:
+        asyncio.run(policy.run(fn))
+    assert ei.value.attempts == 2
+    assert stats.give_ups('op') == 1
+
+
+def test_retry_deadline_cancels_attempt():
+    stats = RetryStats()
+    policy = RetryPolicy('op', max_attempts=10, deadline=0.1, stats=stats)
+    cancelled = asyncio.Event()
+
+    async def fn() -> None:
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    async def main() -> None:
+        with pytest.raises(RetryExhaustedError):
+            await policy.run(fn)
+        assert cancelled.is_set()
+
+    asyncio.run(main())
+    assert stats.give_ups() == 1
+
+
+def test_not_retried():
+    policy = RetryPolicy('op', stats=RetryStats())
+
+    async def fn() -> None:
+        raise CaptchaError('https://www.emag.ro/', '验证')
+
+    with pytest.raises(CaptchaError):
+        asyncio.run(policy.run(fn))
+
+
+def test_backoff():
+    policy = RetryPolicy('op', base_delay=1, max_delay=4, jitter=0.5)
+    for attempt, upper in ((1, 1), (2, 2), (3, 4), (10, 4)):
+        assert upper / 2 <= policy.backoff(attempt) <= upper
@@ -0,0 +1,49 @@
+"""测试会话热启动，比较冷启动、热启动到第一个产品出现的耗时"""
+
+from asyncio import run
+
+from scraper_utils.utils.browser_util import BrowserManager, ResourceType, MS1000
+
+from emag_crawler.session import SessionStore, WarmSession
+from emag_crawler.logger import logger
+from emag_crawler.utils import build_category_url
+
+CONTEXT_KWARGS = dict(
+    abort_res_types=(ResourceType.IMAGE, ResourceType.MEDIA, ResourceType.FONT),
+    default_navigation_timeout=60 * MS1000,
+    default_timeout=60 * MS1000,
+    need_stealth=True,
+)
+
+
+async def measure(store: SessionStore, cdp_endpoint=None) -> WarmSession:
+    async with BrowserManager(
+        'C:/Program Files/Google/Chrome/Application/chrome.exe',
+        'chrome',
+        headless=False,
+        args=['--start-maximized'],
+    ) as bm:
+        session = WarmSession(bm, CONTEXT_KWARGS, store, 'test', cdp_endpoint)
+        async with session:
+            page = await session.first_product(build_category_url('bare-transversale'))
+            await page.close()
+    return session
+
+
+async def main():
+    store = SessionStore()
+    store.discard('test')
+
+    cold = await measure(store)
+    warm = await measure(store)
+    # 需要先启动 chrome --remote-debugging-port=9222
+    cdp = await measure(store, 'http://localhost:9222')
+
+    for s in (cold, warm, cdp):
+        logger.info(f'{s.mode}: 启动 {s.startup_seconds:.2f}s，第一个产品 {s.time_to_first_product:.2f}s')
+
+
+if __name__ == '__main__':
+    logger.info('程序启动')
+    run(main())
+    logger.info('程序结束')
@@ -0,0 +1,73 @@
+"""测试 SnapshotIndex"""
+
+from emag_crawler.models import ProductCardItem
+from emag_crawler.snapshot import SnapshotIndex
+from emag_crawler.storage import connect_sqlite
+
+
+def _item(pnk: str, rank: int, price: float, max_qty=None) -> ProductCardItem:
+    return ProductCardItem(
+        pnk=pnk,
+        product_id=str(rank),
+        category='bare-transversale',
+        source_url='https://www.emag.ro/bare-transversale/c',
+        rank=rank,
+        price=price,
+        max_qty=max_qty,
+    )
+
+
+def test_snapshot_index(tmp_path):
+    with SnapshotIndex(tmp_path / 'snapshot.db') as index:
+        changes = index.update(
+            'bare-transversale', [_item('D5X4Y2BBM', 1, 10.0), _item('DQ1LZ2MBM', 2, 20.0)]
+        )
+        assert [c.change for c in changes] == ['insert', 'insert']
+
+        # 没有变化时不输出
+        assert (
+            index.update('bare-transversale', [_item('D5X4Y2BBM', 1, 10.0), _item('DQ1LZ2MBM', 2, 20.0)])
+            == []
+        )
+
+        # 价格变化、产品消失
+        changes = index.update('bare-transversale', [_item('D5X4Y2BBM', 1, 12.5)])
+        assert [(c.change, c.pnk) for c in changes] == [('update', 'D5X4Y2BBM'), ('delete', 'DQ1LZ2MBM')]
+        assert changes[0].changed_fields == ['price']
+        assert changes[0].previous == {'price': 10.0}
+
+        # 未对比 max_qty 时沿用旧值
+        index.update('bare-transversale', [_item('D5X4Y2BBM', 1, 12.5, max_qty=3)])
+        assert (
+            index.update('bare-transversale', [_item('D5X4Y2BBM', 1, 12.5)], fields=('price', 'rank')) == []
+        )
+
+        # 不完整的爬取不输出消失
+        assert index.update('bare-transversale', [], complete=False) == []
+
+        # 消失后再出现视为新增
+        changes = index.update(
+            'bare-transversale', [_item('DQ1LZ2MBM', 2, 20.0), _item('D5X4Y2BBM', 1, 12.5, 3)]
+        )
+        assert [c.change for c in changes] == ['insert']
+
+        assert index.count('bare-transversale') == 2
+        assert index.compact(retention=0) == 0
+
+
+def test_snapshot_index_auto_vacuum(tmp_path):
+    # 新建的索引
+    with SnapshotIndex(tmp_path / 'snapshot.db') as index:
+        assert index.conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+        assert index.conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+
+        index.update('bare-transversale', [_item(f'PNK{i:06d}', i, 1.0) for i in range(1, 2001)])
+        index.update('bare-transversale', [])
+        assert index.compact(retention=-1) == 2000
+        # 删除后的空闲页被回收
+        assert index.conn.execute('PRAGMA freelist_count').fetchone()[0] == 0
+
+    # 不带 auto_vacuum 创建的旧索引，打开时转换
+    connect_sqlite(tmp_path / 'old.db').close()
+    with SnapshotIndex(tmp_path / 'old.db') as index:
+        assert index.conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
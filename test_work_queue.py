@@ -0,0 +1,56 @@
+"""测试 SQLiteWorkQueue"""
+
+from time import sleep
+
+import pytest
+
+from emag_crawler.exceptions import LeaseLostError
+from emag_crawler.work_queue import SQLiteWorkQueue
+
+
+def test_lease_ack(tmp_path):
+    with SQLiteWorkQueue(tmp_path / 'queue.db') as queue:
+        assert queue.put(['bare-transversale', 'acuarele', 'bare-transversale']) == 2
+
+        first = queue.lease('a')
+        second = queue.lease('b')
+        assert first is not None and second is not None
+        assert first.category != second.category
+        # 全部被领取，不会重复分配
+        assert queue.lease('c') is None
+
+        queue.ack(first)
+        with pytest.raises(LeaseLostError):
+            queue.ack(first)
+        assert queue.stats() == {'done': 1, 'leased': 1}
+
+
+def test_expired_lease_is_released(tmp_path):
+    with SQLiteWorkQueue(tmp_path / 'queue.db') as queue:
+        queue.put(['bare-transversale'])
+
+        lost = queue.lease('a', visibility_timeout=0.05)
+        sleep(0.1)
+        # 过期的租约不能续约，任务重新可见
+        with pytest.raises(LeaseLostError):
+            queue.heartbeat(lost)  # type: ignore
+
+        lease = queue.lease('b')
+        assert lease is not None and lease.attempts == 2
+        queue.heartbeat(lease)
+        queue.ack(lease)
+
+
+def test_captcha_dead_letter(tmp_path):
+    with SQLiteWorkQueue(tmp_path / 'queue.db', max_captchas=2, retry_backoff=0) as queue:
+        queue.put(['bare-transversale'])
+
+        assert queue.fail(queue.lease('a'), '触发验证', captcha=True) is False  # type: ignore
+        assert queue.fail(queue.lease('a'), '触发验证', captcha=True) is True  # type: ignore
+        assert queue.lease('a') is None
+
+        [dead] = queue.dead_letters()
+        assert (dead.category, dead.attempts, dead.captcha_count) == ('bare-transversale', 2, 2)
+
+        assert queue.requeue_dead() == 1
+        assert queue.lease('a') is not None